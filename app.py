@@ -6,7 +6,7 @@ def _ensure_deps():
     p2 = os.path.join(base_dir, 'requirements.txt')
     if os.path.exists(p1): reqs.append(p1)
     if os.path.exists(p2): reqs.append(p2)
-    names = ['flask','osmnx','networkx','folium','geopy','matplotlib','shapely']
+    names = ['flask','osmnx','networkx','requests','folium','geopy','matplotlib','shapely']
     missing = []
     for n in names:
         try:
@@ -20,7 +20,7 @@ def _ensure_deps():
         except Exception:
             subprocess.check_call([sys.executable,'-m','pip','install']+missing)
 _ensure_deps()
-from flask import Flask, render_template, jsonify, request, send_file
+from flask import Flask, render_template, jsonify, request, send_file, g, has_request_context, Response, stream_with_context
 import osmnx as ox
 import networkx as nx
 import heapq
@@ -31,11 +31,42 @@ import json
 import io
 import matplotlib
 matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import random
+from PIL import Image, ImageDraw, ImageFont
 import urllib.request
+import urllib.parse
 import urllib.error
 import threading
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import tempfile
+import csv
+import math
+import re
+import hashlib
+import gzip
+import time
+import base64
+import logging
+import itertools
+import functools
+import html
+import copy
+import sqlite3
+import unicodedata
+import bisect
+import mmap
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from array import array
+import numpy as np
+import contourpy
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # Diretórios de templates e estáticos relativos ao arquivo atual
 base_dir = os.path.dirname(os.path.abspath(os.path.realpath(__file__)))
@@ -44,96 +75,581 @@ static_dir = os.path.join(base_dir, 'static')
 
 app = Flask(__name__, template_folder=template_dir, static_folder=static_dir)
 
+# Log com níveis; caminhos quentes (busca, geometria) só registram em DEBUG
+logger = logging.getLogger('rotamarcio')
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    logger.addHandler(_handler)
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+logger.propagate = False
+
 # Configurações
 cidade_atual = "Maricá, Rio de Janeiro, Brazil"
 grafo = None
 grafo_proj = None
+motor_roteamento = None
 
-# Geocoder com configuração otimizada
-geolocator = Nominatim(user_agent="marica_routes_app_v2")
+# Estratégias de busca do GraphRouter (padrão do servidor via ROTEAMENTO_ESTRATEGIA)
+ESTRATEGIAS_BUSCA = ('dijkstra', 'bidirecional', 'astar', 'ch', 'alt')
+ESTRATEGIA_PADRAO = os.environ.get('ROTEAMENTO_ESTRATEGIA', 'dijkstra').lower()
+# Número de marcos (landmarks) do ALT; 0 desativa o pré-processamento
+ALT_MARCOS = int(os.environ.get('ALT_MARCOS', '8'))
+# Rotas alternativas (método dos platôs): quantidade máxima por requisição, custo máximo
+# acima do ótimo, sobreposição máxima e platô mínimo (ambos como fração do custo ótimo)
+ALTERNATIVAS_MAX = int(os.environ.get('ALTERNATIVAS_MAX', '3'))
+ALTERNATIVAS_ESTIRAMENTO = float(os.environ.get('ALTERNATIVAS_ESTIRAMENTO', '0.3'))
+ALTERNATIVAS_SOBREPOSICAO = float(os.environ.get('ALTERNATIVAS_SOBREPOSICAO', '0.7'))
+ALTERNATIVAS_PLATO_MIN = float(os.environ.get('ALTERNATIVAS_PLATO_MIN', '0.2'))
+RAIO_TERRA_M = 6371009
 
-# Rate limiter para evitar bloqueios
-geocode_com_rate_limit = RateLimiter(geolocator.geocode, min_delay_seconds=0.5)
-reverse_geocode_com_rate_limit = RateLimiter(geolocator.reverse, min_delay_seconds=0.5)
+# Geocoder: Nominatim público por padrão; NOMINATIM_URL aponta para outra instância
+_nominatim = urllib.parse.urlsplit(os.environ.get('NOMINATIM_URL', 'https://nominatim.openstreetmap.org'))
+geolocator = Nominatim(user_agent="marica_routes_app_v2", scheme=_nominatim.scheme or 'https',
+                       domain=_nominatim.netloc + _nominatim.path.rstrip('/'),
+                       timeout=float(os.environ.get('NOMINATIM_TIMEOUT_S', '1')))
 
-def inicializar_sistema():
-    """Inicializa o sistema com Maricá"""
-    global grafo, grafo_proj
-    try:
-        print("📍 Carregando dados de Maricá...")
-        ox.settings.log_console = False
-        mode = os.environ.get('GRAPH_MODE', 'osrm').lower()
-        if mode == 'graphml':
-            graphml_file = os.environ.get('GRAPHML_FILE') or os.path.join(base_dir, 'data', 'marica_drive.graphml')
+# Rate limiter para evitar bloqueios (a política do Nominatim público é 1 req/s)
+NOMINATIM_INTERVALO_S = float(os.environ.get('NOMINATIM_INTERVALO_S', '0.5'))
+geocode_com_rate_limit = RateLimiter(geolocator.geocode, min_delay_seconds=NOMINATIM_INTERVALO_S)
+reverse_geocode_com_rate_limit = RateLimiter(geolocator.reverse, min_delay_seconds=NOMINATIM_INTERVALO_S)
+
+def arquivo_graphml():
+    """Caminho do graphml configurado (GRAPHML_FILE ou data/marica_drive.graphml)"""
+    return os.environ.get('GRAPHML_FILE') or os.path.join(base_dir, 'data', 'marica_drive.graphml')
+
+def caminho_hierarquia(graphml_file):
+    """Artefato da Contraction Hierarchy salvo ao lado do graphml"""
+    return os.path.splitext(graphml_file)[0] + '.ch'
+
+def caminho_snapshot(graphml_file):
+    """Snapshot binário do grafo compilado (GRAPH_SNAPSHOT ou ao lado do graphml)"""
+    return os.environ.get('GRAPH_SNAPSHOT') or os.path.splitext(graphml_file)[0] + '.snap'
+
+def parametros_randomizacao(semente=None, proporcao=None):
+    """(semente, proporção) da randomização; None usa RANDOMIZAR_SEMENTE/RANDOMIZAR_ARESTAS_PROP"""
+    if semente is None:
+        semente = os.environ.get('RANDOMIZAR_SEMENTE') or None
+    if proporcao is None:
+        proporcao = os.environ.get('RANDOMIZAR_ARESTAS_PROP', '0.05')
+    return (str(semente) if semente is not None else None), float(proporcao)
+
+def origem_snapshot(graphml_file):
+    """Identifica o graphml de que um snapshot foi gerado (os pesos base não dependem da randomização)"""
+    origem = {}
+    if os.path.exists(graphml_file):
+        info = os.stat(graphml_file)
+        origem['tamanho'] = info.st_size
+        origem['mtime_ns'] = info.st_mtime_ns
+    return origem
+
+def compilar_motor(grafo, grafo_proj=None, semente=None, proporcao=None):
+    """Grafo -> motor com índice espacial, geometria achatada e o cenário de pesos padrão aplicado"""
+    motor = GrafoCompilado(grafo)
+    motor.indice_espacial = IndiceEspacial.do_grafo(motor, grafo_proj)
+    motor.geometria = GeometriaArestas.do_motor(motor)
+    motor.aplicar_cenario(CenarioPesos.gerar(motor.total_arestas, semente, proporcao))
+    return motor
+
+def construir_versao(semente=None, proporcao=None, progresso=None):
+    """
+    Carrega e compila uma versão do grafo sem tocar no estado global.
+    Retorna (grafo, grafo_proj, motor), ou None no modo osrm (sem grafo local).
+    'progresso(etapa, fração)' é chamado a cada etapa.
+    """
+    def etapa(nome, fracao):
+        if progresso is not None:
+            progresso(nome, fracao)
+
+    logger.info("📍 Carregando dados de Maricá...")
+    ox.settings.log_console = False
+    mode = os.environ.get('GRAPH_MODE', 'osrm').lower()
+    graphml_file = None
+    grafo_novo, proj_novo, motor = None, None, None
+    if mode == 'graphml':
+        graphml_file = arquivo_graphml()
+        etapa('snapshot', 0.05)
+        # Snapshot dispensa o networkx: grafo/grafo_proj ficam vazios
+        motor = carregar_snapshot(caminho_snapshot(graphml_file), graphml_file, semente, proporcao)
+        if motor is None:
             if not os.path.exists(graphml_file):
                 url = os.environ.get('GRAPHML_URL')
                 if url:
+                    etapa('download', 0.05)
                     os.makedirs(os.path.dirname(graphml_file), exist_ok=True)
                     urllib.request.urlretrieve(url, graphml_file)
-            grafo = ox.load_graphml(graphml_file)
-            grafo_proj = ox.project_graph(grafo)
-        elif mode == 'osm':
-            place = os.environ.get('OSM_PLACE', cidade_atual)
-            net = os.environ.get('OSM_NETWORK', 'drive')
-            grafo = ox.graph_from_place(place, network_type=net)
-            grafo_proj = ox.project_graph(grafo)
-        else:
-            return True
-        
-        randomizar_pesos_grafo(grafo)
-        proporcao = float(os.environ.get('RANDOMIZAR_ARESTAS_PROP', '0.05'))
-        randomizar_arestas_estrutura(grafo, proporcao)
-        
-        print(f"✅ Sucesso! {len(grafo.nodes())} nós, {len(grafo.edges())} arestas")
-        return True
-    except Exception as e:
-        print(f"❌ Erro ao carregar Maricá: {e}")
-        return False
+            etapa('graphml', 0.1)
+            grafo_novo = ox.load_graphml(graphml_file)
+            etapa('projecao', 0.4)
+            proj_novo = ox.project_graph(grafo_novo)
+    elif mode == 'osm':
+        place = os.environ.get('OSM_PLACE', cidade_atual)
+        net = os.environ.get('OSM_NETWORK', 'drive')
+        etapa('osm', 0.1)
+        grafo_novo = ox.graph_from_place(place, network_type=net)
+        etapa('projecao', 0.4)
+        proj_novo = ox.project_graph(grafo_novo)
+    else:
+        return None
+    
+    if motor is None:
+        etapa('compilacao', 0.6)
+        motor = compilar_motor(grafo_novo, proj_novo, semente, proporcao)
+    if graphml_file:
+        etapa('hierarquia', 0.8)
+        carregar_hierarquia(motor, caminho_hierarquia(graphml_file))
+    if ALT_MARCOS <= 0:
+        motor.alt = None
+    elif motor.alt is None:
+        etapa('alt', 0.85)
+        alt = MarcosALT.construir(motor, peso=PESO_PREPROCESSAMENTO, quantidade=ALT_MARCOS)
+        motor.alt = alt
+        logger.info("✅ ALT: %d marcos em %.1fs (%.1f MB)", len(alt.marcos), alt.tempo_construcao_s, alt.memoria_bytes() / 1e6)
+    
+    logger.info("✅ Sucesso! %d nós, %d arestas", motor.estatisticas['total_nos'], motor.estatisticas['total_arestas'])
+    return grafo_novo, proj_novo, motor
+
+class GerenciadorGrafo:
+    """
+    Dono da versão atual do grafo. Cargas são single-flight (quem pede durante
+    uma carga recebe o mesmo Future) e a versão nova é montada fora do estado
+    global; a troca é uma única atribuição sob lock. Cada requisição fixa o
+    motor no início (motor_atual), então requisições em andamento terminam na
+    versão em que começaram.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._carga = None
+        self.estado = 'vazio'
+        self.etapa = None
+        self.progresso = 0.0
+        self.erro = None
+        self.erro_ultima_carga = None
+        self.inicio_carga = None
+        self.parametros = None
+        self.trocas = 0
+
+    @property
+    def carregando(self):
+        return self._carga is not None
+
+    def carregar(self, semente=None, proporcao=None, esperar=True):
+        """
+        Inicia uma carga (ou se junta à que está em andamento).
+        Com esperar=True roda na thread atual e retorna True/False; senão roda em
+        segundo plano e retorna (Future, iniciada_agora).
+        """
+        with self._lock:
+            futuro = self._carga
+            iniciar = futuro is None
+            if iniciar:
+                futuro = self._carga = Future()
+                # Numa recarga a versão atual continua atendendo; o estado só muda na troca
+                if not self._versao_no_ar():
+                    self.estado = 'carregando'
+                self.etapa, self.progresso, self.erro = 'inicio', 0.0, None
+                self.inicio_carga = time.time()
+                self.parametros = {'semente': semente, 'proporcao': proporcao}
+        if iniciar:
+            if esperar:
+                self._executar(futuro, semente, proporcao)
+            else:
+                threading.Thread(target=self._executar, args=(futuro, semente, proporcao), daemon=True).start()
+        if esperar:
+            return futuro.result()
+        return futuro, iniciar
+
+    def _progresso(self, etapa, fracao):
+        self.etapa, self.progresso = etapa, fracao
+
+    def _versao_no_ar(self):
+        return self.estado in ('pronto', 'osrm')
+
+    def _executar(self, futuro, semente, proporcao):
+        sucesso = False
+        try:
+            versao = construir_versao(semente, proporcao, self._progresso)
+            self._trocar(versao)
+            sucesso = True
+        except Exception as e:
+            logger.exception("❌ Erro ao carregar Maricá: %s", e)
+            with self._lock:
+                # Falha numa recarga não derruba a versão que já está atendendo
+                if not self._versao_no_ar():
+                    self.estado, self.erro = 'erro', str(e)
+                self.etapa, self.erro_ultima_carga = None, str(e)
+        finally:
+            with self._lock:
+                self._carga = None
+            futuro.set_result(sucesso)
+        if sucesso and versao is not None and GRAFO_TILES_PRE_NIVEIS >= 0:
+            try:
+                threading.Thread(target=pre_renderizar_malha, args=(versao[2],), daemon=True).start()
+            except RuntimeError as e:
+                logger.warning("⚠️ Pré-renderização da malha não iniciada: %s", e)
+
+    def _trocar(self, versao):
+        global grafo, grafo_proj, motor_roteamento
+        with self._lock:
+            if versao is None:
+                self.estado = 'osrm'
+            else:
+                grafo, grafo_proj, motor_roteamento = versao
+                self.estado = 'pronto'
+                self.trocas += 1
+            self.etapa, self.progresso, self.erro_ultima_carga = None, 1.0, None
+        # Entradas antigas já não casam (a versão faz parte da chave); só libera memória
+        cache_rotas.limpar()
+        cache_isocronas.limpar()
+        cache_tiles.limpar()
+
+    def status(self):
+        with self._lock:
+            return {
+                'estado': self.estado,
+                'etapa': self.etapa,
+                'progresso': round(self.progresso, 2),
+                'erro': self.erro,
+                'erro_ultima_carga': self.erro_ultima_carga,
+                'em_andamento': self._carga is not None,
+                'tempo_carga_s': round(time.time() - self.inicio_carga, 2) if self.inicio_carga else None,
+                'parametros': self.parametros,
+                'trocas': self.trocas
+            }
+
+gerenciador_grafo = GerenciadorGrafo()
+
+def inicializar_sistema(semente=None, proporcao=None):
+    """Inicializa (ou recarrega) o sistema com Maricá; chamadas simultâneas compartilham a mesma carga"""
+    return gerenciador_grafo.carregar(semente, proporcao)
+
+def motor_atual():
+    """Motor fixado no início da requisição; fora de uma requisição, a versão atual"""
+    if has_request_context():
+        return g.get('motor', motor_roteamento)
+    return motor_roteamento
+
+def interpretar_cenario(pedido):
+    """
+    (semente, proporcao) do campo 'cenario' de uma requisição: uma semente (número
+    ou texto) ou {'semente', 'proporcao'}; None sem o campo. Levanta ValueError se inválido.
+    """
+    if pedido is None:
+        return None
+    if isinstance(pedido, dict):
+        semente, proporcao = pedido.get('semente'), pedido.get('proporcao')
+    else:
+        semente, proporcao = pedido, None
+    if isinstance(semente, bool) or not isinstance(semente, (int, str)) or not str(semente).strip():
+        raise ValueError('Cenário inválido: informe a semente (número ou texto)')
+    if proporcao is not None:
+        proporcao = float(proporcao)
+        if not 0.0 <= proporcao <= 1.0:
+            raise ValueError('Cenário inválido: proporcao deve estar entre 0 e 1')
+    return str(semente).strip(), proporcao
+
+def fixar_cenario(dados):
+    """
+    Fixa em g.motor a visão do cenário pedido no campo 'cenario' da requisição.
+    Sem o campo mantém o cenário padrão. Levanta ValueError se o cenário for inválido.
+    """
+    cenario = interpretar_cenario((dados or {}).get('cenario'))
+    motor = motor_atual()
+    if cenario is None or motor is None:
+        return motor
+    g.motor = motor.para_cenario(*cenario)
+    return g.motor
+
+def descrever_cenario(motor):
+    """Semente/proporção e bloqueios do cenário do motor (para as respostas da API)"""
+    cenario = motor.cenario if motor is not None else None
+    if cenario is None:
+        return None
+    return {'semente': cenario.semente, 'proporcao': cenario.proporcao, 'arestas_bloqueadas': cenario.total_bloqueadas}
 
 INIT_GRAPH_ON_START = os.environ.get('INIT_GRAPH_ON_START', 'false').lower() == 'true'
 
 @app.before_request
 def _lazy_init():
     try:
-        global grafo
         mode = os.environ.get('GRAPH_MODE', 'osrm').lower()
-        if grafo is None and not getattr(app, '_init_attempted', False) and mode != 'osrm':
-            app._init_attempted = True
-            ok = inicializar_sistema()
-            if not ok:
-                app._init_attempted = False
+        # /health e /metrics nunca esperam a carga (reportam o progresso)
+        if (motor_roteamento is None and mode != 'osrm' and not gerenciador_grafo.carregando
+                and request.endpoint not in ('health', 'metrics')):
+            inicializar_sistema()
     except Exception:
-        app._init_attempted = False
+        logger.exception("Erro na inicialização sob demanda")
 
-def randomizar_pesos_grafo(grafo):
-    """Aplica randomização nos pesos das arestas conforme requisitos acadêmicos"""
-    print("🔢 Aplicando randomização nos pesos das arestas...")
-    
-    for origem, destino, chave, dados in grafo.edges(keys=True, data=True):
-        # Randomizar o comprimento original (±20% de variação)
-        comprimento_original = dados.get('length', 100)
-        fator_randomico = random.uniform(0.8, 1.2)
-        novo_comprimento = comprimento_original * fator_randomico
-        
-        # Atualizar os dados da aresta
-        grafo[origem][destino][chave]['length'] = novo_comprimento
-        grafo[origem][destino][chave]['length_original'] = comprimento_original
-        grafo[origem][destino][chave]['fator_randomico'] = fator_randomico
-    
-def randomizar_arestas_estrutura(grafo, proporcao=0.05):
-    total = grafo.number_of_edges()
-    alvo = max(1, int(total * proporcao))
-    todas = list(grafo.edges(keys=True))
-    random.shuffle(todas)
-    selecionadas = todas[:alvo]
-    for o, d, k in selecionadas:
-        grafo[o][d][k]['disabled'] = True
+@app.before_request
+def _fixar_motor():
+    g.motor = motor_roteamento
+
+class Metricas:
+    """Histogramas de latência em memória, expostos no formato texto do Prometheus"""
+    LIMITES = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histogramas = {}
+        self._descricoes = {}
+
+    def descrever(self, nome, descricao):
+        self._descricoes[nome] = descricao
+
+    def observar(self, nome, valor, **rotulos):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self._lock:
+            h = self._histogramas.get(chave)
+            if h is None:
+                h = self._histogramas[chave] = [[0] * len(self.LIMITES), 0, 0.0]
+            for i, limite in enumerate(self.LIMITES):
+                if valor <= limite:
+                    h[0][i] += 1
+            h[1] += 1
+            h[2] += valor
+
+    def texto_prometheus(self):
+        with self._lock:
+            itens = sorted((k, ([*v[0]], v[1], v[2])) for k, v in self._histogramas.items())
+        linhas = []
+        ultimo = None
+        for (nome, rotulos), (baldes, total, soma) in itens:
+            if nome != ultimo:
+                linhas.append(f"# HELP {nome} {self._descricoes.get(nome, nome)}")
+                linhas.append(f"# TYPE {nome} histogram")
+                ultimo = nome
+            base = ','.join(f'{k}="{v}"' for k, v in rotulos)
+            sep = ',' if base else ''
+            for limite, contagem in zip(self.LIMITES, baldes):
+                linhas.append(f'{nome}_bucket{{{base}{sep}le="{limite}"}} {contagem}')
+            linhas.append(f'{nome}_bucket{{{base}{sep}le="+Inf"}} {total}')
+            linhas.append(f'{nome}_sum{{{base}}} {soma}')
+            linhas.append(f'{nome}_count{{{base}}} {total}')
+        return '\n'.join(linhas) + '\n'
+
+metricas = Metricas()
+metricas.descrever('rotamarcio_requisicao_segundos', 'Latência das requisições HTTP por endpoint')
+metricas.descrever('rotamarcio_etapa_segundos', 'Latência por etapa (snap, busca, geometria, serializacao)')
+
+@contextmanager
+def cronometro(etapa, **rotulos):
+    """Mede a duração do bloco e registra no histograma da etapa"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        metricas.observar('rotamarcio_etapa_segundos', time.perf_counter() - inicio, etapa=etapa, **rotulos)
+
+@app.before_request
+def _iniciar_cronometro():
+    request.environ['rotamarcio.inicio'] = time.perf_counter()
+
+@app.after_request
+def _registrar_latencia(resposta):
+    inicio = request.environ.get('rotamarcio.inicio')
+    if inicio is not None:
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'desconhecido'
+        metricas.observar('rotamarcio_requisicao_segundos', time.perf_counter() - inicio, endpoint=endpoint)
+    return resposta
+
+# Respostas JSON grandes saem comprimidas (brotli se instalado, senão gzip) quando o cliente aceita
+COMPRESSAO_MIN_BYTES = int(os.environ.get('COMPRESSAO_MIN_BYTES', '1024'))
+
+@app.after_request
+def _comprimir_resposta(resposta):
+    if (resposta.is_streamed or resposta.direct_passthrough or resposta.mimetype != 'application/json'
+            or 'Content-Encoding' in resposta.headers or not 200 <= resposta.status_code < 300):
+        return resposta
+    corpo = resposta.get_data()
+    if len(corpo) < COMPRESSAO_MIN_BYTES:
+        return resposta
+    aceitas = request.accept_encodings
+    with cronometro('compressao'):
+        if brotli is not None and aceitas['br']:
+            resposta.set_data(brotli.compress(corpo, quality=4))
+            resposta.headers['Content-Encoding'] = 'br'
+        elif aceitas['gzip']:
+            resposta.set_data(gzip.compress(corpo, compresslevel=5))
+            resposta.headers['Content-Encoding'] = 'gzip'
+        else:
+            return resposta
+    resposta.vary.add('Accept-Encoding')
+    return resposta
+
+class CenarioPesos:
+    """
+    Cenário de randomização como overlay sobre os pesos base imutáveis do motor:
+    um multiplicador float32 por aresta (±20%) e uma máscara de bloqueios de
+    1 bit por aresta, gerados com NumPy a partir da semente. Ocupa ~4,1 bytes
+    por aresta, então muitos cenários convivem em memória; com semente definida
+    o resultado é reprodutível (permite reaproveitar CH e ALT pré-processados).
+    """
+    VARIACAO = (0.8, 1.2)
+
+    def __init__(self, semente, proporcao, multiplicadores, bloqueios):
+        self.semente = semente
+        self.proporcao = proporcao
+        self.multiplicadores = multiplicadores
+        self.bloqueios = bloqueios
+        self.total_bloqueadas = int(np.unpackbits(bloqueios).sum())
+
+    @classmethod
+    def gerar(cls, total_arestas, semente=None, proporcao=None):
+        """Cenário para a semente/proporção (None usa RANDOMIZAR_SEMENTE/RANDOMIZAR_ARESTAS_PROP)"""
+        semente, proporcao = parametros_randomizacao(semente, proporcao)
+        rng = np.random.default_rng(cls.semente_numerica(semente))
+        multiplicadores = rng.uniform(*cls.VARIACAO, total_arestas).astype(np.float32)
+        alvo = min(total_arestas, max(1, int(total_arestas * proporcao))) if proporcao > 0 else 0
+        marcadas = np.zeros(total_arestas, dtype=bool)
+        marcadas[rng.choice(total_arestas, alvo, replace=False)] = True
+        # Mesmo layout da bitmask do motor: bit (e & 7) do byte (e >> 3)
+        bloqueios = np.packbits(marcadas, bitorder='little')
+        return cls(semente, proporcao, multiplicadores, bloqueios)
+
+    @staticmethod
+    def semente_numerica(semente):
+        """Semente inteira para o gerador; textos não numéricos viram um hash estável (None: aleatória)"""
+        if semente is None:
+            return None
+        try:
+            return int(semente)
+        except ValueError:
+            return int.from_bytes(hashlib.sha1(str(semente).encode('utf-8')).digest()[:8], 'little')
+
+    @property
+    def chave(self):
+        return (self.semente, self.proporcao)
+
+    def memoria_bytes(self):
+        return self.multiplicadores.nbytes + self.bloqueios.nbytes
+
+    def aplicar(self, pesos_base, desabilitadas_base):
+        """(pesos, bitmask de bloqueios) do cenário sobre os arrays base"""
+        pesos = np.frombuffer(pesos_base, dtype=np.float64) * self.multiplicadores
+        mascara = np.frombuffer(desabilitadas_base, dtype=np.uint8) | self.bloqueios
+        return array('d', pesos.tobytes()), bytearray(mascara.tobytes())
+
+_contador_versoes = itertools.count(1)
+
+CENARIOS_MAX = int(os.environ.get('CENARIOS_MAX', '256'))
+CENARIOS_MAX_ATIVOS = int(os.environ.get('CENARIOS_MAX_ATIVOS', '8'))
+
+# Perfis de deslocamento no grafo local: velocidade típica por classe de via (km/h),
+# limite de velocidade do modo e classes proibidas. O carro usa o maxspeed quando informado.
+VELOCIDADES_VIA_KMH = {
+    'motorway': 80.0, 'motorway_link': 50.0, 'trunk': 60.0, 'trunk_link': 40.0,
+    'primary': 50.0, 'primary_link': 35.0, 'secondary': 40.0, 'secondary_link': 30.0,
+    'tertiary': 35.0, 'tertiary_link': 25.0, 'unclassified': 30.0, 'residential': 25.0,
+    'living_street': 10.0, 'service': 15.0, 'track': 15.0, 'road': 30.0
+}
+VELOCIDADE_VIA_PADRAO_KMH = 30.0
+PERFIS_MODO = {
+    'driving': {'velocidade_max_kmh': None, 'proibidas': ()},
+    'walking': {'velocidade_max_kmh': 5.0, 'proibidas': ('motorway', 'motorway_link', 'trunk', 'trunk_link')},
+    'cycling': {'velocidade_max_kmh': 15.0, 'proibidas': ('motorway', 'motorway_link')}
+}
+# Peso dos pré-processamentos (CH e ALT). As rotas da API minimizam o tempo do modo
+# (driving por padrão); com outro peso, 'ch' e 'alt' caem para bidirecional e A*
+PESO_PREPROCESSAMENTO = os.environ.get('PESO_PREPROCESSAMENTO', 'tempo_driving')
+
+def velocidade_maxima_kmh(valor):
+    """maxspeed do OSM em km/h (média quando há vários valores); 0 se ausente ou não numérico"""
+    numeros = []
+    for item in (valor if isinstance(valor, list) else [valor]):
+        texto = str(item or '').strip().lower()
+        numero = re.match(r'\d+(\.\d+)?', texto)
+        if numero:
+            numeros.append(float(numero.group()) * (1.609344 if texto.endswith('mph') else 1.0))
+    return sum(numeros) / len(numeros) if numeros else 0.0
+
+def velocidades_modo(modo, classes_via, classes, velocidades_max):
+    """(velocidades em m/s float32, bitmask de arestas inacessíveis) do modo, vetorizado sobre as arestas"""
+    perfil = PERFIS_MODO[modo]
+    tabela = np.array([VELOCIDADES_VIA_KMH.get(c, VELOCIDADE_VIA_PADRAO_KMH) for c in classes_via], dtype=np.float32)
+    proibidas = np.array([c in perfil['proibidas'] for c in classes_via], dtype=bool)
+    classes = np.frombuffer(classes, dtype=np.uint8)
+    maximas = np.frombuffer(velocidades_max, dtype=np.float32)
+    kmh = np.where(maximas > 0, maximas, tabela[classes])
+    if perfil['velocidade_max_kmh'] is not None:
+        kmh = np.minimum(kmh, perfil['velocidade_max_kmh'])
+    return (kmh / 3.6).astype(np.float32), np.packbits(proibidas[classes], bitorder='little')
+
+def peso_do_modo(modo):
+    """Peso da busca para o modo: tempo de viagem em segundos ('tempo_<modo>'); None usa a distância"""
+    if modo is None:
+        return 'length'
+    if modo not in PERFIS_MODO:
+        raise ValueError(f"Modo inválido: {modo} (use {', '.join(PERFIS_MODO)})")
+    return f'tempo_{modo}'
+
+class CacheRotas:
+    """
+    Cache LRU com TTL dos resultados de obter_rota_por_geometria.
+    A memória é limitada pelo total de coordenadas guardadas, não pelo número de entradas;
+    'medir' conta as coordenadas de um resultado (padrão: len(resultado['caminho'])).
+    """
+    def __init__(self, max_coordenadas=500000, ttl_s=600.0, medir=None):
+        self.max_coordenadas = max_coordenadas
+        self.ttl_s = ttl_s
+        self.medir = medir or (lambda resultado: len(resultado.get('caminho') or ()))
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()
+        self.coordenadas = 0
+        self.hits = 0
+        self.misses = 0
+
+    def obter(self, chave):
+        with self._lock:
+            item = self._entradas.get(chave)
+            if item is not None and time.monotonic() - item[0] > self.ttl_s:
+                self._remover(chave)
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._entradas.move_to_end(chave)
+            self.hits += 1
+            return dict(item[1])
+
+    def guardar(self, chave, resultado):
+        tamanho = self.medir(resultado)
+        if tamanho > self.max_coordenadas:
+            return
+        with self._lock:
+            if chave in self._entradas:
+                self._remover(chave)
+            self._entradas[chave] = (time.monotonic(), dict(resultado), tamanho)
+            self.coordenadas += tamanho
+            while self.coordenadas > self.max_coordenadas and self._entradas:
+                self._remover(next(iter(self._entradas)))
+
+    def _remover(self, chave):
+        _, _, tamanho = self._entradas.pop(chave)
+        self.coordenadas -= tamanho
+
+    def limpar(self):
+        with self._lock:
+            self._entradas.clear()
+            self.coordenadas = 0
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entradas': len(self._entradas),
+                'coordenadas': self.coordenadas,
+                'max_coordenadas': self.max_coordenadas
+            }
+
+cache_rotas = CacheRotas(int(os.environ.get('ROTA_CACHE_MAX_COORDS', '500000')),
+                         float(os.environ.get('ROTA_CACHE_TTL_S', '600')))
 def dijkstra_customizado(grafo, origem_no, destino_no, peso='length'):
     """
     Implementação customizada do algoritmo de Dijkstra com heapq
     Conforme requisitos acadêmicos do projeto
     """
-    print(f"🔍 Calculando rota com Dijkstra customizado: {origem_no} → {destino_no}")
+    logger.debug("🔍 Calculando rota com Dijkstra customizado: %s → %s", origem_no, destino_no)
     
     # Inicializar distâncias e nós anteriores
     distancias = {no: float('inf') for no in grafo.nodes()}
@@ -192,118 +708,2155 @@ def dijkstra_customizado(grafo, origem_no, destino_no, peso='length'):
     
     caminho.reverse()
     
-    print(f"✅ Rota encontrada: {len(caminho)} nós, {distancia_total:.1f} metros")
+    logger.debug("✅ Rota encontrada: %d nós, %.1f metros", len(caminho), distancia_total)
     return caminho, distancia_total
 
-def obter_rota_por_geometria(origem_no, destino_no):
-    """Obtém rota seguindo exatamente a geometria das vias OSM usando Dijkstra customizado"""
+def obter_rota_por_geometria(origem_no, destino_no, estrategia=None, modo=None):
+    """
+    Obtém rota seguindo exatamente a geometria das vias OSM (com cache por nós e versão do grafo).
+    Com 'modo' a busca minimiza o tempo de viagem do perfil do modo; sem ele, a distância.
+    """
     try:
-        # Usar implementação customizada de Dijkstra em vez de nx.shortest_path
-        caminho, distancia_total = dijkstra_customizado(grafo, origem_no, destino_no, 'length')
-        
-        if not caminho:
-            return {'sucesso': False, 'erro': 'Não foi possível encontrar caminho'}
-        
-        # Coletar todas as coordenadas da geometria das arestas
-        coordenadas_completas = []
-        
-        print(f"=== Processando caminho com {len(caminho)} nós ===")
-        
-        for i in range(len(caminho) - 1):
-            no_origem = caminho[i]
-            no_destino = caminho[i + 1]
-            
-            # Obter dados da aresta
-            aresta = grafo[no_origem][no_destino][0]
-            
-            print(f"Processando aresta {no_origem} -> {no_destino}")
-            print(f"Tem geometria: {'geometry' in aresta}")
-            
-            # Se houver geometria, usar as coordenadas exatas
-            if 'geometry' in aresta:
-                coords = list(aresta['geometry'].coords)
-                print(f"Coordenadas da geometria: {len(coords)} pontos")
-                print(f"Primeiras coordenadas: {coords[:2] if coords else 'vazio'}")
-                
-                # Converter de (lng, lat) para (lat, lng) para Leaflet
-                coords_convertidas = [(lat, lng) for lng, lat in coords]
-                
-                # Evitar duplicação de pontos
-                if coordenadas_completas and coords_convertidas[0] == coordenadas_completas[-1]:
-                    coords_convertidas = coords_convertidas[1:]
-                coordenadas_completas.extend(coords_convertidas)
+        motor = motor_atual()
+        if motor is None or motor.geometria is None:
+            return {'sucesso': False, 'erro': 'Grafo local não compilado'}
+        estrategia = normalizar_estrategia(estrategia)
+        peso = peso_do_modo(modo)
+        chave = (origem_no, destino_no, peso, motor.estrategia_efetiva(estrategia, peso), motor.versao)
+        resultado = cache_rotas.obter(chave)
+        if resultado is not None:
+            resultado['cache'] = True
+        else:
+            resultado = _obter_rota_por_geometria(motor, origem_no, destino_no, estrategia, peso)
+            if resultado['sucesso']:
+                cache_rotas.guardar(chave, resultado)
+        return resultado
+    except Exception as e:
+        logger.exception("Erro ao obter rota por geometria: %s", e)
+        return {'sucesso': False, 'erro': str(e)}
+
+def _obter_rota_por_geometria(motor, origem_no, destino_no, estrategia, peso='length'):
+    # Busca sobre o grafo compilado (dijkstra, bidirecional, A*, CH ou ALT)
+    busca = GraphRouter(motor.grafo, motor).search(origem_no, destino_no, peso, estrategia)
+    caminho = busca['caminho']
+    if peso == 'length':
+        distancia_total, tempo_total = busca['distancia'], None
+    else:
+        distancia_total, tempo_total = motor.comprimento(busca['arestas']), busca['distancia']
+    
+    if not caminho:
+        return {'sucesso': False, 'erro': 'Não foi possível encontrar caminho'}
+    
+    # Geometria pré-computada das arestas, já em (lat, lng) para o Leaflet
+    with cronometro('geometria'):
+        coords = motor.geometria.montar(busca['arestas'])
+        pares = GeometriaArestas.pares(coords)
+    logger.debug("Rota %s -> %s: %d arestas, %d coordenadas", origem_no, destino_no, len(busca['arestas']), len(pares))
+    
+    return {
+        'sucesso': True,
+        'caminho': pares,
+        'distancia': distancia_total,
+        'tempo_s': tempo_total,
+        'nos_count': len(caminho),
+        'nos_assentados': busca['nos_assentados'],
+        'estrategia': busca['estrategia'],
+        'cache': False
+    }
+
+class GrafoCompilado:
+    """
+    Grafo compilado em arrays (CSR) para consultas de caminho mínimo.
+    Construído uma vez após a carga/randomização; os nós viram inteiros
+    (na ordem dos ids OSM, preservando o desempate da fila de prioridade),
+    e as arestas ficam em offsets/alvos/pesos contíguos. Assim como em
+    dijkstra_customizado, cada par (u, v) usa a primeira aresta paralela.
+    """
+    def __init__(self, grafo):
+        self.grafo = grafo
+        try:
+            nos = sorted(grafo.nodes())
+        except TypeError:
+            nos = list(grafo.nodes())
+        self.nos = nos
+        self.indice = {no: i for i, no in enumerate(nos)}
+        self.offsets = array('l', [0])
+        self.alvos = array('l')
+        self.origens = array('l')
+        self.chaves = []
+        desabilitadas = []
+        # Nomes (name, depois ref) por aresta: tabela de textos + CSR de índices
+        self.rotulos = []
+        self.rotulos_offsets = array('l', [0])
+        self.rotulos_ids = array('l')
+        ids_rotulos = {}
+        # Classe da via (highway, índice em classes_via) e maxspeed em km/h (0 se ausente) por aresta
+        self.classes_via = ['']
+        self.classes = array('B')
+        self.velocidades_max = array('f')
+        ids_classes = {'': 0}
+        for i, no in enumerate(nos):
+            for vizinho, dados_aresta in grafo.adj[no].items():
+                if not dados_aresta:
+                    continue
+                chave, info_aresta = next(iter(dados_aresta.items()))
+                self.origens.append(i)
+                self.alvos.append(self.indice[vizinho])
+                self.chaves.append(chave)
+                desabilitadas.append(bool(info_aresta.get('disabled')))
+                classe = info_aresta.get('highway')
+                classe = str((classe[0] if classe else '') if isinstance(classe, list) else (classe or ''))
+                if classe not in ids_classes:
+                    ids_classes[classe] = len(self.classes_via)
+                    self.classes_via.append(classe)
+                self.classes.append(ids_classes[classe])
+                self.velocidades_max.append(velocidade_maxima_kmh(info_aresta.get('maxspeed')))
+                for atributo in ('name', 'ref'):
+                    valores = info_aresta.get(atributo)
+                    for valor in (valores if isinstance(valores, list) else [valores]):
+                        if valor:
+                            valor = str(valor)
+                            if valor not in ids_rotulos:
+                                ids_rotulos[valor] = len(self.rotulos)
+                                self.rotulos.append(valor)
+                            self.rotulos_ids.append(ids_rotulos[valor])
+                self.rotulos_offsets.append(len(self.rotulos_ids))
+            self.offsets.append(len(self.alvos))
+        self.total_nos = len(nos)
+        self.total_arestas = len(self.alvos)
+        self.lat = array('d', (float(grafo.nodes[no]['y']) for no in nos))
+        self.lng = array('d', (float(grafo.nodes[no]['x']) for no in nos))
+        self.lat_rad = array('d', map(math.radians, self.lat))
+        self.lng_rad = array('d', map(math.radians, self.lng))
+        self.cos_lat = array('d', map(math.cos, self.lat_rad))
+        # CSR reverso (arestas de entrada por nó) para a busca no sentido do destino
+        contagem = [0] * (self.total_nos + 1)
+        for v in self.alvos:
+            contagem[v + 1] += 1
+        for i in range(self.total_nos):
+            contagem[i + 1] += contagem[i]
+        self.offsets_rev = array('l', contagem)
+        self.arestas_rev = array('l', [0]) * self.total_arestas
+        proximo = contagem[:-1]
+        for e, v in enumerate(self.alvos):
+            self.arestas_rev[proximo[v]] = e
+            proximo[v] += 1
+        # Bitmask de arestas desabilitadas (1 bit por aresta)
+        self.desabilitadas = bytearray((self.total_arestas + 7) // 8)
+        for e, flag in enumerate(desabilitadas):
+            if flag:
+                self.desabilitadas[e >> 3] |= 1 << (e & 7)
+        self.estatisticas = {
+            'total_nos': grafo.number_of_nodes(),
+            'total_arestas': grafo.number_of_edges(),
+            'arestas_randomizadas': 0,
+            'arestas_bloqueadas': sum(map(int.bit_count, self.desabilitadas))
+        }
+        self.versao = next(_contador_versoes)
+        self._inicializar_estado()
+        # Pesos e bloqueios do graphml, nunca alterados; cenários são overlays sobre eles
+        self.pesos_base = self.pesos('length')
+        self.desabilitadas_base = self.desabilitadas
+
+    @classmethod
+    def do_snapshot(cls, cabecalho, arrays):
+        """Motor sobre os arrays mapeados de um SnapshotGrafo (sem networkx)"""
+        motor = cls.__new__(cls)
+        motor.grafo = None
+        motor.nos = arrays['nos'].tolist()
+        motor.indice = {no: i for i, no in enumerate(motor.nos)}
+        for nome in ('offsets', 'alvos', 'origens', 'offsets_rev', 'arestas_rev', 'lat', 'lng',
+                     'lat_rad', 'lng_rad', 'cos_lat', 'rotulos_offsets', 'rotulos_ids', 'classes', 'velocidades_max'):
+            setattr(motor, nome, arrays[nome])
+        motor.chaves = None
+        motor.total_nos = len(motor.nos)
+        motor.total_arestas = len(motor.alvos)
+        motor.rotulos = cabecalho['rotulos']
+        motor.classes_via = cabecalho['classes_via']
+        motor.estatisticas = cabecalho['estatisticas']
+        motor.versao = next(_contador_versoes)
+        motor._inicializar_estado()
+        motor.pesos_base = motor._pesos['length'] = arrays['pesos_base']
+        motor.desabilitadas_base = motor.desabilitadas = arrays['desabilitadas_base']
+        return motor
+
+    def _inicializar_estado(self):
+        self._raiz = self
+        self._pesos = {}
+        self._fatores_heuristica = {}
+        self.cenario = None
+        self._cenarios = OrderedDict()
+        self._visoes = OrderedDict()
+        self._lock_cenarios = threading.Lock()
+        self._geodesicas = None
+        self._perfis_modo = {}
+        self._camada_malha = None
+        self._local = threading.local()
+        self._lock_componentes = threading.Lock()
+        self.hierarquia = None
+        self.alt = None
+        self.indice_espacial = None
+        self.geometria = None
+        self._geocodificador = None
+        self._indice_arestas = None
+        # Snapshot de que o motor foi mapeado (os workers do lote mapeiam o mesmo arquivo)
+        self.arquivo_snapshot = None
+
+    def _componente(self, atributo, construir):
+        # Componentes que não dependem dos pesos ficam no motor base, compartilhados pelos cenários
+        raiz = self._raiz
+        valor = getattr(raiz, atributo)
+        if valor is None:
+            with raiz._lock_componentes:
+                valor = getattr(raiz, atributo)
+                if valor is None:
+                    valor = construir()
+                    setattr(raiz, atributo, valor)
+        return valor
+
+    @property
+    def geocodificador(self):
+        """Geocodificador de nomes de rua, construído no primeiro uso (fora da inicialização)"""
+        return self._componente('_geocodificador', lambda: GeocodificadorLocal(self))
+
+    @property
+    def camada_malha(self):
+        """Malha viária para os mapas de /api/grafo_visual, construída no primeiro uso"""
+        return self._componente('_camada_malha', lambda: CamadaMalha(self))
+
+    @property
+    def indice_arestas(self):
+        """Índice de arestas do reverse geocoding, construído no primeiro uso"""
+        return self._componente('_indice_arestas', lambda: IndiceArestas(self, self.indice_espacial.projetar))
+
+    def aplicar_cenario(self, cenario):
+        """Aplica o cenário neste motor (na montagem da versão, antes de anexar CH/ALT)"""
+        self._pesos['length'], self.desabilitadas = cenario.aplicar(self.pesos_base, self.desabilitadas_base)
+        self._fatores_heuristica = {}
+        self.cenario = cenario
+        self.estatisticas = dict(self.estatisticas, arestas_randomizadas=self.total_arestas,
+                                 arestas_bloqueadas=sum(map(int.bit_count, self.desabilitadas)))
+
+    def para_cenario(self, semente, proporcao=None):
+        """
+        Visão do motor sob outro cenário: compartilha topologia, geometria e
+        índices, com pesos/bloqueios próprios (sem CH nem ALT, que valem só
+        para o cenário padrão). Os overlays ficam num LRU de CENARIOS_MAX
+        entradas e as visões materializadas num LRU menor (CENARIOS_MAX_ATIVOS).
+        """
+        raiz = self._raiz
+        semente, proporcao = parametros_randomizacao(semente, proporcao)
+        chave = (semente, proporcao)
+        if raiz.cenario is not None and raiz.cenario.chave == chave:
+            return raiz
+        with raiz._lock_cenarios:
+            visao = raiz._visoes.get(chave)
+            if visao is not None:
+                raiz._visoes.move_to_end(chave)
+                return visao
+            cenario = raiz._cenarios.get(chave)
+            if cenario is None:
+                cenario = CenarioPesos.gerar(raiz.total_arestas, semente, proporcao)
+                raiz._cenarios[chave] = cenario
+                while len(raiz._cenarios) > CENARIOS_MAX:
+                    raiz._cenarios.popitem(last=False)
             else:
-                # Se não houver geometria, usar coordenadas dos nós
-                lat_origem = grafo.nodes[no_origem]['y']
-                lng_origem = grafo.nodes[no_origem]['x']
-                lat_destino = grafo.nodes[no_destino]['y']
-                lng_destino = grafo.nodes[no_destino]['x']
-                
-                print(f"Usando coordenadas dos nós: ({lat_origem}, {lng_origem}) -> ({lat_destino}, {lng_destino})")
-                
-                # Coordenadas dos nós já vêm no formato correto (lat, lng) para Leaflet
-                # Evitar duplicação de pontos
-                if not coordenadas_completas or (lat_origem, lng_origem) != coordenadas_completas[-1]:
-                    coordenadas_completas.append((lat_origem, lng_origem))
-                coordenadas_completas.append((lat_destino, lng_destino))
-            
-        # Converter para formato [lat, lng] e garantir coordenadas válidas
-        coords_otimizadas = []
-        for coord in coordenadas_completas:
-            if len(coord) >= 2:
-                try:
-                    # Determinar formato da coordenada
-                    if isinstance(coord[0], tuple):  # Formato (lng, lat)
-                        lng, lat = coord[0], coord[1]
-                    else:  # Formato [lat, lng] ou (lat, lng)
-                        lat, lng = coord[0], coord[1]
-                    
-                    # Verificar se não é duplicada da anterior
-                    if coords_otimizadas:
-                        lat_prev, lng_prev = coords_otimizadas[-1]
-                        if abs(lat - lat_prev) < 0.000001 and abs(lng - lng_prev) < 0.000001:
-                            continue  # Pular coordenada duplicada
-                    
-                    # Garantir que são floats válidos
-                    lat_float = float(lat)
-                    lng_float = float(lng)
-                    coords_otimizadas.append([lat_float, lng_float])
-                    
-                except (ValueError, TypeError):
+                raiz._cenarios.move_to_end(chave)
+            visao = copy.copy(raiz)
+            # Pesos derivados (tempos por modo) são recalculados sobre a distância do cenário
+            visao._pesos = {}
+            visao.hierarquia = None
+            visao.alt = None
+            visao.aplicar_cenario(cenario)
+            visao.versao = (raiz.versao, chave)
+            raiz._visoes[chave] = visao
+            while len(raiz._visoes) > CENARIOS_MAX_ATIVOS:
+                raiz._visoes.popitem(last=False)
+        logger.debug("Cenário %s materializado (%d bloqueios)", chave, cenario.total_bloqueadas)
+        return visao
+
+    def estatisticas_cenarios(self):
+        raiz = self._raiz
+        with raiz._lock_cenarios:
+            return {
+                'overlays': len(raiz._cenarios),
+                'ativos': len(raiz._visoes),
+                'memoria_overlays_bytes': sum(c.memoria_bytes() for c in raiz._cenarios.values())
+            }
+
+    def rotulos_da_aresta(self, e):
+        """Valores de name e ref da aresta, nessa ordem"""
+        return [self.rotulos[i] for i in self.rotulos_ids[self.rotulos_offsets[e]:self.rotulos_offsets[e + 1]]]
+
+    def nome_da_aresta(self, e):
+        """Nome de exibição da aresta (primeiro name, senão ref) ou None"""
+        ini = self.rotulos_offsets[e]
+        return self.rotulos[self.rotulos_ids[ini]] if ini < self.rotulos_offsets[e + 1] else None
+
+    def assinatura(self, peso='length'):
+        """Impressão digital da topologia, pesos e bloqueios; valida artefatos pré-processados"""
+        h = hashlib.sha1()
+        h.update(array('q', self.offsets).tobytes())
+        h.update(array('q', self.alvos).tobytes())
+        h.update(self.pesos(peso).tobytes())
+        h.update(bytes(self.desabilitadas))
+        return h.hexdigest()
+
+    def perfil_modo(self, modo):
+        """(velocidades em m/s, bitmask de inacessíveis) do modo; calculado uma vez e compartilhado pelos cenários"""
+        raiz = self._raiz
+        perfil = raiz._perfis_modo.get(modo)
+        if perfil is None:
+            with raiz._lock_componentes:
+                perfil = raiz._perfis_modo.get(modo)
+                if perfil is None:
+                    perfil = velocidades_modo(modo, raiz.classes_via, raiz.classes, raiz.velocidades_max)
+                    raiz._perfis_modo[modo] = perfil
+        return perfil
+
+    def _tempos_modo(self, modo):
+        # Tempo de viagem (s) = distância do cenário / velocidade do modo; inacessíveis ficam com peso infinito
+        velocidades, inacessiveis = self.perfil_modo(modo)
+        tempos = np.frombuffer(self.pesos('length'), dtype=np.float64) / velocidades
+        tempos[np.unpackbits(inacessiveis, count=self.total_arestas, bitorder='little').astype(bool)] = np.inf
+        return array('d', tempos.tobytes())
+
+    def comprimento(self, arestas):
+        """Soma das distâncias (m) das arestas, na ordem do caminho"""
+        pesos = self.pesos('length')
+        total = 0.0
+        for e in arestas:
+            total += pesos[e]
+        return total
+
+    def pesos(self, peso='length'):
+        """Array de pesos por aresta para o atributo pedido (compilado sob demanda; 'tempo_<modo>' vem do perfil)"""
+        arr = self._pesos.get(peso)
+        if arr is None:
+            if peso.startswith('tempo_') and peso[len('tempo_'):] in PERFIS_MODO:
+                arr = self._pesos[peso] = self._tempos_modo(peso[len('tempo_'):])
+                return arr
+            if self.grafo is None:
+                raise ValueError(f"Peso '{peso}' indisponível no snapshot do grafo")
+            arr = array('d')
+            for e in range(self.total_arestas):
+                info_aresta = self.grafo[self.nos[self.origens[e]]][self.nos[self.alvos[e]]][self.chaves[e]]
+                arr.append(info_aresta.get(peso, info_aresta.get('length', 1)))
+            self._pesos[peso] = arr
+        return arr
+
+    def _buffers(self, slot=0):
+        """Buffers de distância/anterior/visitado/auxiliar reutilizados por thread (um jogo por sentido de busca)"""
+        buffers = getattr(self._local, 'buffers', None)
+        if buffers is None:
+            buffers = self._local.buffers = {}
+        buf = buffers.get(slot)
+        if buf is None:
+            n = self.total_nos
+            buf = (array('d', [float('inf')]) * n, array('l', [-1]) * n, bytearray(n), array('d', [0.0]) * n)
+            buffers[slot] = buf
+        return buf
+
+    def distancia_geodesica(self, a, b):
+        """Distância de grande círculo (haversine) entre dois nós, em metros"""
+        lat1, lat2 = math.radians(self.lat[a]), math.radians(self.lat[b])
+        dlat = lat2 - lat1
+        dlng = math.radians(self.lng[b] - self.lng[a])
+        h = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlng / 2) ** 2
+        return 2 * RAIO_TERRA_M * math.asin(math.sqrt(min(1.0, h)))
+
+    def geodesicas(self):
+        """Distância de grande círculo entre as pontas de cada aresta (float64, compartilhada pelos cenários)"""
+        def construir():
+            lat = np.frombuffer(self.lat_rad, dtype=np.float64)
+            lng = np.frombuffer(self.lng_rad, dtype=np.float64)
+            origens = np.frombuffer(self.origens, dtype=f'i{self.origens.itemsize}')
+            alvos = np.frombuffer(self.alvos, dtype=f'i{self.alvos.itemsize}')
+            lat1, lat2 = lat[origens], lat[alvos]
+            h = (np.sin((lat2 - lat1) / 2) ** 2
+                 + np.cos(lat1) * np.cos(lat2) * np.sin((lng[alvos] - lng[origens]) / 2) ** 2)
+            return 2 * RAIO_TERRA_M * np.arcsin(np.sqrt(np.minimum(1.0, h)))
+        return self._componente('_geodesicas', construir)
+
+    def fator_heuristica(self, peso='length'):
+        """
+        Maior fator f tal que peso(u, v) >= f * haversine(u, v) em todas as arestas.
+        f * haversine(v, destino) é então uma heurística admissível e consistente para o A*,
+        inclusive com os comprimentos randomizados (±20%).
+        """
+        fator = self._fatores_heuristica.get(peso)
+        if fator is None:
+            geo = self.geodesicas()
+            positivas = geo > 0
+            fator = float('inf')
+            if positivas.any():
+                fator = float((np.frombuffer(self.pesos(peso), dtype=np.float64)[positivas] / geo[positivas]).min())
+            if fator == float('inf') or fator < 0:
+                fator = 0.0
+            # Margem para erros de arredondamento
+            fator *= 1 - 1e-9
+            self._fatores_heuristica[peso] = fator
+        return fator
+
+    def dijkstra(self, origem, destino, peso='length'):
+        """
+        Dijkstra sobre índices inteiros.
+        Retorna (distancia, arestas do caminho, nós assentados); distancia é inf sem caminho.
+        """
+        pesos = self.pesos(peso)
+        offsets, alvos, desabilitadas = self.offsets, self.alvos, self.desabilitadas
+        distancias, anteriores, visitados, _ = self._buffers()
+        inf = float('inf')
+        heappush, heappop = heapq.heappush, heapq.heappop
+        tocados = [origem]
+        distancias[origem] = 0.0
+        fila_prioridade = [(0.0, origem)]
+        assentados = 0
+        try:
+            while fila_prioridade:
+                distancia_atual, no_atual = heappop(fila_prioridade)
+                if visitados[no_atual]:
                     continue
-        
-        print(f"=== Coordenadas finais ===")
-        print(f"Total de coordenadas: {len(coords_otimizadas)}")
-        print(f"Primeiras 5 coordenadas: {coords_otimizadas[:5] if coords_otimizadas else 'vazio'}")
-        print(f"Últimas 5 coordenadas: {coords_otimizadas[-5:] if coords_otimizadas else 'vazio'}")
-        
-        # Verificar se as coordenadas estão no formato correto para Leaflet [lat, lng]
-        if coords_otimizadas:
-            print(f"Formato de coordenadas: {type(coords_otimizadas[0])}")
-            print(f"Exemplo de coordenada: {coords_otimizadas[0]}")
-            if isinstance(coords_otimizadas[0], list) and len(coords_otimizadas[0]) == 2:
-                print(f"Latitude: {coords_otimizadas[0][0]}, Longitude: {coords_otimizadas[0][1]}")
-        
+                visitados[no_atual] = 1
+                assentados += 1
+                if no_atual == destino:
+                    break
+                for e in range(offsets[no_atual], offsets[no_atual + 1]):
+                    vizinho = alvos[e]
+                    if visitados[vizinho] or desabilitadas[e >> 3] & (1 << (e & 7)):
+                        continue
+                    distancia = distancia_atual + pesos[e]
+                    if distancia < distancias[vizinho]:
+                        if distancias[vizinho] == inf:
+                            tocados.append(vizinho)
+                        distancias[vizinho] = distancia
+                        anteriores[vizinho] = e
+                        heappush(fila_prioridade, (distancia, vizinho))
+            distancia_total = distancias[destino]
+            arestas = []
+            if distancia_total != inf:
+                no = destino
+                while no != origem:
+                    e = anteriores[no]
+                    arestas.append(e)
+                    no = self.origens[e]
+                arestas.reverse()
+            return distancia_total, arestas, assentados
+        finally:
+            # Reset apenas dos nós tocados nesta consulta
+            for no in tocados:
+                distancias[no] = inf
+                anteriores[no] = -1
+                visitados[no] = 0
+
+    def dijkstra_bidirecional(self, origem, destino, peso='length'):
+        """
+        Dijkstra simultâneo a partir da origem (CSR) e do destino (CSR reverso).
+        Para quando a soma dos topos das filas alcança a melhor distância de encontro.
+        """
+        pesos = self.pesos(peso)
+        offsets, alvos, origens, desabilitadas = self.offsets, self.alvos, self.origens, self.desabilitadas
+        offsets_rev, arestas_rev = self.offsets_rev, self.arestas_rev
+        dist_f, ant_f, vis_f, _ = self._buffers(0)
+        dist_b, ant_b, vis_b, _ = self._buffers(1)
+        inf = float('inf')
+        heappush, heappop = heapq.heappush, heapq.heappop
+        if origem == destino:
+            return 0.0, [], 1
+        tocados_f, tocados_b = [origem], [destino]
+        dist_f[origem] = 0.0
+        dist_b[destino] = 0.0
+        fila_f, fila_b = [(0.0, origem)], [(0.0, destino)]
+        melhor, encontro = inf, -1
+        assentados = 0
+        try:
+            while fila_f or fila_b:
+                topo_f = fila_f[0][0] if fila_f else inf
+                topo_b = fila_b[0][0] if fila_b else inf
+                if topo_f + topo_b >= melhor:
+                    break
+                if topo_f <= topo_b:
+                    distancia_atual, no_atual = heappop(fila_f)
+                    if vis_f[no_atual]:
+                        continue
+                    vis_f[no_atual] = 1
+                    assentados += 1
+                    for e in range(offsets[no_atual], offsets[no_atual + 1]):
+                        if desabilitadas[e >> 3] & (1 << (e & 7)):
+                            continue
+                        vizinho = alvos[e]
+                        distancia = distancia_atual + pesos[e]
+                        if distancia < dist_f[vizinho]:
+                            if dist_f[vizinho] == inf:
+                                tocados_f.append(vizinho)
+                            dist_f[vizinho] = distancia
+                            ant_f[vizinho] = e
+                            heappush(fila_f, (distancia, vizinho))
+                        if distancia + dist_b[vizinho] < melhor:
+                            melhor, encontro = distancia + dist_b[vizinho], vizinho
+                else:
+                    distancia_atual, no_atual = heappop(fila_b)
+                    if vis_b[no_atual]:
+                        continue
+                    vis_b[no_atual] = 1
+                    assentados += 1
+                    for i in range(offsets_rev[no_atual], offsets_rev[no_atual + 1]):
+                        e = arestas_rev[i]
+                        if desabilitadas[e >> 3] & (1 << (e & 7)):
+                            continue
+                        vizinho = origens[e]
+                        distancia = distancia_atual + pesos[e]
+                        if distancia < dist_b[vizinho]:
+                            if dist_b[vizinho] == inf:
+                                tocados_b.append(vizinho)
+                            dist_b[vizinho] = distancia
+                            ant_b[vizinho] = e
+                            heappush(fila_b, (distancia, vizinho))
+                        if distancia + dist_f[vizinho] < melhor:
+                            melhor, encontro = distancia + dist_f[vizinho], vizinho
+            arestas = []
+            if melhor != inf:
+                no = encontro
+                while no != origem:
+                    e = ant_f[no]
+                    arestas.append(e)
+                    no = origens[e]
+                arestas.reverse()
+                no = encontro
+                while no != destino:
+                    e = ant_b[no]
+                    arestas.append(e)
+                    no = alvos[e]
+            return melhor, arestas, assentados
+        finally:
+            for no in tocados_f:
+                dist_f[no] = inf
+                ant_f[no] = -1
+                vis_f[no] = 0
+            for no in tocados_b:
+                dist_b[no] = inf
+                ant_b[no] = -1
+                vis_b[no] = 0
+
+    def astar(self, origem, destino, peso='length'):
+        """A* com heurística de grande círculo escalada por fator_heuristica (admissível)"""
+        pesos = self.pesos(peso)
+        offsets, alvos, desabilitadas = self.offsets, self.alvos, self.desabilitadas
+        distancias, anteriores, visitados, heuristica = self._buffers()
+        inf = float('inf')
+        heappush, heappop = heapq.heappush, heapq.heappop
+        sin, asin, sqrt = math.sin, math.asin, math.sqrt
+        lat_rad, lng_rad, cos_lat = self.lat_rad, self.lng_rad, self.cos_lat
+        escala = 2 * RAIO_TERRA_M * self.fator_heuristica(peso)
+        lat_t, lng_t, cos_t = lat_rad[destino], lng_rad[destino], cos_lat[destino]
+
+        def h(no):
+            a = sin((lat_rad[no] - lat_t) / 2) ** 2 + cos_lat[no] * cos_t * sin((lng_rad[no] - lng_t) / 2) ** 2
+            return escala * asin(sqrt(min(1.0, a)))
+
+        tocados = [origem]
+        distancias[origem] = 0.0
+        fila_prioridade = [(h(origem), origem)]
+        assentados = 0
+        try:
+            while fila_prioridade:
+                _, no_atual = heappop(fila_prioridade)
+                if visitados[no_atual]:
+                    continue
+                visitados[no_atual] = 1
+                assentados += 1
+                if no_atual == destino:
+                    break
+                distancia_atual = distancias[no_atual]
+                for e in range(offsets[no_atual], offsets[no_atual + 1]):
+                    vizinho = alvos[e]
+                    if visitados[vizinho] or desabilitadas[e >> 3] & (1 << (e & 7)):
+                        continue
+                    distancia = distancia_atual + pesos[e]
+                    if distancia < distancias[vizinho]:
+                        if distancias[vizinho] == inf:
+                            tocados.append(vizinho)
+                            heuristica[vizinho] = h(vizinho)
+                        distancias[vizinho] = distancia
+                        anteriores[vizinho] = e
+                        heappush(fila_prioridade, (distancia + heuristica[vizinho], vizinho))
+            distancia_total = distancias[destino]
+            arestas = []
+            if distancia_total != inf:
+                no = destino
+                while no != origem:
+                    e = anteriores[no]
+                    arestas.append(e)
+                    no = self.origens[e]
+                arestas.reverse()
+            return distancia_total, arestas, assentados
+        finally:
+            for no in tocados:
+                distancias[no] = inf
+                anteriores[no] = -1
+                visitados[no] = 0
+
+    def estrategia_efetiva(self, estrategia, peso='length'):
+        """Sem pré-processamento para o peso pedido, 'ch' cai para a bidirecional e 'alt' para o A*"""
+        if estrategia == 'ch' and (self.hierarquia is None or self.hierarquia.peso != peso):
+            return 'bidirecional'
+        if estrategia == 'alt' and (self.alt is None or self.alt.peso != peso):
+            return 'astar'
+        return estrategia
+
+    def buscar(self, origem, destino, peso='length', estrategia='dijkstra'):
+        """Despacha para a estratégia de busca pedida; retorna (distancia, arestas, nós assentados)"""
+        estrategia = self.estrategia_efetiva(estrategia, peso)
+        if estrategia == 'ch':
+            distancia_total, arestas, assentados = self.hierarquia.consultar(origem, destino)
+            if arestas:
+                # Soma na ordem do caminho, como nas demais estratégias
+                pesos = self.pesos(peso)
+                distancia_total = 0.0
+                for e in arestas:
+                    distancia_total += pesos[e]
+            return distancia_total, arestas, assentados
+        if estrategia == 'alt':
+            return self.alt.consultar(self, origem, destino)
+        if estrategia == 'bidirecional':
+            return self.dijkstra_bidirecional(origem, destino, peso)
+        if estrategia == 'astar':
+            return self.astar(origem, destino, peso)
+        return self.dijkstra(origem, destino, peso)
+
+    def arvore_caminhos(self, origem, peso='length', reverso=False, alvos=None, limite=float('inf')):
+        """
+        Dijkstra de fonte única (ou para o destino, com reverso=True).
+        Para quando todos os 'alvos' forem assentados ou a distância passar de 'limite';
+        só os nós assentados (alvos, ou todos até 'limite') têm distância final.
+        Retorna (distancias, anteriores) em arrays novos; anteriores guarda a aresta CSR.
+        """
+        pesos = self.pesos(peso)
+        desabilitadas = self.desabilitadas
+        if reverso:
+            offsets, lista, vizinhos = self.offsets_rev, self.arestas_rev, self.origens
+        else:
+            offsets, lista, vizinhos = self.offsets, None, self.alvos
+        n = self.total_nos
+        inf = float('inf')
+        distancias = array('d', [inf]) * n
+        anteriores = array('l', [-1]) * n
+        visitados = bytearray(n)
+        pendentes = set(alvos) if alvos is not None else None
+        heappush, heappop = heapq.heappush, heapq.heappop
+        distancias[origem] = 0.0
+        fila = [(0.0, origem)]
+        while fila:
+            distancia_atual, no_atual = heappop(fila)
+            if visitados[no_atual]:
+                continue
+            if distancia_atual > limite:
+                break
+            visitados[no_atual] = 1
+            if pendentes is not None:
+                pendentes.discard(no_atual)
+                if not pendentes:
+                    break
+            for i in range(offsets[no_atual], offsets[no_atual + 1]):
+                e = lista[i] if lista is not None else i
+                if desabilitadas[e >> 3] & (1 << (e & 7)):
+                    continue
+                vizinho = vizinhos[e]
+                distancia = distancia_atual + pesos[e]
+                if distancia < distancias[vizinho]:
+                    distancias[vizinho] = distancia
+                    anteriores[vizinho] = e
+                    heappush(fila, (distancia, vizinho))
+        return distancias, anteriores
+
+    def somar_na_arvore(self, raiz, anteriores, alvos, peso='length', reverso=False):
+        """
+        Soma de 'peso' ao longo do caminho da árvore de arvore_caminhos (mesmo 'reverso')
+        entre a raiz e cada alvo; inf para alvos fora da árvore. Os trechos já somados
+        ficam guardados, então cada aresta da árvore é percorrida no máximo uma vez.
+        """
+        pesos = self.pesos(peso)
+        # Na árvore direta o pai de v é a origem da aresta anterior; na reversa, o alvo
+        pais, filhos = (self.alvos, self.origens) if reverso else (self.origens, self.alvos)
+        inf = float('inf')
+        somas = {raiz: 0.0}
+        resultado = []
+        for alvo in alvos:
+            subida = []
+            no = alvo
+            while no not in somas:
+                e = anteriores[no]
+                if e < 0:
+                    break
+                subida.append(e)
+                no = pais[e]
+            if no not in somas:
+                resultado.append(inf)
+                continue
+            total = somas[no]
+            for e in reversed(subida):
+                total += pesos[e]
+                somas[filhos[e]] = total
+            resultado.append(total)
+        return resultado
+
+    def nos_do_caminho(self, origem, arestas):
+        """Converte a sequência de arestas em lista de ids de nós originais"""
+        caminho = [self.nos[origem]]
+        caminho.extend(self.nos[self.alvos[e]] for e in arestas)
+        return caminho
+
+    def caminho_minimo(self, origem_no, destino_no, peso='length', estrategia='dijkstra'):
+        """
+        Caminho mínimo entre ids de nós originais.
+        Retorna {'caminho', 'distancia', 'arestas', 'nos_assentados'}; caminho vazio se inalcançável.
+        """
+        origem = self.indice[origem_no]
+        destino = self.indice[destino_no]
+        distancia_total, arestas, assentados = self.buscar(origem, destino, peso, estrategia)
+        if distancia_total == float('inf'):
+            return {'caminho': [], 'distancia': 0.0, 'arestas': [], 'nos_assentados': assentados}
         return {
-            'sucesso': True,
-            'caminho': coords_otimizadas,
+            'caminho': self.nos_do_caminho(origem, arestas),
             'distancia': distancia_total,
-            'nos_count': len(caminho)
+            'arestas': arestas,
+            'nos_assentados': assentados
+        }
+
+    def rotas_alternativas(self, origem, destino, peso='length', k=2, estrategia='dijkstra', custo_otimo=None):
+        """
+        Até k rotas alternativas pelo método dos platôs. Uma árvore de Dijkstra a partir
+        da origem e outra até o destino, limitadas a (1 + ALTERNATIVAS_ESTIRAMENTO) x o
+        custo ótimo; arestas que estão nas duas árvores formam platôs, e cada platô dá
+        um caminho via (origem -> início do platô -> fim -> destino) de custo df + db.
+        Ficam os que têm platô de pelo menos ALTERNATIVAS_PLATO_MIN x o ótimo, passam
+        no T-teste de otimalidade local nas duas junções e compartilham no máximo
+        ALTERNATIVAS_SOBREPOSICAO x o ótimo com a rota ótima e com as já escolhidas.
+        'custo_otimo' (da rota que o chamador já calculou) só fixa o limite das árvores;
+        sem ele, uma busca com 'estrategia' calcula o ótimo antes. A rota ótima usada nas
+        comparações sai da própria árvore direta.
+        Retorna ([(custo, arestas, compartilhado com a ótima), ...] por custo, custo ótimo, nós assentados).
+        """
+        inf = float('inf')
+        assentados = 0
+        if custo_otimo is None:
+            custo_otimo, _, assentados = self.buscar(origem, destino, peso, estrategia)
+        if k <= 0 or custo_otimo == inf or custo_otimo <= 0:
+            return [], custo_otimo, assentados
+        # Folga relativa: o custo do chamador pode vir de outra ordem de somas (CH, A*)
+        limite = (1 + ALTERNATIVAS_ESTIRAMENTO) * custo_otimo * (1 + 1e-9)
+        df, pf = self.arvore_caminhos(origem, peso, limite=limite)
+        db, pb = self.arvore_caminhos(destino, peso, reverso=True, limite=limite)
+        custo_otimo = df[destino]
+        if custo_otimo == inf:
+            return [], custo_otimo, assentados
+        arestas_otimas, no = [], destino
+        while no != origem:
+            arestas_otimas.append(pf[no])
+            no = self.origens[pf[no]]
+        tipo_indice = f'i{self.alvos.itemsize}'
+        df_np, db_np = np.frombuffer(df, dtype=np.float64), np.frombuffer(db, dtype=np.float64)
+        pf_np, pb_np = np.frombuffer(pf, dtype=tipo_indice), np.frombuffer(pb, dtype=tipo_indice)
+        origens, alvos = np.frombuffer(self.origens, dtype=tipo_indice), np.frombuffer(self.alvos, dtype=tipo_indice)
+        assentados += int(np.count_nonzero(df_np <= limite) + np.count_nonzero(db_np <= limite))
+        # Aresta de platô: é a aresta da árvore direta que chega em v e a da reversa que sai de u
+        # (rótulos <= limite são finais, então o custo via a aresta é exato)
+        arestas = np.arange(self.total_arestas)
+        plato = (pf_np[alvos] == arestas) & (pb_np[origens] == arestas) & (df_np[origens] + db_np[origens] <= limite)
+        pesos = self.pesos(peso)
+        tamanho_minimo = ALTERNATIVAS_PLATO_MIN * custo_otimo
+        candidatos = []
+        for e in np.flatnonzero(plato).tolist():
+            anterior = pf[origens[e]]
+            if anterior >= 0 and plato[anterior]:
+                continue
+            # e inicia um platô: segue pela árvore reversa enquanto as arestas forem de platô
+            cadeia = [e]
+            while True:
+                seguinte = pb[alvos[cadeia[-1]]]
+                if seguinte < 0 or not plato[seguinte]:
+                    break
+                cadeia.append(seguinte)
+            inicio, fim = int(origens[e]), int(alvos[cadeia[-1]])
+            if df[fim] - df[inicio] >= tamanho_minimo:
+                candidatos.append((df[inicio] + db[inicio], inicio, fim, cadeia))
+        candidatos.sort(key=lambda c: c[0])
+
+        otimas = set(arestas_otimas)
+        escolhidas = []
+        limite_compartilhado = ALTERNATIVAS_SOBREPOSICAO * custo_otimo
+        estrategia_teste = self.estrategia_efetiva('ch', peso)
+        for custo, inicio, fim, cadeia in candidatos:
+            if len(escolhidas) >= k:
+                break
+            ida, no = [], inicio
+            while no != origem:
+                ida.append(pf[no])
+                no = self.origens[pf[no]]
+            ida.reverse()
+            volta, no = [], fim
+            while no != destino:
+                volta.append(pb[no])
+                no = self.alvos[pb[no]]
+            via = ida + cadeia + volta
+            nos = [origem] + [self.alvos[a] for a in via]
+            if len(set(nos)) != len(nos):
+                continue
+            compartilhado = sum(pesos[a] for a in via if a in otimas)
+            if compartilhado > limite_compartilhado:
+                continue
+            if any(sum(pesos[a] for a in via if a in conjunto) > limite_compartilhado for _, _, _, conjunto in escolhidas):
+                continue
+            # T-teste: o trecho de T antes a T depois de cada junção do platô deve ser mínimo
+            prefixo = list(itertools.accumulate((pesos[a] for a in via), initial=0.0))
+            otimo_local = True
+            for centro in (len(ida), len(ida) + len(cadeia)):
+                a = max(0, bisect.bisect_right(prefixo, prefixo[centro] - tamanho_minimo) - 1)
+                b = min(len(prefixo) - 1, bisect.bisect_left(prefixo, prefixo[centro] + tamanho_minimo))
+                distancia, _, extra = self.buscar(nos[a], nos[b], peso, estrategia_teste)
+                assentados += extra
+                if distancia < (prefixo[b] - prefixo[a]) * (1 - 1e-9):
+                    otimo_local = False
+                    break
+            if otimo_local:
+                escolhidas.append((custo, via, compartilhado, set(via)))
+        return [(custo, via, compartilhado) for custo, via, compartilhado, _ in escolhidas], custo_otimo, assentados
+
+class HierarquiaContracao:
+    """
+    Contraction Hierarchy construída sobre as arestas habilitadas do GrafoCompilado.
+    Cada aresta da hierarquia é original (referencia a aresta CSR) ou atalho
+    (referencia as duas arestas que substitui), então o caminho da consulta é
+    desempacotado na sequência exata de arestas do grafo e a geometria OSM
+    continua disponível para obter_rota_por_geometria.
+    """
+    MAGICO = b'RMCH1\n'
+    ARRAYS = ('ordem', 'origens', 'alvos', 'pesos', 'filho_a', 'filho_b', 'original',
+              'offsets_sub', 'arestas_sub', 'offsets_desc', 'arestas_desc')
+
+    def __init__(self, peso, assinatura, **arrays):
+        self.peso = peso
+        self.assinatura = assinatura
+        for nome in self.ARRAYS:
+            setattr(self, nome, arrays[nome])
+
+    @classmethod
+    def construir(cls, motor, peso='length', limite_assentados=200, progresso=None):
+        """Contrai os nós por ordem de diferença de arestas (atualização preguiçosa)"""
+        pesos_csr = motor.pesos(peso)
+        n = motor.total_nos
+        inf = float('inf')
+        heappush, heappop = heapq.heappush, heapq.heappop
+        origens, alvos, pesos = array('i'), array('i'), array('d')
+        filho_a, filho_b, original = array('i'), array('i'), array('i')
+        saida = [dict() for _ in range(n)]
+        entrada = [dict() for _ in range(n)]
+
+        def nova_aresta(u, v, w, a, b, e):
+            idx = len(pesos)
+            origens.append(u)
+            alvos.append(v)
+            pesos.append(w)
+            filho_a.append(a)
+            filho_b.append(b)
+            original.append(e)
+            saida[u][v] = idx
+            entrada[v][u] = idx
+
+        for e in range(motor.total_arestas):
+            if motor.desabilitadas[e >> 3] & (1 << (e & 7)):
+                continue
+            u, v = motor.origens[e], motor.alvos[e]
+            # Peso infinito: aresta inacessível no perfil do modo
+            if u != v and pesos_csr[e] != inf:
+                nova_aresta(u, v, pesos_csr[e], -1, -1, e)
+
+        def distancias_testemunha(u, ignorar, limite):
+            # Dijkstra local a partir de u sem passar por 'ignorar'; limitado em distância e nós assentados
+            dist = {u: 0.0}
+            fila = [(0.0, u)]
+            assentados = 0
+            while fila:
+                d, x = heappop(fila)
+                if d > dist[x]:
+                    continue
+                if d > limite or assentados >= limite_assentados:
+                    break
+                assentados += 1
+                for y, idx in saida[x].items():
+                    if y == ignorar:
+                        continue
+                    nd = d + pesos[idx]
+                    if nd < dist.get(y, inf):
+                        dist[y] = nd
+                        heappush(fila, (nd, y))
+            return dist
+
+        def atalhos_necessarios(x):
+            atalhos = []
+            saidas = list(saida[x].items())
+            for u, iu in entrada[x].items():
+                w_u = pesos[iu]
+                limite = max((w_u + pesos[iv] for v, iv in saidas if v != u), default=None)
+                if limite is None:
+                    continue
+                dist = distancias_testemunha(u, x, limite)
+                for v, iv in saidas:
+                    if v == u:
+                        continue
+                    w = w_u + pesos[iv]
+                    if dist.get(v, inf) > w:
+                        atalhos.append((u, v, w, iu, iv))
+            return atalhos
+
+        vizinhos_contraidos = [0] * n
+
+        def prioridade(x):
+            atalhos = atalhos_necessarios(x)
+            return len(atalhos) - len(entrada[x]) - len(saida[x]) + vizinhos_contraidos[x], atalhos
+
+        fila = [(prioridade(x)[0], x) for x in range(n)]
+        heapq.heapify(fila)
+        ordem = array('i', [0]) * n
+        sub = [None] * n
+        desc = [None] * n
+        posicao = 0
+        while fila:
+            _, x = heappop(fila)
+            p, atalhos = prioridade(x)
+            if fila and p > fila[0][0]:
+                heappush(fila, (p, x))
+                continue
+            for u, v, w, iu, iv in atalhos:
+                atual = saida[u].get(v)
+                if atual is None or w < pesos[atual]:
+                    nova_aresta(u, v, w, iu, iv, -1)
+            ordem[x] = posicao
+            posicao += 1
+            # Arestas restantes de x ligam a nós de ordem maior: viram arestas de subida
+            sub[x] = list(saida[x].values())
+            desc[x] = list(entrada[x].values())
+            for v in saida[x]:
+                del entrada[v][x]
+                vizinhos_contraidos[v] += 1
+            for u in entrada[x]:
+                del saida[u][x]
+                vizinhos_contraidos[u] += 1
+            saida[x] = entrada[x] = None
+            if progresso and posicao % 1000 == 0:
+                progresso(posicao, n, len(pesos))
+
+        def compactar(listas):
+            offsets, arestas = array('i', [0]), array('i')
+            for lista in listas:
+                arestas.extend(lista)
+                offsets.append(len(arestas))
+            return offsets, arestas
+
+        offsets_sub, arestas_sub = compactar(sub)
+        offsets_desc, arestas_desc = compactar(desc)
+        return cls(peso, motor.assinatura(peso), ordem=ordem, origens=origens, alvos=alvos, pesos=pesos,
+                   filho_a=filho_a, filho_b=filho_b, original=original,
+                   offsets_sub=offsets_sub, arestas_sub=arestas_sub,
+                   offsets_desc=offsets_desc, arestas_desc=arestas_desc)
+
+    @property
+    def total_atalhos(self):
+        return sum(1 for e in self.original if e < 0)
+
+    def consultar(self, origem, destino):
+        """
+        Busca bidirecional só para cima na hierarquia.
+        Retorna (distancia, arestas CSR do caminho desempacotado, nós assentados).
+        """
+        inf = float('inf')
+        heappush, heappop = heapq.heappush, heapq.heappop
+        alvos, origens, pesos = self.alvos, self.origens, self.pesos
+        offsets_sub, arestas_sub = self.offsets_sub, self.arestas_sub
+        offsets_desc, arestas_desc = self.offsets_desc, self.arestas_desc
+        dist_f, dist_b = {origem: 0.0}, {destino: 0.0}
+        ant_f, ant_b = {}, {}
+        fila_f, fila_b = [(0.0, origem)], [(0.0, destino)]
+        melhor, encontro = (0.0, origem) if origem == destino else (inf, -1)
+        assentados = 0
+        while fila_f or fila_b:
+            if fila_f and fila_f[0][0] >= melhor:
+                fila_f = []
+            if fila_b and fila_b[0][0] >= melhor:
+                fila_b = []
+            if not fila_f and not fila_b:
+                break
+            if fila_f and (not fila_b or fila_f[0][0] <= fila_b[0][0]):
+                d, u = heappop(fila_f)
+                if d > dist_f[u]:
+                    continue
+                assentados += 1
+                if u in dist_b and d + dist_b[u] < melhor:
+                    melhor, encontro = d + dist_b[u], u
+                for i in range(offsets_sub[u], offsets_sub[u + 1]):
+                    idx = arestas_sub[i]
+                    v = alvos[idx]
+                    nd = d + pesos[idx]
+                    if nd < dist_f.get(v, inf):
+                        dist_f[v] = nd
+                        ant_f[v] = idx
+                        heappush(fila_f, (nd, v))
+            else:
+                d, u = heappop(fila_b)
+                if d > dist_b[u]:
+                    continue
+                assentados += 1
+                if u in dist_f and d + dist_f[u] < melhor:
+                    melhor, encontro = d + dist_f[u], u
+                for i in range(offsets_desc[u], offsets_desc[u + 1]):
+                    idx = arestas_desc[i]
+                    v = origens[idx]
+                    nd = d + pesos[idx]
+                    if nd < dist_b.get(v, inf):
+                        dist_b[v] = nd
+                        ant_b[v] = idx
+                        heappush(fila_b, (nd, v))
+        if melhor == inf:
+            return inf, [], assentados
+        caminho_ch = []
+        no = encontro
+        while no != origem:
+            idx = ant_f[no]
+            caminho_ch.append(idx)
+            no = origens[idx]
+        caminho_ch.reverse()
+        no = encontro
+        while no != destino:
+            idx = ant_b[no]
+            caminho_ch.append(idx)
+            no = alvos[idx]
+        return melhor, self.desempacotar(caminho_ch), assentados
+
+    def espaco_busca(self, origem, reverso=False):
+        """Busca só para cima completa a partir de origem; retorna {nó: distância}"""
+        inf = float('inf')
+        heappush, heappop = heapq.heappush, heapq.heappop
+        if reverso:
+            offsets, arestas, vizinhos = self.offsets_desc, self.arestas_desc, self.origens
+        else:
+            offsets, arestas, vizinhos = self.offsets_sub, self.arestas_sub, self.alvos
+        pesos = self.pesos
+        dist = {origem: 0.0}
+        assentados = {}
+        fila = [(0.0, origem)]
+        while fila:
+            d, u = heappop(fila)
+            if u in assentados:
+                continue
+            assentados[u] = d
+            for i in range(offsets[u], offsets[u + 1]):
+                idx = arestas[i]
+                v = vizinhos[idx]
+                nd = d + pesos[idx]
+                if nd < dist.get(v, inf):
+                    dist[v] = nd
+                    heappush(fila, (nd, v))
+        return assentados
+
+    def matriz(self, origens, destinos):
+        """Many-to-many por baldes: uma busca reversa por destino e uma direta por origem"""
+        inf = float('inf')
+        baldes = {}
+        for j, destino in enumerate(destinos):
+            for v, d in self.espaco_busca(destino, reverso=True).items():
+                baldes.setdefault(v, []).append((j, d))
+        matriz = []
+        for origem in origens:
+            linha = [inf] * len(destinos)
+            for v, d in self.espaco_busca(origem).items():
+                for j, d_b in baldes.get(v, ()):
+                    if d + d_b < linha[j]:
+                        linha[j] = d + d_b
+            matriz.append(linha)
+        return matriz
+
+    def desempacotar(self, arestas_ch):
+        """Expande atalhos recursivamente até as arestas CSR originais"""
+        resultado = []
+        pilha = list(reversed(arestas_ch))
+        while pilha:
+            idx = pilha.pop()
+            e = self.original[idx]
+            if e >= 0:
+                resultado.append(e)
+            else:
+                pilha.append(self.filho_b[idx])
+                pilha.append(self.filho_a[idx])
+        return resultado
+
+    def salvar(self, caminho):
+        cabecalho = {
+            'peso': self.peso,
+            'assinatura': self.assinatura,
+            'byteorder': sys.byteorder,
+            'arrays': [[nome, getattr(self, nome).typecode, len(getattr(self, nome))] for nome in self.ARRAYS]
+        }
+        tmp = caminho + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(self.MAGICO)
+            f.write(json.dumps(cabecalho).encode('utf-8') + b'\n')
+            for nome in self.ARRAYS:
+                getattr(self, nome).tofile(f)
+        os.replace(tmp, caminho)
+
+    @classmethod
+    def carregar(cls, caminho):
+        with open(caminho, 'rb') as f:
+            if f.readline() != cls.MAGICO:
+                raise ValueError('Arquivo de hierarquia inválido')
+            cabecalho = json.loads(f.readline().decode('utf-8'))
+            arrays = {}
+            for nome, typecode, tamanho in cabecalho['arrays']:
+                arr = array(typecode)
+                arr.fromfile(f, tamanho)
+                if cabecalho.get('byteorder', sys.byteorder) != sys.byteorder:
+                    arr.byteswap()
+                arrays[nome] = arr
+        return cls(cabecalho['peso'], cabecalho['assinatura'], **arrays)
+
+class MarcosALT:
+    """
+    Pré-processamento ALT (A*, Landmarks, desigualdade triangular).
+    Para cada marco L guarda d(L, v) e d(v, L) de todos os nós em float32;
+    max(d(L, t) - d(L, v), d(v, L) - d(t, L)) é um limite inferior de d(v, t).
+    Reconstruir exige apenas 2 Dijkstras completos por marco, então é barato
+    refazer após mudança de pesos ou bloqueios (ao contrário da CH).
+    """
+    MARCOS_ATIVOS = 4
+
+    def __init__(self, peso, marcos, distancias_de, distancias_para, folga, tempo_construcao_s=0.0):
+        self.peso = peso
+        self.marcos = marcos
+        self.distancias_de = distancias_de
+        self.distancias_para = distancias_para
+        self.folga = folga
+        self.tempo_construcao_s = tempo_construcao_s
+
+    @classmethod
+    def construir(cls, motor, peso='length', quantidade=8):
+        """Escolhe os marcos por ponto mais distante (farthest-point) e calcula as distâncias"""
+        inicio = time.time()
+        inf = float('inf')
+        n = motor.total_nos
+        marcos, distancias_de, distancias_para = [], [], []
+        # Primeiro marco: nó mais distante de um nó arbitrário
+        dist_inicial, _ = motor.arvore_caminhos(0, peso)
+        minimo = array('d', [inf]) * n
+        candidato = max(range(n), key=lambda v: dist_inicial[v] if dist_inicial[v] != inf else -1.0)
+        maior = 0.0
+        while len(marcos) < min(quantidade, n):
+            de, _ = motor.arvore_caminhos(candidato, peso)
+            para, _ = motor.arvore_caminhos(candidato, peso, reverso=True)
+            marcos.append(candidato)
+            distancias_de.append(array('f', de))
+            distancias_para.append(array('f', para))
+            # Próximo marco: nó alcançável que maximiza a menor distância aos marcos já escolhidos
+            candidato, melhor = None, -1.0
+            for v in range(n):
+                d = de[v]
+                if d != inf:
+                    maior = max(maior, d)
+                    if d < minimo[v]:
+                        minimo[v] = d
+                if minimo[v] != inf and minimo[v] > melhor:
+                    candidato, melhor = v, minimo[v]
+                d = para[v]
+                if d != inf:
+                    maior = max(maior, d)
+            if candidato is None or melhor <= 0:
+                break
+        # Arredondamento para float32: desconta o erro máximo para manter a heurística admissível
+        folga = 2 * maior * 2.0 ** -23
+        return cls(peso, marcos, distancias_de, distancias_para, folga, time.time() - inicio)
+
+    def memoria_bytes(self):
+        return sum(len(a) * a.itemsize for a in self.distancias_de + self.distancias_para)
+
+    def consultar(self, motor, origem, destino):
+        """A* com heurística ALT (com reabertura de nós, tolerante ao arredondamento float32)"""
+        pesos = motor.pesos(self.peso)
+        offsets, alvos, origens, desabilitadas = motor.offsets, motor.alvos, motor.origens, motor.desabilitadas
+        distancias, anteriores, _, heuristica = motor._buffers()
+        inf = float('inf')
+        heappush, heappop = heapq.heappush, heapq.heappop
+        folga = self.folga
+
+        # Marcos ativos: os que dão o melhor limite inferior na origem
+        limites = []
+        for de, para in zip(self.distancias_de, self.distancias_para):
+            limites.append((max(de[destino] - de[origem], para[origem] - para[destino]), de, para))
+        limites.sort(key=lambda x: x[0] if x[0] == x[0] else -inf, reverse=True)
+        ativos = [(de, de[destino], para, para[destino]) for _, de, para in limites[:self.MARCOS_ATIVOS]]
+
+        def h(no):
+            melhor = 0.0
+            for de, de_t, para, para_t in ativos:
+                x = de_t - de[no]
+                if x > melhor:
+                    melhor = x
+                x = para[no] - para_t
+                if x > melhor:
+                    melhor = x
+            return melhor - folga if melhor > folga else 0.0
+
+        tocados = [origem]
+        distancias[origem] = 0.0
+        fila_prioridade = [(h(origem), 0.0, origem)]
+        assentados = 0
+        try:
+            while fila_prioridade:
+                _, distancia_atual, no_atual = heappop(fila_prioridade)
+                if distancia_atual > distancias[no_atual]:
+                    continue
+                assentados += 1
+                if no_atual == destino:
+                    break
+                for e in range(offsets[no_atual], offsets[no_atual + 1]):
+                    if desabilitadas[e >> 3] & (1 << (e & 7)):
+                        continue
+                    vizinho = alvos[e]
+                    distancia = distancia_atual + pesos[e]
+                    if distancia < distancias[vizinho]:
+                        if distancias[vizinho] == inf:
+                            tocados.append(vizinho)
+                            heuristica[vizinho] = h(vizinho)
+                        distancias[vizinho] = distancia
+                        anteriores[vizinho] = e
+                        if heuristica[vizinho] != inf:
+                            heappush(fila_prioridade, (distancia + heuristica[vizinho], distancia, vizinho))
+            distancia_total = distancias[destino]
+            arestas = []
+            if distancia_total != inf:
+                no = destino
+                while no != origem:
+                    e = anteriores[no]
+                    arestas.append(e)
+                    no = origens[e]
+                arestas.reverse()
+            return distancia_total, arestas, assentados
+        finally:
+            for no in tocados:
+                distancias[no] = inf
+                anteriores[no] = -1
+
+class GeometriaArestas:
+    """
+    Geometria de todas as arestas CSR achatada na carga do grafo: um único buffer
+    com (lat, lng) intercalados e offsets por aresta. Pontos consecutivos repetidos
+    já são removidos aqui, e cada aresta marca se começa/termina exatamente nas
+    coordenadas dos seus nós, de modo que a emenda entre arestas consecutivas de um
+    caminho é descartada sem comparar coordenadas. Não há shapely no caminho da requisição.
+    """
+    TOLERANCIA = 0.000001
+
+    def __init__(self, coords, offsets, inicia_no_no, termina_no_no):
+        self.coords = coords
+        self.offsets = offsets
+        self.inicia_no_no = inicia_no_no
+        self.termina_no_no = termina_no_no
+        # Visão em bytes para copiar trechos com frombytes (serve para array e para mmap)
+        self._coords_bytes = memoryview(coords).cast('B')
+
+    @classmethod
+    def do_motor(cls, motor):
+        grafo = motor.grafo
+        tol = cls.TOLERANCIA
+        coords = array('d')
+        offsets = array('l', [0])
+        inicia_no_no = bytearray(motor.total_arestas)
+        termina_no_no = bytearray(motor.total_arestas)
+        for e in range(motor.total_arestas):
+            u, v = motor.origens[e], motor.alvos[e]
+            aresta = grafo[motor.nos[u]][motor.nos[v]][motor.chaves[e]]
+            if 'geometry' in aresta:
+                # Converter de (lng, lat) para (lat, lng)
+                pontos = [(lat, lng) for lng, lat in aresta['geometry'].coords]
+            else:
+                pontos = [(motor.lat[u], motor.lng[u]), (motor.lat[v], motor.lng[v])]
+            anterior = None
+            for lat, lng in pontos:
+                if anterior is not None and abs(lat - anterior[0]) < tol and abs(lng - anterior[1]) < tol:
+                    continue
+                coords.append(float(lat))
+                coords.append(float(lng))
+                anterior = (lat, lng)
+            offsets.append(len(coords) // 2)
+            ini, fim = offsets[e], offsets[e + 1]
+            if fim > ini:
+                inicia_no_no[e] = (abs(coords[2 * ini] - motor.lat[u]) < tol
+                                   and abs(coords[2 * ini + 1] - motor.lng[u]) < tol)
+                termina_no_no[e] = (abs(coords[2 * fim - 2] - motor.lat[v]) < tol
+                                    and abs(coords[2 * fim - 1] - motor.lng[v]) < tol)
+        return cls(coords, offsets, inicia_no_no, termina_no_no)
+
+    def memoria_bytes(self):
+        return (len(self.coords) * self.coords.itemsize + len(self.offsets) * self.offsets.itemsize
+                + len(self.inicia_no_no) + len(self.termina_no_no))
+
+    def montar(self, arestas):
+        """Concatena a geometria das arestas do caminho em um array (lat, lng intercalados)"""
+        coords, offsets, coords_bytes = self.coords, self.offsets, self._coords_bytes
+        inicia, termina = self.inicia_no_no, self.termina_no_no
+        tol = self.TOLERANCIA
+        saida = array('d')
+        anterior_termina = False
+        for e in arestas:
+            ini, fim = offsets[e], offsets[e + 1]
+            if saida and ini < fim:
+                if anterior_termina and inicia[e]:
+                    ini += 1
+                elif abs(coords[2 * ini] - saida[-2]) < tol and abs(coords[2 * ini + 1] - saida[-1]) < tol:
+                    ini += 1
+            # 16 bytes por ponto (lat, lng em float64)
+            saida.frombytes(coords_bytes[16 * ini:16 * fim])
+            anterior_termina = termina[e]
+        return saida
+
+    @staticmethod
+    def pares(coords):
+        """Array intercalado -> lista de [lat, lng] para JSON"""
+        it = iter(coords)
+        return [list(par) for par in zip(it, it)]
+
+class IndiceEspacial:
+    """
+    Grade uniforme sobre as coordenadas projetadas (metros) dos nós, construída
+    uma vez na carga do grafo. Substitui Point + project_geometry + nearest_nodes
+    por ponto: a projeção lat/lng é feita em lote e a busca percorre anéis de
+    células ao redor do ponto até garantir o mais próximo.
+    """
+    def __init__(self, xs, ys, projetar, tamanho_celula=None, crs=None):
+        self.xs = xs
+        self.ys = ys
+        self.projetar = projetar
+        self.crs = crs
+        n = len(xs)
+        self.min_x, self.min_y = min(xs), min(ys)
+        largura = max(xs) - self.min_x
+        altura = max(ys) - self.min_y
+        if tamanho_celula is None:
+            # ~4 nós por célula em média
+            tamanho_celula = max(25.0, math.sqrt(max(largura * altura, 1.0) / max(n, 1)) * 2)
+        self.tamanho_celula = tamanho_celula
+        self.colunas = int(largura // tamanho_celula) + 1
+        self.linhas = int(altura // tamanho_celula) + 1
+        self.celulas = {}
+        for i in range(n):
+            chave = (int((xs[i] - self.min_x) // tamanho_celula), int((ys[i] - self.min_y) // tamanho_celula))
+            self.celulas.setdefault(chave, []).append(i)
+
+    @classmethod
+    def do_grafo(cls, motor, grafo_proj=None):
+        """Usa o CRS do grafo projetado (pyproj); sem ele, projeção equiretangular local"""
+        crs = grafo_proj.graph.get('crs') if grafo_proj is not None else None
+        if crs is not None:
+            from pyproj import CRS
+            crs = CRS.from_user_input(crs).to_wkt()
+        projetar = cls.projetor(crs, motor)
+        xs, ys = projetar(list(motor.lng), list(motor.lat))
+        return cls(array('d', xs), array('d', ys), projetar, crs=crs)
+
+    @staticmethod
+    def projetor(crs, motor):
+        """Função (lngs, lats) -> (xs, ys) em metros para o CRS dado (ou equiretangular local)"""
+        if crs is not None:
+            from pyproj import Transformer
+            transformador = Transformer.from_crs('EPSG:4326', crs, always_xy=True)
+
+            def projetar(lngs, lats):
+                xs, ys = transformador.transform(lngs, lats)
+                return list(xs), list(ys)
+        else:
+            cos_ref = math.cos(math.radians(sum(motor.lat) / max(motor.total_nos, 1)))
+
+            def projetar(lngs, lats):
+                return ([RAIO_TERRA_M * math.radians(lng) * cos_ref for lng in lngs],
+                        [RAIO_TERRA_M * math.radians(lat) for lat in lats])
+        return projetar
+
+    def mais_proximo_xy(self, x, y, max_dist=None):
+        """(índice do nó, distância em metros) do nó mais próximo de (x, y) projetado"""
+        c = self.tamanho_celula
+        cx = int((x - self.min_x) // c)
+        cy = int((y - self.min_y) // c)
+        limite_aneis = max(abs(cx), abs(cy), abs(cx - self.colunas), abs(cy - self.linhas)) + 1
+        melhor, melhor_d2 = -1, float('inf')
+        xs, ys, celulas = self.xs, self.ys, self.celulas
+        # Anéis anteriores ao primeiro que toca a grade estão vazios
+        r = max(0, -cx, cx - self.colunas + 1, -cy, cy - self.linhas + 1)
+        while r <= limite_aneis:
+            # Só as células do anel r que caem dentro da grade
+            dy_min, dy_max = max(-r, -cy), min(r, self.linhas - 1 - cy)
+            for dx in range(max(-r, -cx), min(r, self.colunas - 1 - cx) + 1):
+                if abs(dx) == r:
+                    faixa = range(dy_min, dy_max + 1)
+                else:
+                    faixa = [dy for dy in (-r, r) if dy_min <= dy <= dy_max]
+                for dy in faixa:
+                    for i in celulas.get((cx + dx, cy + dy), ()):
+                        d2 = (xs[i] - x) ** 2 + (ys[i] - y) ** 2
+                        if d2 < melhor_d2:
+                            melhor, melhor_d2 = i, d2
+            # Células do próximo anel estão a pelo menos r * c do ponto
+            alcance = r * c
+            if melhor >= 0 and melhor_d2 <= alcance * alcance:
+                break
+            if max_dist is not None and alcance > max_dist:
+                break
+            r += 1
+        if melhor < 0:
+            return None, float('inf')
+        distancia = math.sqrt(melhor_d2)
+        if max_dist is not None and distancia > max_dist:
+            return None, distancia
+        return melhor, distancia
+
+    def mais_proximos(self, pontos, max_dist=None):
+        """Snapping em lote de [(lat, lng), ...]; retorna [(índice ou None, distância), ...]"""
+        if not pontos:
+            return []
+        xs, ys = self.projetar([p[1] for p in pontos], [p[0] for p in pontos])
+        return [self.mais_proximo_xy(x, y, max_dist) for x, y in zip(xs, ys)]
+
+class IndiceArestas:
+    """
+    Grade uniforme sobre os segmentos (projetados, em metros) da geometria das
+    arestas com nome. Cada segmento entra em todas as células que seu retângulo
+    envolvente toca; a busca percorre anéis de células até garantir o segmento
+    mais próximo. Base do reverse geocoding local (rua + cruzamento mais próximo).
+    """
+    def __init__(self, motor, projetar, tamanho_celula=None):
+        geometria = motor.geometria
+        self.motor = motor
+        self.projetar = projetar
+        self.nomes = [motor.nome_da_aresta(e) for e in range(motor.total_arestas)]
+        coords = geometria.coords
+        xs, ys = projetar(list(coords[1::2]), list(coords[0::2]))
+        self.xs, self.ys = array('d', xs), array('d', ys)
+        # Segmento k liga os pontos seg_ponto[k] e seg_ponto[k] + 1 da geometria
+        self.seg_ponto = array('l')
+        self.seg_aresta = array('l')
+        for e in range(motor.total_arestas):
+            if self.nomes[e] is None:
+                continue
+            for ponto in range(geometria.offsets[e], geometria.offsets[e + 1] - 1):
+                self.seg_ponto.append(ponto)
+                self.seg_aresta.append(e)
+        self.celulas = {}
+        if not self.seg_ponto:
+            return
+        self.min_x, self.min_y = min(self.xs), min(self.ys)
+        largura = max(self.xs) - self.min_x
+        altura = max(self.ys) - self.min_y
+        if tamanho_celula is None:
+            tamanho_celula = max(20.0, math.sqrt(max(largura * altura, 1.0) / len(self.seg_ponto)) * 2)
+        self.tamanho_celula = c = tamanho_celula
+        self.colunas = int(largura // c) + 1
+        self.linhas = int(altura // c) + 1
+        for k, ponto in enumerate(self.seg_ponto):
+            x1, y1, x2, y2 = self.xs[ponto], self.ys[ponto], self.xs[ponto + 1], self.ys[ponto + 1]
+            for cx in range(int((min(x1, x2) - self.min_x) // c), int((max(x1, x2) - self.min_x) // c) + 1):
+                for cy in range(int((min(y1, y2) - self.min_y) // c), int((max(y1, y2) - self.min_y) // c) + 1):
+                    self.celulas.setdefault((cx, cy), []).append(k)
+
+    def _distancia2(self, k, x, y):
+        """(distância² do ponto ao segmento k, parâmetro t da projeção no segmento)"""
+        ponto = self.seg_ponto[k]
+        x1, y1 = self.xs[ponto], self.ys[ponto]
+        dx, dy = self.xs[ponto + 1] - x1, self.ys[ponto + 1] - y1
+        comprimento2 = dx * dx + dy * dy
+        t = 0.0 if comprimento2 == 0 else min(1.0, max(0.0, ((x - x1) * dx + (y - y1) * dy) / comprimento2))
+        px, py = x1 + t * dx - x, y1 + t * dy - y
+        return px * px + py * py, t
+
+    def segmento_mais_proximo(self, x, y, max_dist=None):
+        """(segmento, distância em metros, t) do segmento mais próximo de (x, y) projetado"""
+        if not self.celulas:
+            return None, float('inf'), 0.0
+        c = self.tamanho_celula
+        cx = int((x - self.min_x) // c)
+        cy = int((y - self.min_y) // c)
+        limite_aneis = max(abs(cx), abs(cy), abs(cx - self.colunas), abs(cy - self.linhas)) + 1
+        melhor, melhor_d2, melhor_t = -1, float('inf'), 0.0
+        vistos = set()
+        r = max(0, -cx, cx - self.colunas + 1, -cy, cy - self.linhas + 1)
+        while r <= limite_aneis:
+            dy_min, dy_max = max(-r, -cy), min(r, self.linhas - 1 - cy)
+            for dx in range(max(-r, -cx), min(r, self.colunas - 1 - cx) + 1):
+                if abs(dx) == r:
+                    faixa = range(dy_min, dy_max + 1)
+                else:
+                    faixa = [dy for dy in (-r, r) if dy_min <= dy <= dy_max]
+                for dy in faixa:
+                    for k in self.celulas.get((cx + dx, cy + dy), ()):
+                        if k in vistos:
+                            continue
+                        vistos.add(k)
+                        d2, t = self._distancia2(k, x, y)
+                        if d2 < melhor_d2:
+                            melhor, melhor_d2, melhor_t = k, d2, t
+            # Segmentos ainda não vistos estão a pelo menos r * c do ponto
+            alcance = r * c
+            if melhor >= 0 and melhor_d2 <= alcance * alcance:
+                break
+            if max_dist is not None and alcance > max_dist:
+                break
+            r += 1
+        if melhor < 0:
+            return None, float('inf'), 0.0
+        distancia = math.sqrt(melhor_d2)
+        if max_dist is not None and distancia > max_dist:
+            return None, distancia, 0.0
+        return melhor, distancia, melhor_t
+
+    def _cruzamento(self, e, rua, t_na_aresta):
+        """Nome de outra rua incidente ao nó da aresta mais próximo do ponto (depois ao outro)"""
+        motor = self.motor
+        nos = (motor.origens[e], motor.alvos[e])
+        if t_na_aresta > 0.5:
+            nos = nos[::-1]
+        for no in nos:
+            incidentes = itertools.chain(
+                range(motor.offsets[no], motor.offsets[no + 1]),
+                (motor.arestas_rev[i] for i in range(motor.offsets_rev[no], motor.offsets_rev[no + 1])))
+            for outra in incidentes:
+                nome = self.nomes[outra]
+                if nome is not None and nome != rua:
+                    return nome
+        return None
+
+    def reverso(self, pontos, max_dist=None):
+        """Reverse geocoding em lote de [(lat, lng), ...]; None para pontos sem rua próxima"""
+        if not pontos:
+            return []
+        geometria = self.motor.geometria
+        coords = geometria.coords
+        xs, ys = self.projetar([p[1] for p in pontos], [p[0] for p in pontos])
+        resultados = []
+        for x, y in zip(xs, ys):
+            k, distancia, t = self.segmento_mais_proximo(x, y, max_dist)
+            if k is None:
+                resultados.append(None)
+                continue
+            e, ponto = self.seg_aresta[k], self.seg_ponto[k]
+            lat = coords[2 * ponto] + t * (coords[2 * ponto + 2] - coords[2 * ponto])
+            lng = coords[2 * ponto + 1] + t * (coords[2 * ponto + 3] - coords[2 * ponto + 1])
+            # Posição relativa ao longo da aresta, pelo índice do segmento na geometria
+            pontos_aresta = geometria.offsets[e + 1] - geometria.offsets[e] - 1
+            t_na_aresta = (ponto - geometria.offsets[e] + t) / max(pontos_aresta, 1)
+            rua = self.nomes[e]
+            cruzamento = self._cruzamento(e, rua, t_na_aresta)
+            nome = f'{rua}, próximo a {cruzamento}' if cruzamento else rua
+            resultados.append({
+                'nome': f'{nome}, Maricá - RJ',
+                'rua': rua,
+                'cruzamento': cruzamento,
+                'lat': lat,
+                'lng': lng,
+                'distancia_m': round(distancia, 1)
+            })
+        return resultados
+
+def normalizar_texto(texto):
+    """Minúsculas, sem acentos e com espaços simples (para buscas insensíveis a acento/caixa)"""
+    texto = unicodedata.normalize('NFKD', str(texto))
+    texto = ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+    texto = ''.join(c if c.isalnum() else ' ' for c in texto)
+    return ' '.join(texto.split())
+
+def _trigramas(texto):
+    texto = f'  {texto} '
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+class GeocodificadorLocal:
+    """
+    Geocodificador offline construído a partir dos nomes (name/ref) das arestas.
+    Cada rua vira uma entrada com a coordenada do seu nó mais próximo do centróide;
+    a busca combina prefixo do nome, prefixo por palavra e similaridade por trigramas.
+    """
+    SCORE_MINIMO = 0.45
+
+    def __init__(self, motor):
+        nos_por_nome = {}
+        exibicao = {}
+        for e in range(motor.total_arestas):
+            for valor in motor.rotulos_da_aresta(e):
+                chave = normalizar_texto(valor)
+                if not chave:
+                    continue
+                nos = nos_por_nome.setdefault(chave, set())
+                nos.add(motor.origens[e])
+                nos.add(motor.alvos[e])
+                exibicao.setdefault(chave, valor)
+        self.nomes = sorted(nos_por_nome)
+        self.exibicao = [exibicao[chave] for chave in self.nomes]
+        self.coordenadas = []
+        for chave in self.nomes:
+            nos = nos_por_nome[chave]
+            lat_c = sum(motor.lat[i] for i in nos) / len(nos)
+            lng_c = sum(motor.lng[i] for i in nos) / len(nos)
+            i = min(nos, key=lambda i: (motor.lat[i] - lat_c) ** 2 + (motor.lng[i] - lng_c) ** 2)
+            self.coordenadas.append((motor.lat[i], motor.lng[i]))
+        # Prefixo por palavra: lista ordenada de (palavra, entrada)
+        self.palavras = sorted((palavra, idx) for idx, chave in enumerate(self.nomes) for palavra in set(chave.split()))
+        self.indice_trigramas = {}
+        for idx, chave in enumerate(self.nomes):
+            for tri in _trigramas(chave):
+                self.indice_trigramas.setdefault(tri, []).append(idx)
+
+    def __len__(self):
+        return len(self.nomes)
+
+    def _por_prefixo_palavra(self, prefixo):
+        inicio = bisect.bisect_left(self.palavras, (prefixo,))
+        encontrados = set()
+        for palavra, idx in itertools.islice(self.palavras, inicio, None):
+            if not palavra.startswith(prefixo):
+                break
+            encontrados.add(idx)
+        return encontrados
+
+    def buscar(self, consulta, limite=5):
+        """Retorna [{'nome', 'lat', 'lng', 'score'}, ...] ordenado por relevância"""
+        q = normalizar_texto(consulta)
+        if not q:
+            return []
+        scores = {}
+        # 1) Nome começando pela consulta
+        inicio = bisect.bisect_left(self.nomes, q)
+        for idx in range(inicio, len(self.nomes)):
+            if not self.nomes[idx].startswith(q):
+                break
+            scores[idx] = 1.0
+        # 2) Todas as palavras da consulta como prefixo de palavras do nome
+        palavras = q.split()
+        candidatos = None
+        for palavra in palavras:
+            achados = self._por_prefixo_palavra(palavra)
+            candidatos = achados if candidatos is None else candidatos & achados
+            if not candidatos:
+                break
+        for idx in candidatos or ():
+            scores[idx] = max(scores.get(idx, 0.0), 0.9)
+        # 3) Similaridade por trigramas (tolerante a erros de digitação)
+        if len(scores) < limite:
+            tri_q = _trigramas(q)
+            contagem = {}
+            for tri in tri_q:
+                for idx in self.indice_trigramas.get(tri, ()):
+                    contagem[idx] = contagem.get(idx, 0) + 1
+            for idx, comuns in contagem.items():
+                similaridade = comuns / len(tri_q | _trigramas(self.nomes[idx])) if comuns else 0.0
+                score = min(similaridade, 0.8)
+                if score >= self.SCORE_MINIMO and score > scores.get(idx, 0.0):
+                    scores[idx] = score
+        melhores = sorted(scores.items(), key=lambda item: (-item[1], len(self.nomes[item[0]])))[:limite]
+        return [{
+            'nome': f'{self.exibicao[idx]}, Maricá - RJ',
+            'lat': self.coordenadas[idx][0],
+            'lng': self.coordenadas[idx][1],
+            'score': round(score, 3)
+        } for idx, score in melhores]
+
+class CacheGeocodificacao:
+    """Cache em disco (sqlite) das respostas do Nominatim, incluindo as buscas sem resultado"""
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        self._pronto = False
+
+    def _conectar(self):
+        conexao = sqlite3.connect(self.caminho, timeout=5)
+        if not self._pronto:
+            conexao.execute('CREATE TABLE IF NOT EXISTS geocodificacao ('
+                            'consulta TEXT PRIMARY KEY, resposta TEXT, criado REAL)')
+            self._pronto = True
+        return conexao
+
+    def obter(self, consulta):
+        """(True, resposta) se a consulta está no cache (resposta pode ser None), senão (False, None)"""
+        try:
+            with self._lock:
+                conexao = self._conectar()
+                try:
+                    linha = conexao.execute('SELECT resposta FROM geocodificacao WHERE consulta = ?', (consulta,)).fetchone()
+                finally:
+                    conexao.close()
+        except sqlite3.Error as e:
+            logger.warning("Cache de geocodificação indisponível: %s", e)
+            return False, None
+        if linha is None:
+            return False, None
+        return True, json.loads(linha[0])
+
+    def guardar(self, consulta, resposta):
+        try:
+            with self._lock:
+                os.makedirs(os.path.dirname(self.caminho) or '.', exist_ok=True)
+                conexao = self._conectar()
+                try:
+                    with conexao:
+                        conexao.execute('INSERT OR REPLACE INTO geocodificacao VALUES (?, ?, ?)',
+                                        (consulta, json.dumps(resposta), time.time()))
+                finally:
+                    conexao.close()
+        except sqlite3.Error as e:
+            logger.warning("Falha ao gravar cache de geocodificação: %s", e)
+
+cache_geocodificacao = CacheGeocodificacao(
+    os.environ.get('GEOCODE_CACHE_FILE') or os.path.join(base_dir, 'data', 'geocode_cache.sqlite'))
+
+class SnapshotGrafo:
+    """
+    Snapshot binário do motor compilado: ids e coordenadas dos nós (inclusive
+    projetadas), CSR direto e reverso, pesos e bloqueios base (sem cenário),
+    classe e maxspeed das vias (para os perfis de modo), geometria achatada,
+    nomes das ruas e, se houver, os marcos ALT do cenário padrão. Cada array fica alinhado a 8
+    bytes depois de um cabeçalho JSON; a carga mapeia o arquivo (mmap somente
+    leitura) e usa memoryviews sobre as páginas, sem parse nem cópia, de modo
+    que vários workers compartilham a mesma memória do page cache.
+    """
+    MAGICO = b'RMSNAP3\n'
+    ALINHAMENTO = 8
+
+    @classmethod
+    def salvar(cls, motor, caminho, origem=None):
+        geometria, indice = motor.geometria, motor.indice_espacial
+        arrays = [
+            ('nos', array('q', motor.nos)),
+            ('offsets', motor.offsets), ('alvos', motor.alvos), ('origens', motor.origens),
+            ('offsets_rev', motor.offsets_rev), ('arestas_rev', motor.arestas_rev),
+            ('lat', motor.lat), ('lng', motor.lng),
+            ('lat_rad', motor.lat_rad), ('lng_rad', motor.lng_rad), ('cos_lat', motor.cos_lat),
+            ('desabilitadas_base', memoryview(motor.desabilitadas_base).cast('B')),
+            ('pesos_base', motor.pesos_base),
+            ('rotulos_offsets', motor.rotulos_offsets), ('rotulos_ids', motor.rotulos_ids),
+            ('classes', motor.classes), ('velocidades_max', motor.velocidades_max),
+            ('xs', indice.xs), ('ys', indice.ys),
+            ('geo_coords', geometria.coords), ('geo_offsets', geometria.offsets),
+            ('geo_inicia', memoryview(geometria.inicia_no_no).cast('B')),
+            ('geo_termina', memoryview(geometria.termina_no_no).cast('B')),
+        ]
+        alt = None
+        if motor.alt is not None:
+            alt = {'peso': motor.alt.peso, 'marcos': list(motor.alt.marcos), 'folga': motor.alt.folga,
+                   'cenario': list(motor.cenario.chave) if motor.cenario is not None else None}
+            for i, (de, para) in enumerate(zip(motor.alt.distancias_de, motor.alt.distancias_para)):
+                arrays.append((f'alt_de_{i}', de))
+                arrays.append((f'alt_para_{i}', para))
+        descricao, posicao = [], 0
+        for nome, arr in arrays:
+            tipo = getattr(arr, 'typecode', None) or arr.format
+            posicao = -(-posicao // cls.ALINHAMENTO) * cls.ALINHAMENTO
+            descricao.append([nome, tipo, arr.itemsize, posicao, len(arr)])
+            posicao += len(arr) * arr.itemsize
+        cabecalho = {
+            'byteorder': sys.byteorder,
+            'origem': origem,
+            'crs': indice.crs,
+            'rotulos': motor.rotulos,
+            'classes_via': motor.classes_via,
+            'estatisticas': motor.estatisticas,
+            'alt': alt,
+            'arrays': descricao
         }
-        
+        tmp = caminho + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(cls.MAGICO)
+            f.write(json.dumps(cabecalho).encode('utf-8') + b'\n')
+            inicio = -(-f.tell() // cls.ALINHAMENTO) * cls.ALINHAMENTO
+            for (nome, arr), (_, _, _, deslocamento, _) in zip(arrays, descricao):
+                f.write(b'\0' * (inicio + deslocamento - f.tell()))
+                f.write(memoryview(arr).cast('B'))
+        os.replace(tmp, caminho)
+
+    @classmethod
+    def abrir(cls, caminho):
+        """(cabeçalho, {nome: memoryview}) com os arrays mapeados do arquivo"""
+        with open(caminho, 'rb') as f:
+            if f.readline() != cls.MAGICO:
+                raise ValueError('Arquivo de snapshot inválido')
+            cabecalho = json.loads(f.readline().decode('utf-8'))
+            inicio = -(-f.tell() // cls.ALINHAMENTO) * cls.ALINHAMENTO
+            if cabecalho.get('byteorder') != sys.byteorder:
+                raise ValueError('Snapshot gerado com outra ordem de bytes')
+            mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        bruto = memoryview(mapa)
+        arrays = {}
+        for nome, tipo, tamanho_item, deslocamento, tamanho in cabecalho['arrays']:
+            if array(tipo).itemsize != tamanho_item:
+                raise ValueError(f'Snapshot incompatível: {nome} usa {tamanho_item} bytes por item')
+            ini = inicio + deslocamento
+            arrays[nome] = bruto[ini:ini + tamanho * tamanho_item].cast(tipo)
+        return cabecalho, arrays
+
+def carregar_snapshot(caminho, graphml_file, semente=None, proporcao=None):
+    """Motor completo a partir do snapshot, ou None se ausente, inválido ou desatualizado"""
+    if not os.path.exists(caminho):
+        return None
+    inicio = time.time()
+    try:
+        cabecalho, arrays = SnapshotGrafo.abrir(caminho)
+    except (OSError, ValueError) as e:
+        logger.warning("⚠️ Snapshot %s ignorado: %s", caminho, e)
+        return None
+    origem_atual = origem_snapshot(graphml_file)
+    origem = cabecalho.get('origem') or {}
+    # Sem o graphml presente o snapshot vale sozinho (distribuído sem o XML)
+    if any(origem.get(campo) != valor for campo, valor in origem_atual.items()):
+        logger.warning("⚠️ Snapshot %s não corresponde ao graphml atual (rode preprocessar.py)", caminho)
+        return None
+    motor = montar_motor_snapshot(cabecalho, arrays, CenarioPesos.gerar(len(arrays['alvos']), semente, proporcao))
+    motor.arquivo_snapshot = caminho
+    logger.info("✅ Snapshot %s mapeado em %.0f ms", caminho, (time.time() - inicio) * 1000)
+    return motor
+
+def montar_motor_snapshot(cabecalho, arrays, cenario):
+    """Motor completo sobre os arrays mapeados de um snapshot, com o cenário dado aplicado"""
+    motor = GrafoCompilado.do_snapshot(cabecalho, arrays)
+    motor.aplicar_cenario(cenario)
+    projetar = IndiceEspacial.projetor(cabecalho['crs'], motor)
+    motor.indice_espacial = IndiceEspacial(arrays['xs'], arrays['ys'], projetar, crs=cabecalho['crs'])
+    motor.geometria = GeometriaArestas(arrays['geo_coords'], arrays['geo_offsets'],
+                                       arrays['geo_inicia'], arrays['geo_termina'])
+    alt = cabecalho.get('alt')
+    # Marcos só valem para o peso e o cenário com que foram calculados (e reprodutível)
+    if (alt and alt['peso'] == PESO_PREPROCESSAMENTO and motor.cenario.semente is not None
+            and alt.get('cenario') == list(motor.cenario.chave)):
+        quantidade = len(alt['marcos'])
+        motor.alt = MarcosALT(alt['peso'], alt['marcos'],
+                              [arrays[f'alt_de_{i}'] for i in range(quantidade)],
+                              [arrays[f'alt_para_{i}'] for i in range(quantidade)],
+                              alt['folga'])
+    return motor
+
+def carregar_hierarquia(motor, caminho):
+    """Anexa a hierarquia persistida ao motor se ela corresponder ao grafo carregado"""
+    if not os.path.exists(caminho):
+        return None
+    try:
+        hierarquia = HierarquiaContracao.carregar(caminho)
     except Exception as e:
-        print(f"Erro ao obter rota por geometria: {e}")
-        return {'sucesso': False, 'erro': str(e)}
+        logger.warning("⚠️ Não foi possível ler a hierarquia %s: %s", caminho, e)
+        return None
+    if hierarquia.assinatura != motor.assinatura(hierarquia.peso):
+        logger.warning("⚠️ Hierarquia %s não corresponde ao grafo carregado (defina RANDOMIZAR_SEMENTE e rode preprocessar.py)", caminho)
+        return None
+    motor.hierarquia = hierarquia
+    logger.info("✅ Contraction Hierarchy carregada: %d atalhos", hierarquia.total_atalhos)
+    return hierarquia
+
+def normalizar_estrategia(estrategia=None):
+    """Valida a estratégia de busca pedida, usando o padrão do servidor quando ausente"""
+    est = (estrategia or ESTRATEGIA_PADRAO).strip().lower()
+    if est not in ESTRATEGIAS_BUSCA:
+        raise ValueError(f"Estratégia de busca inválida: {estrategia} (use {', '.join(ESTRATEGIAS_BUSCA)})")
+    return est
 
 class GraphRouter:
-    def __init__(self, grafo):
+    def __init__(self, grafo, motor=None):
         self.grafo = grafo
-    def shortest_path(self, origem_no, destino_no, peso='length'):
-        return dijkstra_customizado(self.grafo, origem_no, destino_no, peso)
-def calcular_rota_entre_pontos(origem_lat, origem_lng, destino_lat, destino_lng, modo='driving'):
-    """Calcula rota entre dois pontos usando Dijkstra"""
+        atual = motor_atual()
+        if motor is None and atual is not None and (grafo is None or atual.grafo is grafo):
+            motor = atual
+        self.motor = motor
+    def search(self, origem_no, destino_no, peso='length', estrategia=None):
+        """Busca com a estratégia escolhida, incluindo a contagem de nós assentados"""
+        estrategia = normalizar_estrategia(estrategia)
+        if self.motor is not None:
+            with cronometro('busca', estrategia=self.motor.estrategia_efetiva(estrategia, peso)):
+                return self._search(origem_no, destino_no, peso, estrategia)
+        return self._search(origem_no, destino_no, peso, estrategia)
+    def _search(self, origem_no, destino_no, peso, estrategia):
+        if self.motor is None:
+            caminho, distancia = dijkstra_customizado(self.grafo, origem_no, destino_no, peso)
+            return {'caminho': caminho, 'distancia': distancia, 'arestas': None,
+                    'nos_assentados': None, 'estrategia': 'dijkstra'}
+        resultado = self.motor.caminho_minimo(origem_no, destino_no, peso, estrategia)
+        resultado['estrategia'] = self.motor.estrategia_efetiva(estrategia, peso)
+        return resultado
+    def shortest_path(self, origem_no, destino_no, peso='length', estrategia=None):
+        resultado = self.search(origem_no, destino_no, peso, estrategia)
+        return resultado['caminho'], resultado['distancia']
+# Distância máxima (m) entre um ponto e o nó onde ele é encaixado; vazio = sem limite
+SNAP_DISTANCIA_MAX_M = float(os.environ['SNAP_DISTANCIA_MAX_M']) if os.environ.get('SNAP_DISTANCIA_MAX_M') else None
+
+def nos_mais_proximos(pontos, max_dist=None):
+    """
+    Encaixa todos os pontos [(lat, lng), ...] de uma vez nos nós do grafo.
+    Levanta ValueError se algum ponto estiver a mais de max_dist metros do nó mais próximo.
+    """
+    with cronometro('snap'):
+        return _nos_mais_proximos(pontos, max_dist)
+
+def _nos_mais_proximos(pontos, max_dist=None):
+    if max_dist is None:
+        max_dist = SNAP_DISTANCIA_MAX_M
+    motor = motor_atual()
+    if motor is None or motor.indice_espacial is None:
+        return [ox.nearest_nodes(grafo, lng, lat) for lat, lng in pontos]
+    nos = []
+    for (lat, lng), (i, distancia) in zip(pontos, motor.indice_espacial.mais_proximos(pontos, max_dist)):
+        if i is None:
+            raise ValueError(f'Ponto ({lat:.6f}, {lng:.6f}) está a mais de {max_dist:.0f} m da via mais próxima')
+        nos.append(motor.nos[i])
+    return nos
+
+def no_mais_proximo(lat, lng):
+    """Nó do grafo mais próximo da coordenada"""
+    return nos_mais_proximos([(lat, lng)])[0]
+
+def matriz_distancias(motor, origens, destinos, peso='length'):
+    """
+    Matriz de distâncias entre nós (índices do motor), sem N² buscas ponto a ponto.
+    Com hierarquia carregada usa o many-to-many por baldes; senão uma árvore
+    de busca compartilhada por linha (ou por coluna, no sentido reverso, quando
+    há menos destinos que origens). Retorna (matriz, método).
+    """
+    if motor.hierarquia is not None and motor.hierarquia.peso == peso:
+        return motor.hierarquia.matriz(origens, destinos), 'ch-baldes'
+    matriz, _, metodo = matriz_arvores(motor, origens, destinos, peso)
+    return matriz, metodo
+
+def matriz_arvores(motor, origens, destinos, peso='length', somar=None):
+    """
+    Matriz por árvores de busca compartilhadas: uma por linha, ou por coluna (no
+    sentido reverso) quando há menos destinos que origens. Com 'somar' (outro peso,
+    ex.: 'length') também monta a matriz desse peso somado ao longo dos mesmos
+    caminhos mínimos, sem outra rodada de buscas.
+    Retorna (matriz, matriz de 'somar' ou None, método).
+    """
+    somas = [] if somar is not None else None
+    if len(destinos) < len(origens):
+        colunas, colunas_somas = [], []
+        for destino in destinos:
+            distancias, anteriores = motor.arvore_caminhos(destino, peso, reverso=True, alvos=origens)
+            colunas.append([distancias[origem] for origem in origens])
+            if somar is not None:
+                colunas_somas.append(motor.somar_na_arvore(destino, anteriores, origens, somar, reverso=True))
+        if somar is not None:
+            somas = [list(linha) for linha in zip(*colunas_somas)]
+        return [list(linha) for linha in zip(*colunas)], somas, 'arvores-reversas'
+    matriz = []
+    for origem in origens:
+        distancias, anteriores = motor.arvore_caminhos(origem, peso, alvos=destinos)
+        matriz.append([distancias[destino] for destino in destinos])
+        if somar is not None:
+            somas.append(motor.somar_na_arvore(origem, anteriores, destinos, somar))
+    return matriz, somas, 'arvores'
+
+def desvios_insercao(motor, base, candidatos, peso='length', somar='length'):
+    """
+    Desvio de inserir cada candidato na melhor perna da rota base (índices do motor).
+    Uma matriz a partir das origens das pernas (árvores para frente) e outra até os
+    destinos das pernas (árvores reversas), em vez de 2N rotas completas. A perna é
+    escolhida por 'peso'; o desvio em 'somar' (ex.: a distância quando 'peso' é um
+    tempo) é o dos mesmos caminhos, somado nas mesmas árvores.
+    Retorna ([(desvio, perna, desvio em 'somar'), ...] por candidato, custo base,
+    base em 'somar', métodos).
+    """
+    inf = float('inf')
+    origens_pernas, destinos_pernas = base[:-1], base[1:]
+    pernas = len(origens_pernas)
+    ida, ida_somas, metodo_ida = matriz_arvores(motor, origens_pernas, candidatos + destinos_pernas, peso, somar)
+    volta, volta_somas, metodo_volta = matriz_arvores(motor, candidatos, destinos_pernas, peso, somar)
+    custo_pernas = [ida[i][len(candidatos) + i] for i in range(pernas)]
+    soma_pernas = [ida_somas[i][len(candidatos) + i] for i in range(pernas)]
+    resultados = []
+    for c in range(len(candidatos)):
+        melhor = (inf, -1, inf)
+        for i in range(pernas):
+            desvio = ida[i][c] + volta[c][i] - custo_pernas[i]
+            if desvio < melhor[0]:
+                melhor = (desvio, i, ida_somas[i][c] + volta_somas[c][i] - soma_pernas[i])
+        resultados.append(melhor)
+    return resultados, sum(custo_pernas), sum(soma_pernas), (metodo_ida, metodo_volta)
+
+ISOCRONA_CELULA_M = float(os.environ.get('ISOCRONA_CELULA_M', '75'))
+ISOCRONA_MAX_MIN = float(os.environ.get('ISOCRONA_MAX_MIN', '60'))
+ISOCRONA_MAX_LIMITES = 6
+cache_isocronas = CacheRotas(int(os.environ.get('ISOCRONA_CACHE_MAX_COORDS', '200000')),
+                             float(os.environ.get('ROTA_CACHE_TTL_S', '600')),
+                             medir=lambda resultado: resultado['pontos'])
+
+def calcular_isocronas(motor, origem, limites_s, peso, celula_m=None):
+    """
+    Isócronas a partir do nó 'origem' (índice do motor) para vários limites de uma vez.
+    Uma única busca limitada ao maior limite; o tempo dos nós assentados é
+    interpolado ao longo das arestas alcançadas numa grade (menor tempo por
+    célula, dilatada em uma célula para cobrir as margens das vias) e cada
+    polígono é a curva de nível da grade no limite. Coordenadas numa projeção
+    equiretangular local. Retorna (features GeoJSON, nós assentados, pontos).
+    """
+    celula = celula_m or ISOCRONA_CELULA_M
+    maximo = max(limites_s)
+    distancias, _ = motor.arvore_caminhos(origem, peso, limite=maximo)
+    tempos_nos = np.frombuffer(distancias, dtype=np.float64)
+    escala_y = RAIO_TERRA_M * math.pi / 180
+    escala_x = escala_y * math.cos(math.radians(motor.lat[origem]))
+    xs_nos = np.frombuffer(motor.lng, dtype=np.float64) * escala_x
+    ys_nos = np.frombuffer(motor.lat, dtype=np.float64) * escala_y
+    origens = np.frombuffer(motor.origens, dtype=f'i{motor.origens.itemsize}')
+    alvos = np.frombuffer(motor.alvos, dtype=f'i{motor.alvos.itemsize}')
+    pesos = np.frombuffer(motor.pesos(peso), dtype=np.float64)
+    bloqueadas = np.unpackbits(np.frombuffer(motor.desabilitadas, dtype=np.uint8),
+                               count=motor.total_arestas, bitorder='little').astype(bool)
+    inicio_aresta = tempos_nos[origens]
+    arestas = np.flatnonzero((inicio_aresta <= maximo) & ~bloqueadas & np.isfinite(pesos))
+    # Amostras a cada meia célula ao longo de cada aresta alcançada (reta entre os nós)
+    x0, y0 = xs_nos[origens[arestas]], ys_nos[origens[arestas]]
+    dx, dy = xs_nos[alvos[arestas]] - x0, ys_nos[alvos[arestas]] - y0
+    segmentos = np.maximum(1, np.ceil(np.hypot(dx, dy) / (celula / 2)).astype(np.int64))
+    qual = np.repeat(np.arange(len(arestas)), segmentos + 1)
+    fracao = (np.arange(len(qual)) - np.repeat(np.cumsum(segmentos + 1) - (segmentos + 1), segmentos + 1)) / segmentos[qual]
+    px = np.append(x0[qual] + fracao * dx[qual], xs_nos[origem])
+    py = np.append(y0[qual] + fracao * dy[qual], ys_nos[origem])
+    pt = np.append(inicio_aresta[arestas][qual] + fracao * pesos[arestas][qual], 0.0)
+    dentro = pt <= maximo
+    px, py, pt = px[dentro], py[dentro], pt[dentro]
+    # Grade com 2 células de margem: a borda fica sempre fora e as curvas fecham
+    x_min, y_min = px.min() - 2 * celula, py.min() - 2 * celula
+    colunas = int((px.max() - x_min) / celula) + 3
+    linhas = int((py.max() - y_min) / celula) + 3
+    grade = np.full(linhas * colunas, 2.0 * maximo)
+    np.minimum.at(grade, ((py - y_min) / celula).astype(np.int64) * colunas + ((px - x_min) / celula).astype(np.int64), pt)
+    grade = grade.reshape(linhas, colunas)
+    dilatada = grade.copy()
+    for dl in (-1, 0, 1):
+        for dc in (-1, 0, 1):
+            np.minimum(dilatada[1:-1, 1:-1], grade[1 + dl:linhas - 1 + dl, 1 + dc:colunas - 1 + dc], out=dilatada[1:-1, 1:-1])
+    gerador = contourpy.contour_generator(x_min + (np.arange(colunas) + 0.5) * celula,
+                                          y_min + (np.arange(linhas) + 0.5) * celula,
+                                          dilatada, fill_type='OuterOffset')
+    features, total_pontos = [], 0
+    for limite in sorted(limites_s):
+        poligonos = []
+        for pontos, offsets in zip(*gerador.filled(-1.0, limite)):
+            coords = np.column_stack((pontos[:, 0] / escala_x, pontos[:, 1] / escala_y)).round(6).tolist()
+            poligonos.append([coords[a:b] for a, b in zip(offsets[:-1], offsets[1:])])
+            total_pontos += len(coords)
+        features.append({
+            'type': 'Feature',
+            'properties': {'limite_s': limite, 'nos_alcancados': int(np.count_nonzero(tempos_nos <= limite))},
+            'geometry': {'type': 'MultiPolygon', 'coordinates': poligonos}
+        })
+    return features, int(np.count_nonzero(tempos_nos <= maximo)), total_pontos
+
+def _custo_sequencia(matriz, seq):
+    return sum(matriz[a][b] for a, b in zip(seq, seq[1:]))
+
+def _ordem_held_karp(matriz, inicio, fim, livres):
+    """Programação dinâmica exata (Held-Karp) sobre os pontos livres"""
+    inf = float('inf')
+    k = len(livres)
+    custo = {}
+    for j, p in enumerate(livres):
+        custo[(1 << j, j)] = (matriz[inicio][p], -1)
+    for mascara in range(1, 1 << k):
+        for j in range(k):
+            if not mascara & (1 << j) or (mascara, j) not in custo:
+                continue
+            c, _ = custo[(mascara, j)]
+            if c == inf:
+                continue
+            for l in range(k):
+                if mascara & (1 << l):
+                    continue
+                nova = mascara | (1 << l)
+                nc = c + matriz[livres[j]][livres[l]]
+                if nc < custo.get((nova, l), (inf, -1))[0]:
+                    custo[(nova, l)] = (nc, j)
+    cheia = (1 << k) - 1
+    melhor, ultimo = inf, -1
+    for j in range(k):
+        c = custo.get((cheia, j), (inf, -1))[0] + matriz[livres[j]][fim]
+        if c < melhor:
+            melhor, ultimo = c, j
+    if ultimo < 0:
+        return None
+    ordem = []
+    mascara = cheia
+    while ultimo >= 0:
+        ordem.append(livres[ultimo])
+        ultimo, mascara = custo[(mascara, ultimo)][1], mascara & ~(1 << ultimo)
+    ordem.reverse()
+    return [inicio] + ordem + [fim]
+
+def _ordem_heuristica(matriz, inicio, fim, livres):
+    """Vizinho mais próximo seguido de 2-opt e Or-opt até não haver melhora (matriz assimétrica)"""
+    restantes = set(livres)
+    seq = [inicio]
+    while restantes:
+        proximo = min(restantes, key=lambda p: matriz[seq[-1]][p])
+        seq.append(proximo)
+        restantes.discard(proximo)
+    seq.append(fim)
+    melhor = _custo_sequencia(matriz, seq)
+    melhorou = True
+    while melhorou:
+        melhorou = False
+        # 2-opt: inverte o trecho seq[i..j]
+        for i in range(1, len(seq) - 2):
+            for j in range(i + 1, len(seq) - 1):
+                candidata = seq[:i] + seq[i:j + 1][::-1] + seq[j + 1:]
+                custo = _custo_sequencia(matriz, candidata)
+                if custo < melhor - 1e-9:
+                    seq, melhor, melhorou = candidata, custo, True
+        # Or-opt: move blocos de 1 a 3 pontos para outra posição
+        for tamanho in (1, 2, 3):
+            movido = False
+            for i in range(1, len(seq) - tamanho):
+                bloco = seq[i:i + tamanho]
+                resto = seq[:i] + seq[i + tamanho:]
+                for j in range(1, len(resto)):
+                    if j == i:
+                        continue
+                    candidata = resto[:j] + bloco + resto[j:]
+                    custo = _custo_sequencia(matriz, candidata)
+                    if custo < melhor - 1e-9:
+                        seq, melhor, movido = candidata, custo, True
+                        break
+                if movido:
+                    break
+            melhorou |= movido
+    return seq
+
+# Acima deste número de paradas livres a DP exata fica cara; usa heurística
+LIMITE_ORDEM_EXATA = 10
+
+def otimizar_ordem_paradas(matriz, circuito=False):
+    """
+    Ordem de visita que minimiza o custo total.
+    Caminho aberto: origem (0) e destino (último) fixos, paradas livres no meio.
+    Circuito: sai da origem, visita todos os demais pontos e volta à origem.
+    Retorna a sequência de índices de pontos (None se algum ponto for inalcançável).
+    """
+    n = len(matriz)
+    if circuito:
+        inicio, fim, livres = 0, 0, list(range(1, n))
+    else:
+        inicio, fim, livres = 0, n - 1, list(range(1, n - 1))
+    if len(livres) <= LIMITE_ORDEM_EXATA:
+        seq = _ordem_held_karp(matriz, inicio, fim, livres)
+    else:
+        seq = _ordem_heuristica(matriz, inicio, fim, livres)
+    if seq is None or _custo_sequencia(matriz, seq) == float('inf'):
+        return None
+    return seq
+
+def calcular_rota_entre_pontos(origem_lat, origem_lng, destino_lat, destino_lng, modo='driving', estrategia=None,
+                               origem_no=None, destino_no=None):
+    """
+    Calcula rota entre dois pontos no grafo local, pelo menor tempo de viagem do modo
+    (origem_no/destino_no evitam um novo snapping); sem grafo, usa o OSRM.
+    """
     try:
-        if grafo is None:
+        if motor_atual() is None:
             profile = 'driving' if modo == 'driving' else ('walking' if modo == 'walking' else 'cycling')
             waypoints = [(origem_lat, origem_lng), (destino_lat, destino_lng)]
             res = chamar_osrm_route(profile, waypoints)
@@ -316,53 +2869,145 @@ def calcular_rota_entre_pontos(origem_lat, origem_lng, destino_lat, destino_lng,
                 'sucesso': True,
                 'caminho': caminho,
                 'distancia': res.get('distance_m') or 0.0,
+                'tempo_s': res.get('duration_s'),
                 'nos_count': len(caminho),
                 'modo': modo
             }
 
-        # Encontrar nós mais próximos das coordenadas (com projeção quando disponível)
-        origem_no = None
-        destino_no = None
+        # Encontrar nós mais próximos das coordenadas (índice espacial, em lote)
         try:
-            if grafo_proj is not None:
-                from shapely.geometry import Point
-                p_origem = Point(origem_lng, origem_lat)
-                p_destino = Point(destino_lng, destino_lat)
-                p_origem_proj, _ = ox.projection.project_geometry(p_origem, to_crs=grafo_proj.graph.get('crs'))
-                p_destino_proj, _ = ox.projection.project_geometry(p_destino, to_crs=grafo_proj.graph.get('crs'))
-                origem_no = ox.nearest_nodes(grafo_proj, p_origem_proj.x, p_origem_proj.y)
-                destino_no = ox.nearest_nodes(grafo_proj, p_destino_proj.x, p_destino_proj.y)
-        except Exception:
-            pass
-        if origem_no is None or destino_no is None:
-            try:
-                origem_no = ox.nearest_nodes(grafo, origem_lng, origem_lat)
-                destino_no = ox.nearest_nodes(grafo, destino_lng, destino_lat)
-            except Exception as e2:
-                return {'sucesso': False, 'erro': f'Erro ao encontrar nos mais proximos: {str(e2)}'}
+            if origem_no is None or destino_no is None:
+                origem_no, destino_no = nos_mais_proximos([(origem_lat, origem_lng), (destino_lat, destino_lng)])
+        except Exception as e2:
+            return {'sucesso': False, 'erro': f'Erro ao encontrar nos mais proximos: {str(e2)}'}
 
         if origem_no is None or destino_no is None:
             return {'sucesso': False, 'erro': 'Nao foi possivel encontrar nos validos para as coordenadas fornecidas'}
 
         # Usar a função de geometria para obter rota precisa
-        resultado = obter_rota_por_geometria(origem_no, destino_no)
+        resultado = obter_rota_por_geometria(origem_no, destino_no, estrategia, modo)
         
         if resultado['sucesso']:
             return {
                 'sucesso': True,
                 'caminho': resultado['caminho'],
                 'distancia': resultado['distancia'],
+                'tempo_s': resultado['tempo_s'],
                 'nos_count': resultado['nos_count'],
+                'nos_assentados': resultado['nos_assentados'],
+                'estrategia': resultado['estrategia'],
                 'modo': modo
             }
         else:
             return {'sucesso': False, 'erro': resultado.get('erro', 'Erro desconhecido')}
             
     except Exception as e:
-        import traceback
-        print(f"Erro completo ao calcular rota: {traceback.format_exc()}")
+        logger.exception("Erro completo ao calcular rota")
         return {'sucesso': False, 'erro': f'Erro ao calcular rota: {str(e)}'}
 
+def calcular_alternativas(motor, origem_no, destino_no, peso, k, estrategia, formato='json', zoom=None,
+                          custo_otimo=None):
+    """
+    Até k alternativas à rota ótima entre dois nós (método dos platôs), no formato
+    das rotas da API, com o custo relativo e a fração compartilhada com a ótima.
+    'custo_otimo' é o custo da rota principal, quando já calculada (evita refazer a busca).
+    """
+    rotas, custo_otimo, assentados = motor.rotas_alternativas(
+        motor.indice[origem_no], motor.indice[destino_no], peso, k, estrategia, custo_otimo)
+    alternativas = []
+    for custo, arestas, compartilhado in rotas:
+        if peso == 'length':
+            distancia, tempo = custo, None
+        else:
+            distancia, tempo = motor.comprimento(arestas), custo
+        with cronometro('geometria'):
+            coords = GeometriaArestas.pares(motor.geometria.montar(arestas))
+        alternativas.append({
+            **serializar_caminho(coords, formato, zoom),
+            'distancia': distancia,
+            'tempo_s': tempo,
+            'nos_count': len(arestas) + 1,
+            'razao_custo': round(custo / custo_otimo, 3),
+            'sobreposicao': round(compartilhado / custo_otimo, 3)
+        })
+    return alternativas, assentados
+
+FORMATOS_GEOMETRIA = ('json', 'polyline', 'polyline6', 'int32')
+
+def tolerancia_zoom(zoom, lat):
+    """Meio pixel do zoom (Web Mercator, tiles de 256 px) em metros, na latitude dada"""
+    return 156543.03392 * math.cos(math.radians(lat)) / 2 ** zoom / 2
+
+def simplificar_douglas_peucker(coords, tolerancia_m):
+    """
+    Douglas-Peucker iterativo sobre um array (n, 2) de (lat, lng), com distâncias em
+    metros numa projeção equiretangular local; mantém sempre o primeiro e o último ponto.
+    """
+    n = len(coords)
+    if n < 3 or tolerancia_m <= 0:
+        return coords
+    escala_y = RAIO_TERRA_M * math.pi / 180
+    ys = coords[:, 0] * escala_y
+    xs = coords[:, 1] * escala_y * math.cos(math.radians(float(coords[:, 0].mean())))
+    manter = np.zeros(n, dtype=bool)
+    manter[0] = manter[-1] = True
+    pilha = [(0, n - 1)]
+    while pilha:
+        i, j = pilha.pop()
+        if j - i < 2:
+            continue
+        dx, dy = xs[j] - xs[i], ys[j] - ys[i]
+        px, py = xs[i + 1:j] - xs[i], ys[i + 1:j] - ys[i]
+        comprimento2 = dx * dx + dy * dy
+        t = np.clip((px * dx + py * dy) / comprimento2, 0.0, 1.0) if comprimento2 > 0 else 0.0
+        distancias = np.hypot(px - t * dx, py - t * dy)
+        k = int(np.argmax(distancias))
+        if distancias[k] > tolerancia_m:
+            meio = i + 1 + k
+            manter[meio] = True
+            pilha.append((i, meio))
+            pilha.append((meio, j))
+    return coords[manter]
+
+def codificar_polyline(coords, precisao=5):
+    """Encoded polyline do Google (lat, lng) na precisão dada (5 casas; 6 no formato do OSRM/Valhalla)"""
+    deltas = np.diff(np.round(coords * 10 ** precisao).astype(np.int64), axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    saida = []
+    for valor in deltas.ravel().tolist():
+        valor = ~(valor << 1) if valor < 0 else valor << 1
+        while valor >= 0x20:
+            saida.append(chr((0x20 | (valor & 0x1f)) + 63))
+            valor >>= 5
+        saida.append(chr(valor + 63))
+    return ''.join(saida)
+
+def codificar_int32_delta(coords, precisao=6):
+    """int32 little-endian em base64: primeiro ponto absoluto, depois deltas de (lat, lng) * 10^precisao"""
+    deltas = np.diff(np.round(coords * 10 ** precisao).astype(np.int64), axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    return base64.b64encode(deltas.astype('<i4').tobytes()).decode('ascii')
+
+def serializar_caminho(caminho, formato='json', zoom=None):
+    """
+    Campos da geometria da resposta: simplifica para o zoom (se pedido) e codifica
+    no formato escolhido. Com os padrões devolve só {'caminho': caminho}, como antes.
+    """
+    if formato == 'json' and zoom is None:
+        return {'caminho': caminho}
+    coords = np.asarray(caminho, dtype=np.float64).reshape(-1, 2)
+    originais = len(coords)
+    if zoom is not None and originais > 2:
+        coords = simplificar_douglas_peucker(coords, tolerancia_zoom(zoom, float(coords[:, 0].mean())))
+    campos = {'formato_geometria': formato, 'pontos': len(coords), 'pontos_originais': originais}
+    if formato == 'polyline':
+        campos.update(caminho=codificar_polyline(coords, 5), precisao=5)
+    elif formato == 'polyline6':
+        campos.update(caminho=codificar_polyline(coords, 6), precisao=6)
+    elif formato == 'int32':
+        campos.update(caminho=codificar_int32_delta(coords, 6), precisao=6)
+    else:
+        campos['caminho'] = coords.tolist()
+    return campos
+
 @app.route('/')
 def index():
     """Página principal"""
@@ -388,20 +3033,35 @@ def api_buscar_endereco():
         except (ValueError, AttributeError):
             pass
         
+        # Primeiro o geocodificador local (nomes das ruas do grafo)
+        motor = motor_atual()
+        if motor is not None and motor.geocodificador is not None:
+            resultados = motor.geocodificador.buscar(query)
+            if resultados:
+                return jsonify({'sucesso': True, 'fonte': 'local', 'resultados': resultados})
+        
         # Adicionar "Maricá RJ" à busca para melhor precisão
         query_completa = f"{query}, Maricá, Rio de Janeiro, Brazil"
         
-        # Fazer geocoding
-        location = geocode_com_rate_limit(query_completa)
+        # Nominatim só em caso de falha local, com cache em disco
+        chave = normalizar_texto(query_completa)
+        encontrado, resultado = cache_geocodificacao.obter(chave)
+        fonte = 'cache'
+        if not encontrado:
+            location = geocode_com_rate_limit(query_completa)
+            resultado = {
+                'nome': location.address,
+                'lat': location.latitude,
+                'lng': location.longitude
+            } if location else None
+            cache_geocodificacao.guardar(chave, resultado)
+            fonte = 'nominatim'
         
-        if location:
+        if resultado:
             return jsonify({
                 'sucesso': True,
-                'resultados': [{
-                    'nome': location.address,
-                    'lat': location.latitude,
-                    'lng': location.longitude
-                }]
+                'fonte': fonte,
+                'resultados': [resultado]
             })
         else:
             return jsonify({
@@ -415,31 +3075,75 @@ def api_buscar_endereco():
             'mensagem': f'Erro ao buscar endereço: {str(e)}'
         })
 
+REVERSO_MAX_PONTOS = int(os.environ.get('REVERSO_MAX_PONTOS', '1000'))
+REVERSO_DISTANCIA_MAX_M = float(os.environ.get('REVERSO_DISTANCIA_MAX_M', '500'))
+
 @app.route('/api/reverse_geocode', methods=['POST'])
 def api_reverse_geocode_route():
-    """Faz reverse geocoding (coordenadas -> endereço)"""
+    """
+    Faz reverse geocoding (coordenadas -> endereço).
+    Aceita {lat, lng} ou {pontos: [[lat, lng], ...]} (lote, resposta em 'lotes');
+    'enriquecer': true consulta também o Nominatim.
+    """
     try:
         dados = request.json
+        enriquecer = bool(dados.get('enriquecer', False))
+        pontos = dados.get('pontos')
+        
+        if pontos is not None:
+            if not isinstance(pontos, list) or len(pontos) > REVERSO_MAX_PONTOS:
+                return jsonify({'sucesso': False, 'mensagem': f'Informe até {REVERSO_MAX_PONTOS} pontos [lat, lng]'})
+            pontos = [(float(p[0]), float(p[1])) for p in pontos]
+            lotes = reverso_local(pontos)
+            return jsonify({'sucesso': True, 'lotes': [
+                {'sucesso': True, 'fonte': 'local', 'resultados': [r]} if r else
+                {'sucesso': False, 'mensagem': 'Endereço não encontrado para essas coordenadas'}
+                for r in lotes
+            ]})
+        
         lat = dados.get('lat')
         lng = dados.get('lng')
         
         if lat is None or lng is None:
             return jsonify({'sucesso': False, 'mensagem': 'Coordenadas não fornecidas'})
         
-        return api_reverse_geocode(float(lat), float(lng))
+        return api_reverse_geocode(float(lat), float(lng), enriquecer)
     except Exception as e:
         return jsonify({'sucesso': False, 'mensagem': f'Erro ao fazer reverse geocoding: {str(e)}'})
 
-def api_reverse_geocode(lat, lng):
-    """Função auxiliar para reverse geocoding"""
+def reverso_local(pontos):
+    """Reverse geocoding pelo índice de arestas do grafo; lista de None se não houver grafo"""
+    motor = motor_atual()
+    if motor is None or motor.indice_arestas is None:
+        return [None] * len(pontos)
+    with cronometro('reverso'):
+        return motor.indice_arestas.reverso(pontos, REVERSO_DISTANCIA_MAX_M)
+
+def api_reverse_geocode(lat, lng, enriquecer=False):
+    """Função auxiliar para reverse geocoding: local primeiro, Nominatim só se pedido ou sem resposta local"""
     try:
-        location = reverse_geocode_com_rate_limit(f"{lat}, {lng}")
+        resultado = reverso_local([(lat, lng)])[0]
+        if resultado and not enriquecer:
+            return jsonify({'sucesso': True, 'fonte': 'local', 'resultados': [resultado]})
+        
+        try:
+            location = reverse_geocode_com_rate_limit(f"{lat}, {lng}")
+        except Exception as e:
+            if not resultado:
+                raise
+            logger.warning("Nominatim indisponível para enriquecer o reverse geocoding: %s", e)
+            location = None
         if location:
-            return jsonify({'sucesso': True, 'resultados': [{
+            resultados = [{
                 'nome': location.address,
                 'lat': location.latitude,
                 'lng': location.longitude
-            }]})
+            }]
+            if resultado:
+                resultados.append(resultado)
+            return jsonify({'sucesso': True, 'fonte': 'nominatim', 'resultados': resultados})
+        elif resultado:
+            return jsonify({'sucesso': True, 'fonte': 'local', 'resultados': [resultado]})
         else:
             return jsonify({'sucesso': False, 'mensagem': 'Endereço não encontrado para essas coordenadas'})
     except Exception as e:
@@ -456,6 +3160,22 @@ def api_calcular_rota():
         destino_lng = dados.get('destino_lng')
         paradas = dados.get('paradas') or []
         modo = dados.get('modo', 'driving')
+        formato_geometria = dados.get('formato_geometria', 'json')
+        if formato_geometria not in FORMATOS_GEOMETRIA:
+            return jsonify({'sucesso': False, 'mensagem': f"formato_geometria inválido (use {', '.join(FORMATOS_GEOMETRIA)})"})
+        zoom = dados.get('simplificar_zoom')
+        try:
+            zoom = None if zoom is None else min(22, max(0, int(zoom)))
+            k_alternativas = int(dados.get('alternativas') or 0)
+            if not 0 <= k_alternativas <= ALTERNATIVAS_MAX:
+                raise ValueError(f'alternativas deve estar entre 0 e {ALTERNATIVAS_MAX}')
+            if k_alternativas and paradas:
+                raise ValueError('Rotas alternativas só estão disponíveis para rotas sem paradas')
+            estrategia = normalizar_estrategia(dados.get('estrategia'))
+            peso = peso_do_modo(modo)
+            fixar_cenario(dados)
+        except ValueError as e:
+            return jsonify({'sucesso': False, 'mensagem': str(e)})
         
         if not all([origem_lat, origem_lng, destino_lat, destino_lng]):
             return jsonify({
@@ -464,7 +3184,7 @@ def api_calcular_rota():
             })
         
         # Se grafo não estiver inicializado, usar OSRM diretamente com paradas
-        if grafo is None:
+        if motor_atual() is None:
             profile = 'driving' if modo == 'driving' else ('walking' if modo == 'walking' else 'cycling')
             wps = [(float(origem_lat), float(origem_lng))]
             for p in paradas:
@@ -481,8 +3201,9 @@ def api_calcular_rota():
             caminho = [[latlng[1], latlng[0]] for latlng in coords if isinstance(latlng, (list, tuple)) and len(latlng) >= 2]
             return jsonify({
                 'sucesso': True,
-                'caminho': caminho,
+                **serializar_caminho(caminho, formato_geometria, zoom),
                 'distancia': res.get('distance_m') or 0.0,
+                'tempo_s': res.get('duration_s'),
                 'nos_count': len(caminho),
                 'modo': modo
             })
@@ -496,14 +3217,49 @@ def api_calcular_rota():
                 continue
         pontos.append({'lat': float(destino_lat), 'lng': float(destino_lng)})
 
+        # Snapping de todos os pontos em uma única chamada
+        try:
+            max_snap = dados.get('distancia_max_snap_m')
+            nos = nos_mais_proximos([(p['lat'], p['lng']) for p in pontos],
+                                    float(max_snap) if max_snap is not None else None)
+        except Exception as e:
+            return jsonify({'sucesso': False, 'mensagem': f'Erro ao encontrar nos mais proximos: {str(e)}'})
+        for p, no in zip(pontos, nos):
+            p['no'] = no
+
+        otimizacao = None
+        motor = motor_atual()
+        if dados.get('otimizar_ordem') and motor is not None and len(pontos) > 3:
+            circuito = bool(dados.get('circuito'))
+            inicio = time.perf_counter()
+            indices = [motor.indice[p['no']] for p in pontos]
+            matriz, _ = matriz_distancias(motor, indices, indices, peso)
+            meio = time.perf_counter()
+            seq = otimizar_ordem_paradas(matriz, circuito)
+            fim = time.perf_counter()
+            if seq is None:
+                return jsonify({'sucesso': False, 'mensagem': 'Há paradas inalcançáveis entre si no grafo'})
+            pontos = [pontos[i] for i in seq]
+            otimizacao = {
+                # Índices na lista original de pontos (0 = origem, paradas 1..n, último = destino)
+                'ordem_pontos': seq,
+                'circuito': circuito,
+                'metodo': 'held-karp' if len(seq) - 2 <= LIMITE_ORDEM_EXATA else '2-opt/or-opt',
+                'tempo_matriz_ms': round((meio - inicio) * 1000, 2),
+                'tempo_solver_ms': round((fim - meio) * 1000, 2)
+            }
+
         caminho_total = []
         distancia_total = 0.0
+        tempo_total = 0.0
         nos_total = 0
+        assentados_trechos = []
 
         for i in range(len(pontos) - 1):
             a = pontos[i]
             b = pontos[i + 1]
-            seg = calcular_rota_entre_pontos(a['lat'], a['lng'], b['lat'], b['lng'], modo)
+            seg = calcular_rota_entre_pontos(a['lat'], a['lng'], b['lat'], b['lng'], modo, estrategia,
+                                             origem_no=a['no'], destino_no=b['no'])
             if not seg.get('sucesso'):
                 return jsonify({'sucesso': False, 'mensagem': seg.get('erro', 'Erro ao calcular segmento')})
             seg_caminho = seg.get('caminho', [])
@@ -512,15 +3268,34 @@ def api_calcular_rota():
                     seg_caminho = seg_caminho[1:]
             caminho_total.extend(seg_caminho)
             distancia_total += float(seg.get('distancia') or 0.0)
+            tempo_total += float(seg.get('tempo_s') or 0.0)
             nos_total += int(seg.get('nos_count') or 0)
+            assentados_trechos.append(seg.get('nos_assentados'))
 
-        return jsonify({
+        resposta = {
             'sucesso': True,
-            'caminho': caminho_total,
+            **serializar_caminho(caminho_total, formato_geometria, zoom),
             'distancia': distancia_total,
+            'tempo_s': tempo_total,
             'nos_count': nos_total,
+            'nos_assentados': sum(n or 0 for n in assentados_trechos),
+            'nos_assentados_trechos': assentados_trechos,
+            'estrategia': seg.get('estrategia', estrategia),
+            'estrategia_pedida': estrategia,
+            # Sem CH/ALT para o peso do modo a estratégia pedida é substituída
+            'estrategia_substituida': seg.get('estrategia', estrategia) != estrategia,
+            'otimizacao': otimizacao,
+            'cenario': descrever_cenario(motor_atual()),
             'modo': modo
-        })
+        }
+        if k_alternativas and motor is not None:
+            # Árvores de busca compartilhadas: custa poucas buscas, não k buscas com pesos penalizados
+            with cronometro('alternativas'):
+                resposta['alternativas'], resposta['nos_assentados_alternativas'] = calcular_alternativas(
+                    motor, pontos[0]['no'], pontos[-1]['no'], peso, k_alternativas, estrategia,
+                    formato_geometria, zoom, distancia_total if peso == 'length' else tempo_total)
+        with cronometro('serializacao'):
+            return jsonify(resposta)
         
     except Exception as e:
         return jsonify({
@@ -528,11 +3303,378 @@ def api_calcular_rota():
             'mensagem': f'Erro ao calcular rota: {str(e)}'
         })
 
+MATRIZ_MAX_PONTOS = int(os.environ.get('MATRIZ_MAX_PONTOS', '500'))
+
+def _codificar_matriz_float32(matriz):
+    """Matriz em float32 little-endian, linha a linha, codificada em base64"""
+    arr = array('f', (v for linha in matriz for v in linha))
+    if sys.byteorder != 'little':
+        arr.byteswap()
+    return base64.b64encode(arr.tobytes()).decode('ascii')
+
+@app.route('/api/matriz', methods=['POST'])
+def api_matriz():
+    """
+    Matriz de menor tempo de viagem (s) entre origens e destinos no grafo local,
+    no perfil do modo (só vias acessíveis). Com incluir_distancias, também a
+    distância (m) de cada um desses mesmos caminhos, somada nas árvores de busca
+    (o many-to-many da CH não guarda caminhos, então ela fica de fora).
+    """
+    try:
+        dados = request.json or {}
+        origens = dados.get('origens')
+        destinos = dados.get('destinos') or origens
+        modo = dados.get('modo', 'driving')
+        formato = dados.get('formato', 'json')
+        incluir_distancias = bool(dados.get('incluir_distancias', False))
+        if not isinstance(origens, list) or not origens or not isinstance(destinos, list):
+            return jsonify({'sucesso': False, 'mensagem': 'Parâmetros origens/destinos inválidos'})
+        if len(origens) > MATRIZ_MAX_PONTOS or len(destinos) > MATRIZ_MAX_PONTOS:
+            return jsonify({'sucesso': False, 'mensagem': f'Limite excedido: máximo {MATRIZ_MAX_PONTOS} origens e destinos'})
+        if formato not in ('json', 'base64'):
+            return jsonify({'sucesso': False, 'mensagem': 'Formato inválido (use json ou base64)'})
+        try:
+            peso = peso_do_modo(modo)
+            motor = fixar_cenario(dados)
+        except ValueError as e:
+            return jsonify({'sucesso': False, 'mensagem': str(e)})
+        if motor is None:
+            return jsonify({'sucesso': False, 'mensagem': 'Matriz disponível apenas com grafo local'})
+        inicio = time.perf_counter()
+        nos = nos_mais_proximos([(float(p[0]), float(p[1])) for p in origens + destinos])
+        idx_origens = [motor.indice[no] for no in nos[:len(origens)]]
+        idx_destinos = [motor.indice[no] for no in nos[len(origens):]]
+        if incluir_distancias:
+            tempos, distancias, metodo = matriz_arvores(motor, idx_origens, idx_destinos, peso, somar='length')
+        else:
+            tempos, metodo = matriz_distancias(motor, idx_origens, idx_destinos, peso)
+        resposta = {
+            'sucesso': True,
+            'linhas': len(idx_origens),
+            'colunas': len(idx_destinos),
+            'modo': modo,
+            'metodo': metodo,
+            'cenario': descrever_cenario(motor),
+            'formato': formato,
+            'tempo_ms': round((time.perf_counter() - inicio) * 1000, 2)
+        }
+        if formato == 'base64':
+            resposta['tempos'] = _codificar_matriz_float32(tempos)
+            if incluir_distancias:
+                resposta['distancias'] = _codificar_matriz_float32(distancias)
+        else:
+            inf = float('inf')
+            resposta['tempos'] = [[None if t == inf else round(t, 1) for t in linha] for linha in tempos]
+            if incluir_distancias:
+                resposta['distancias'] = [[None if d == inf else round(d, 1) for d in linha] for linha in distancias]
+        with cronometro('serializacao'):
+            return jsonify(resposta)
+    except Exception as e:
+        logger.exception("Erro na API matriz")
+        return jsonify({'sucesso': False, 'mensagem': f'Erro ao calcular matriz: {str(e)}'})
+
+# Roteamento em lote: pares origem/destino distribuídos num pool de processos.
+# Cada worker reimporta o app e mapeia o snapshot; o padrão é conservador para
+# instâncias pequenas (o CLI lote.py usa todas as CPUs)
+LOTE_PROCESSOS = int(os.environ.get('LOTE_PROCESSOS', '2'))
+LOTE_TAMANHO_BLOCO = int(os.environ.get('LOTE_TAMANHO_BLOCO', '200'))
+LOTE_PROGRESSO_S = float(os.environ.get('LOTE_PROGRESSO_S', '1.0'))
+LOTE_CONTEXTO = os.environ.get('LOTE_CONTEXTO', 'spawn')
+CAMPOS_PAR_LOTE = ('origem_lat', 'origem_lng', 'destino_lat', 'destino_lng')
+
+def ler_pares_lote(linhas):
+    """
+    Pares origem/destino de um texto em NDJSON (um objeto ou lista por linha) ou CSV
+    com cabeçalho (origem_lat, origem_lng, destino_lat, destino_lng e, opcional, id).
+    Linhas ilegíveis viram {'_erro': mensagem} para sair como falha no resultado.
+    """
+    linhas = iter(linhas)
+    for primeira in linhas:
+        if primeira.strip():
+            break
+    else:
+        return
+    if primeira.lstrip()[:1] not in ('{', '['):
+        yield from csv.DictReader(itertools.chain([primeira], linhas))
+        return
+    for linha in itertools.chain([primeira], linhas):
+        if linha.strip():
+            try:
+                yield json.loads(linha)
+            except ValueError:
+                yield {'_erro': 'Linha NDJSON inválida'}
+
+def opcoes_lote(dados):
+    """Opções do lote (modo, estratégia, cenário, geometria), validadas; levanta ValueError"""
+    modo = dados.get('modo') or 'driving'
+    formato = dados.get('formato_geometria') or 'json'
+    if formato not in FORMATOS_GEOMETRIA:
+        raise ValueError(f"formato_geometria inválido (use {', '.join(FORMATOS_GEOMETRIA)})")
+    zoom = dados.get('simplificar_zoom')
+    max_dist = dados.get('distancia_max_snap_m')
+    cenario = dados.get('cenario')
+    return {
+        'modo': modo,
+        'peso': peso_do_modo(modo),
+        'estrategia': normalizar_estrategia(dados.get('estrategia')),
+        'cenario': interpretar_cenario(cenario if cenario not in ('', None) else None),
+        'geometria': str(dados.get('geometria', False)).lower() in ('1', 'true', 'sim'),
+        'formato_geometria': formato,
+        'simplificar_zoom': None if zoom in (None, '') else min(22, max(0, int(zoom))),
+        'distancia_max_snap_m': float(max_dist) if max_dist not in (None, '') else None
+    }
+
+# Estado de cada worker do pool: o motor sobre o snapshot mapeado e a CH (carregada sob demanda)
+_lote_caminho_ch = None
+
+def _iniciar_worker_lote(caminho, caminho_ch, cenario, dimensoes):
+    global motor_roteamento, _lote_caminho_ch
+    cabecalho, arrays = SnapshotGrafo.abrir(caminho)
+    motor = montar_motor_snapshot(cabecalho, arrays, cenario)
+    if (motor.total_nos, motor.total_arestas) != dimensoes:
+        raise ValueError(f'Snapshot {caminho} não corresponde ao grafo do servidor')
+    motor_roteamento = motor
+    _lote_caminho_ch = caminho_ch
+
+def _rotear_bloco_lote(bloco, opcoes):
+    """Roteia [(índice, par), ...] no worker; retorna os registros de resultado na mesma ordem"""
+    global _lote_caminho_ch
+    motor = motor_roteamento
+    if opcoes['estrategia'] == 'ch' and _lote_caminho_ch:
+        carregar_hierarquia(motor, _lote_caminho_ch)
+        _lote_caminho_ch = None
+    if opcoes['cenario'] is not None:
+        motor = motor.para_cenario(*opcoes['cenario'])
+    peso, estrategia = opcoes['peso'], opcoes['estrategia']
+    max_dist = opcoes['distancia_max_snap_m']
+    if max_dist is None:
+        max_dist = SNAP_DISTANCIA_MAX_M
+    registros, validos, pontos = [], [], []
+    for indice, par in bloco:
+        registro = {'tipo': 'rota', 'indice': indice}
+        try:
+            if isinstance(par, dict):
+                if par.get('id') not in (None, ''):
+                    registro['id'] = par['id']
+                if '_erro' in par:
+                    raise ValueError(par['_erro'])
+                valores = [float(par[campo]) for campo in CAMPOS_PAR_LOTE]
+            else:
+                valores = [float(v) for v in par]
+                if len(valores) != 4:
+                    raise ValueError
+            if not all(math.isfinite(v) for v in valores):
+                raise ValueError
+        except (KeyError, TypeError, ValueError) as e:
+            registro.update(sucesso=False, mensagem=str(e) if isinstance(e, ValueError) and str(e) else 'Par inválido')
+        else:
+            validos.append(registro)
+            pontos.append((valores[0], valores[1]))
+            pontos.append((valores[2], valores[3]))
+        registros.append(registro)
+    encaixes = motor.indice_espacial.mais_proximos(pontos, max_dist)
+    for k, registro in enumerate(validos):
+        (origem, _), (destino, _) = encaixes[2 * k], encaixes[2 * k + 1]
+        if origem is None or destino is None:
+            registro.update(sucesso=False, mensagem=f'Ponto a mais de {max_dist:.0f} m da via mais próxima')
+            continue
+        distancia, arestas, assentados = motor.buscar(origem, destino, peso, estrategia)
+        if distancia == float('inf'):
+            registro.update(sucesso=False, mensagem='Não foi possível encontrar caminho')
+            continue
+        if peso == 'length':
+            distancia, tempo = distancia, None
+        else:
+            distancia, tempo = motor.comprimento(arestas), distancia
+        registro.update(sucesso=True, distancia=round(distancia, 1),
+                        tempo_s=None if tempo is None else round(tempo, 1),
+                        nos_count=len(arestas) + 1, nos_assentados=assentados)
+        if opcoes['geometria']:
+            coords = motor.geometria.montar(arestas)
+            if opcoes['formato_geometria'] == 'json' and opcoes['simplificar_zoom'] is None:
+                coords = GeometriaArestas.pares(coords)
+            registro.update(serializar_caminho(coords, opcoes['formato_geometria'], opcoes['simplificar_zoom']))
+    return registros
+
+class ProcessadorLote:
+    """
+    Pool de processos do roteamento em lote. Os workers não recebem o grafo por
+    pickle: mapeiam (mmap, somente leitura) o snapshot da versão atual, de modo
+    que as páginas ficam compartilhadas no page cache. Se a versão não veio de
+    um snapshot, um snapshot temporário é gravado uma vez por versão. O pool só
+    é criado no primeiro lote e é recriado quando a versão do grafo muda.
+    """
+    def __init__(self, processos=None):
+        self._lock = threading.Lock()
+        self.processos = max(1, processos or LOTE_PROCESSOS)
+        self._pool = None
+        self._versao = None
+        self._temporario = None
+
+    def preparar(self, motor):
+        """Pool de workers para a versão do motor (cria, ou recria se a versão mudou)"""
+        raiz = motor._raiz
+        with self._lock:
+            if self._pool is not None and self._versao == raiz.versao:
+                return self._pool
+            self._descartar()
+            caminho = raiz.arquivo_snapshot
+            if caminho is None:
+                with cronometro('lote_snapshot'):
+                    descritor, caminho = tempfile.mkstemp(prefix='rotamarcio-lote-', suffix='.snap')
+                    os.close(descritor)
+                    SnapshotGrafo.salvar(raiz, caminho)
+                self._temporario = caminho
+            caminho_ch = None
+            if raiz.hierarquia is not None and os.environ.get('GRAPH_MODE', 'osrm').lower() == 'graphml':
+                caminho_ch = caminho_hierarquia(arquivo_graphml())
+            self._pool = ProcessPoolExecutor(
+                self.processos, mp_context=multiprocessing.get_context(LOTE_CONTEXTO),
+                initializer=_iniciar_worker_lote,
+                initargs=(caminho, caminho_ch, raiz.cenario, (raiz.total_nos, raiz.total_arestas)))
+            self._versao = raiz.versao
+            logger.info("✅ Pool do lote: %d processos sobre %s", self.processos, caminho)
+            return self._pool
+
+    def _descartar(self, esperar=False):
+        # Blocos em andamento no pool antigo terminam antes de o snapshot temporário sair
+        pool, temporario = self._pool, self._temporario
+        self._pool, self._versao, self._temporario = None, None, None
+        if pool is None:
+            return
+        def encerrar():
+            pool.shutdown(wait=True)
+            if temporario:
+                try:
+                    os.remove(temporario)
+                except OSError:
+                    pass
+        if esperar:
+            encerrar()
+        else:
+            threading.Thread(target=encerrar, daemon=True).start()
+
+    def encerrar(self):
+        """Encerra o pool esperando os blocos em andamento"""
+        with self._lock:
+            self._descartar(esperar=True)
+
+    def executar(self, motor, pares, opcoes):
+        """
+        Roteia os pares (iterável, consumido sob demanda) e gera, na ordem de entrada,
+        os registros {'tipo': 'rota', ...}, intercalados com {'tipo': 'progresso', ...}
+        a cada LOTE_PROGRESSO_S e encerrados por {'tipo': 'resumo', ...}.
+        """
+        pool = self.preparar(motor)
+        pendentes = deque()
+        inicio = ultimo = time.perf_counter()
+        contagem = {'total': 0, 'sucesso': 0, 'falhas': 0}
+
+        def andamento(tipo):
+            decorrido = time.perf_counter() - inicio
+            return {'tipo': tipo, 'processados': contagem['total'], 'sucesso': contagem['sucesso'],
+                    'falhas': contagem['falhas'], 'decorrido_s': round(decorrido, 2),
+                    'pares_por_s': round(contagem['total'] / decorrido, 1) if decorrido > 0 else None}
+
+        def colher():
+            nonlocal pool
+            futuro, bloco, enviado = pendentes.popleft()
+            try:
+                registros = futuro.result()
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    with self._lock:
+                        if self._pool is pool:
+                            self._descartar()
+                mensagem = f'Falha no worker do lote: {e}'
+                registros = [{'tipo': 'rota', 'indice': indice, 'sucesso': False, 'mensagem': mensagem}
+                             for indice, _ in bloco]
+            metricas.observar('rotamarcio_etapa_segundos', time.perf_counter() - enviado, etapa='lote_bloco')
+            for registro in registros:
+                contagem['total'] += 1
+                contagem['sucesso' if registro.get('sucesso') else 'falhas'] += 1
+            return registros
+
+        def blocos():
+            bloco = []
+            for indice, par in enumerate(pares):
+                bloco.append((indice, par))
+                if len(bloco) >= LOTE_TAMANHO_BLOCO:
+                    yield bloco
+                    bloco = []
+            if bloco:
+                yield bloco
+
+        # Janela limitada de blocos em voo: a entrada é lida no ritmo dos workers
+        for bloco in blocos():
+            try:
+                futuro = pool.submit(_rotear_bloco_lote, bloco, opcoes)
+            except (BrokenProcessPool, RuntimeError):
+                pool = self.preparar(motor)
+                futuro = pool.submit(_rotear_bloco_lote, bloco, opcoes)
+            pendentes.append((futuro, bloco, time.perf_counter()))
+            while len(pendentes) >= 2 * self.processos or (pendentes and pendentes[0][0].done()):
+                yield from colher()
+                if time.perf_counter() - ultimo >= LOTE_PROGRESSO_S:
+                    ultimo = time.perf_counter()
+                    yield andamento('progresso')
+        while pendentes:
+            yield from colher()
+            if pendentes and time.perf_counter() - ultimo >= LOTE_PROGRESSO_S:
+                ultimo = time.perf_counter()
+                yield andamento('progresso')
+        yield dict(andamento('resumo'), processos=self.processos, modo=opcoes['modo'],
+                   estrategia=opcoes['estrategia'])
+
+processador_lote = ProcessadorLote()
+
+@app.route('/api/lote', methods=['POST'])
+def api_lote():
+    """
+    Roteamento em lote no grafo local. Aceita JSON {'pares': [...], opções}, um
+    arquivo (multipart, campo 'arquivo') ou o corpo em NDJSON/CSV, com as opções
+    na query string (modo, estrategia, cenario, geometria, formato_geometria,
+    simplificar_zoom, distancia_max_snap_m). Responde em NDJSON, em streaming:
+    um registro por par na ordem de entrada, progresso periódico e um resumo.
+    """
+    try:
+        if request.is_json:
+            dados = request.get_json(silent=True) or {}
+            pares = dados.get('pares')
+            if not isinstance(pares, list):
+                return jsonify({'sucesso': False, 'mensagem': "Informe 'pares' como lista"})
+        else:
+            dados = request.args.to_dict()
+            arquivo = request.files.get('arquivo')
+            fonte = arquivo.stream if arquivo is not None else request.stream
+            pares = ler_pares_lote(io.TextIOWrapper(fonte, encoding='utf-8', newline=''))
+        try:
+            opcoes = opcoes_lote(dados)
+        except ValueError as e:
+            return jsonify({'sucesso': False, 'mensagem': str(e)})
+        motor = motor_atual()
+        if motor is None:
+            return jsonify({'sucesso': False, 'mensagem': 'Lote disponível apenas com grafo local'})
+        if opcoes['cenario'] is not None:
+            motor = motor.para_cenario(*opcoes['cenario'])
+        processador_lote.preparar(motor)
+
+        def gerar():
+            yield json.dumps({'tipo': 'inicio', 'modo': opcoes['modo'], 'estrategia': opcoes['estrategia'],
+                              'cenario': descrever_cenario(motor), 'processos': processador_lote.processos}) + '\n'
+            for registro in processador_lote.executar(motor, pares, opcoes):
+                yield json.dumps(registro, ensure_ascii=False) + '\n'
+
+        return Response(stream_with_context(gerar()), mimetype='application/x-ndjson')
+    except Exception as e:
+        return jsonify({'sucesso': False, 'mensagem': f'Erro no lote: {str(e)}'})
+
 @app.route('/api/info_algoritmo')
 def api_info_algoritmo():
     """Retorna informações sobre o algoritmo Dijkstra e estatísticas do grafo"""
     try:
-        if grafo is None:
+        motor = motor_atual()
+        if motor is None:
             info = {
                 'algoritmo': 'OSRM (fallback sem grafo local)',
                 'complexidade_tempo': 'Serviço externo (OSRM)',
@@ -553,15 +3695,10 @@ def api_info_algoritmo():
             }
             return jsonify({'sucesso': True, 'info': info})
         
-        # Calcular estatísticas do grafo
-        total_nos = len(grafo.nodes())
-        total_arestas = len(grafo.edges())
-        
-        # Verificar quantas arestas têm pesos randomizados
-        arestas_randomizadas = 0
-        for origem, destino, chave, dados in grafo.edges(keys=True, data=True):
-            if 'fator_randomico' in dados:
-                arestas_randomizadas += 1
+        # Estatísticas do grafo (contadas na compilação, valem também para o snapshot)
+        total_nos = motor.estatisticas['total_nos']
+        total_arestas = motor.estatisticas['total_arestas']
+        arestas_randomizadas = motor.estatisticas['arestas_randomizadas']
         
         # Informações sobre o algoritmo
         info = {
@@ -575,6 +3712,8 @@ def api_info_algoritmo():
             'tipo_grafo': 'Direcionado com pesos positivos',
             'aplicacao': 'Rotas urbanas em Maricá, RJ',
             'idioma': 'Português (Brasil)',
+            'estrategias_busca': list(ESTRATEGIAS_BUSCA),
+            'estrategia_padrao': ESTRATEGIA_PADRAO,
             'caracteristicas': [
                 'Implementação customizada com heapq',
                 'Randomização de pesos (±20%)',
@@ -645,18 +3784,111 @@ def api_pontos_turisticos():
 # Configuração OSRM (público por padrão; pode ser sobrescrito via env OSRM_URL)
 OSRM_BASE_URL = os.environ.get('OSRM_URL', 'https://router.project-osrm.org')
 
+class ClienteOSRM:
+    """
+    Cliente HTTP do OSRM com conexões keep-alive reaproveitadas (requests.Session),
+    cache LRU/TTL das respostas por perfil + waypoints arredondados + passos e
+    coalescência de requisições idênticas simultâneas (só uma vai à rede; as
+    demais esperam o mesmo resultado). A latência de cada chamada vai para /metrics.
+    """
+    CASAS_DECIMAIS = 5  # ~1 m
+
+    def __init__(self, base_url, timeout_s=12.0, conexoes=8, cache=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout_s = timeout_s
+        self.sessao = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=conexoes, pool_maxsize=conexoes)
+        self.sessao.mount('http://', adaptador)
+        self.sessao.mount('https://', adaptador)
+        self.sessao.headers['User-Agent'] = 'RotaMarcio/1.0'
+        self.cache = cache if cache is not None else CacheRotas(
+            200000, 600.0, medir=lambda r: len((r.get('geometry_geojson') or {}).get('coordinates') or ()))
+        self._lock = threading.Lock()
+        self._em_voo = {}
+        self.chamadas = 0
+        self.coalescidas = 0
+        self.erros = 0
+
+    def rota(self, profile, waypoints, include_steps=False):
+        wps = tuple((round(float(wp[0]), self.CASAS_DECIMAIS), round(float(wp[1]), self.CASAS_DECIMAIS))
+                    for wp in waypoints)
+        chave = (profile, wps, bool(include_steps))
+        resultado = self.cache.obter(chave)
+        if resultado is not None:
+            resultado['cache'] = True
+            return resultado
+        with self._lock:
+            futuro = self._em_voo.get(chave)
+            lider = futuro is None
+            if lider:
+                futuro = self._em_voo[chave] = Future()
+            else:
+                self.coalescidas += 1
+        if not lider:
+            return dict(futuro.result())
+        try:
+            resultado = self._chamar(profile, wps, include_steps)
+            if resultado.get('sucesso'):
+                self.cache.guardar(chave, resultado)
+            futuro.set_result(resultado)
+        except BaseException as e:
+            futuro.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._em_voo.pop(chave, None)
+        return dict(resultado)
+
+    def _chamar(self, profile, wps, include_steps):
+        coords = ';'.join(f"{lng},{lat}" for lat, lng in wps)
+        url = f"{self.base_url}/route/v1/{profile}/{coords}"
+        params = {'overview': 'full', 'geometries': 'geojson', 'steps': 'true' if include_steps else 'false'}
+        inicio = time.perf_counter()
+        status = 'erro'
+        try:
+            resposta = self.sessao.get(url, params=params, timeout=self.timeout_s)
+            resposta.raise_for_status()
+            data = resposta.json()
+            status = 'ok'
+        except requests.RequestException as e:
+            with self._lock:
+                self.erros += 1
+            return {'sucesso': False, 'mensagem': f'Erro de rede ao chamar OSRM: {e}'}
+        except ValueError as e:
+            with self._lock:
+                self.erros += 1
+            return {'sucesso': False, 'mensagem': f'Erro ao processar resposta OSRM: {str(e)}'}
+        finally:
+            metricas.observar('rotamarcio_osrm_segundos', time.perf_counter() - inicio,
+                              profile=profile, status=status)
+            with self._lock:
+                self.chamadas += 1
+        return interpretar_resposta_osrm(data, include_steps)
+
+    def estatisticas(self):
+        with self._lock:
+            dados = {'chamadas': self.chamadas, 'coalescidas': self.coalescidas, 'erros': self.erros}
+        dados['cache'] = self.cache.estatisticas()
+        return dados
+
+metricas.descrever('rotamarcio_osrm_segundos', 'Latência das chamadas ao OSRM')
+cliente_osrm = ClienteOSRM(OSRM_BASE_URL,
+                           float(os.environ.get('OSRM_TIMEOUT_S', '12')),
+                           int(os.environ.get('OSRM_CONEXOES', '8')))
+
 def chamar_osrm_route(profile, waypoints, include_steps=False):
     try:
         if not waypoints or len(waypoints) < 2:
             return {'sucesso': False, 'mensagem': 'Waypoints insuficientes'}
         if len(waypoints) > 7:
             return {'sucesso': False, 'mensagem': 'Limite excedido: máximo origem + 5 paradas + destino'}
-        coords = ';'.join([f"{wp[1]},{wp[0]}" for wp in waypoints])
-        steps_flag = 'true' if include_steps else 'false'
-        url = f"{OSRM_BASE_URL}/route/v1/{profile}/{coords}?overview=full&geometries=geojson&steps={steps_flag}"
-        req = urllib.request.Request(url, headers={'User-Agent': 'RotaMarcio/1.0'})
-        with urllib.request.urlopen(req, timeout=12) as resp:
-            data = json.loads(resp.read().decode('utf-8'))
+        return cliente_osrm.rota(profile, waypoints, include_steps)
+    except Exception as e:
+        return {'sucesso': False, 'mensagem': f'Erro ao processar resposta OSRM: {str(e)}'}
+
+def interpretar_resposta_osrm(data, include_steps=False):
+    """Converte o JSON do /route do OSRM no formato de resposta da API"""
+    try:
         if 'routes' not in data or not data['routes']:
             return {'sucesso': False, 'mensagem': 'OSRM não retornou rotas'}
         r0 = data['routes'][0]
@@ -719,8 +3951,6 @@ def chamar_osrm_route(profile, waypoints, include_steps=False):
                     })
             resultado['passos'] = passos
         return resultado
-    except urllib.error.URLError as e:
-        return {'sucesso': False, 'mensagem': f'Erro de rede ao chamar OSRM: {e}'}
     except Exception as e:
         return {'sucesso': False, 'mensagem': f'Erro ao processar resposta OSRM: {str(e)}'}
 
@@ -741,8 +3971,7 @@ def api_rota_osrm():
         resultado = chamar_osrm_route(profile, wps, include_steps)
         return jsonify(resultado)
     except Exception as e:
-        import traceback
-        print(f"Erro na API rota_osrm: {traceback.format_exc()}")
+        logger.exception("Erro na API rota_osrm")
         return jsonify({'sucesso': False, 'mensagem': f'Erro ao calcular rota OSRM: {str(e)}'})
 
 @app.route('/api/desvio_parada', methods=['POST'])
@@ -775,180 +4004,465 @@ def api_desvio_parada():
             'preview_geometry_geojson': res_cand.get('geometry_geojson')
         })
     except Exception as e:
-        import traceback
-        print(f"Erro na API desvio_parada: {traceback.format_exc()}")
+        logger.exception("Erro na API desvio_parada")
         return jsonify({'sucesso': False, 'mensagem': f'Erro ao calcular desvio: {str(e)}'})
 
+DESVIOS_MAX_CANDIDATOS = int(os.environ.get('DESVIOS_MAX_CANDIDATOS', '200'))
+
+@app.route('/api/desvios_parada', methods=['POST'])
+def api_desvios_parada():
+    """
+    Avalia em lote o desvio de inserir cada candidato na rota base (grafo local).
+    Entrada: {profile, base: [[lat, lng], ...], candidatos: [[lat, lng], ...]};
+    a melhor perna de cada candidato é a de menor acréscimo de tempo no perfil do
+    modo (tempo_<profile>, só vias acessíveis), e os candidatos voltam ordenados
+    por esse acréscimo. O acréscimo de distância é o dessa mesma perna.
+    """
+    try:
+        dados = request.json or {}
+        profile = dados.get('profile', 'driving')
+        base = dados.get('base')
+        candidatos = dados.get('candidatos')
+        if not isinstance(base, list) or len(base) < 2:
+            return jsonify({'sucesso': False, 'mensagem': 'Rota base inválida'})
+        if not isinstance(candidatos, list) or not candidatos:
+            return jsonify({'sucesso': False, 'mensagem': 'Candidatos inválidos'})
+        if len(candidatos) > DESVIOS_MAX_CANDIDATOS:
+            return jsonify({'sucesso': False, 'mensagem': f'Limite excedido: máximo {DESVIOS_MAX_CANDIDATOS} candidatos'})
+        try:
+            peso = peso_do_modo(profile)
+            motor = fixar_cenario(dados)
+        except ValueError as e:
+            return jsonify({'sucesso': False, 'mensagem': str(e)})
+        if motor is None:
+            return jsonify({'sucesso': False, 'mensagem': 'Desvios em lote disponíveis apenas com grafo local'})
+        inicio = time.perf_counter()
+        base_norm = [(float(wp[0]), float(wp[1])) for wp in base]
+        cand_norm = [(float(c[0]), float(c[1])) for c in candidatos]
+        nos = nos_mais_proximos(base_norm + cand_norm)
+        idx_base = [motor.indice[no] for no in nos[:len(base_norm)]]
+        idx_cand = [motor.indice[no] for no in nos[len(base_norm):]]
+        desvios, tempo_base, distancia_base, metodos = desvios_insercao(motor, idx_base, idx_cand, peso)
+        inf = float('inf')
+        resultados = []
+        for i, ((lat, lng), (desvio_tempo, perna, desvio)) in enumerate(zip(cand_norm, desvios)):
+            alcancavel = desvio_tempo < inf
+            resultados.append({
+                'indice': i,
+                'lat': lat,
+                'lng': lng,
+                'perna': perna if alcancavel else None,
+                'delta_distance_m': round(desvio, 1) if alcancavel else None,
+                'delta_duration_s': round(desvio_tempo, 1) if alcancavel else None
+            })
+        resultados.sort(key=lambda r: (r['delta_duration_s'] is None, r['delta_duration_s'] or 0.0))
+        return jsonify({
+            'sucesso': True,
+            'profile': profile,
+            'base_distance_m': round(distancia_base, 1) if distancia_base < inf else None,
+            'base_duration_s': round(tempo_base, 1) if tempo_base < inf else None,
+            'candidatos': resultados,
+            'metodo': '+'.join(dict.fromkeys(metodos)),
+            'cenario': descrever_cenario(motor),
+            'tempo_ms': round((time.perf_counter() - inicio) * 1000, 2)
+        })
+    except Exception as e:
+        logger.exception("Erro na API desvios_parada")
+        return jsonify({'sucesso': False, 'mensagem': f'Erro ao calcular desvios: {str(e)}'})
+
+@app.route('/api/isocrona', methods=['POST'])
+def api_isocrona():
+    """
+    Áreas alcançáveis a partir de um ponto em vários limites de tempo (ex.: 5/10/15 min).
+    Entrada: {lat, lng, modo, limites_min: [5, 10, 15], cenario}; saída em GeoJSON
+    (um MultiPolygon por limite), em cache por nó de origem, modo, limites e versão do grafo.
+    """
+    try:
+        dados = request.json or {}
+        modo = dados.get('modo', 'driving')
+        limites = dados.get('limites_min') or [5, 10, 15]
+        if not isinstance(limites, list) or len(limites) > ISOCRONA_MAX_LIMITES:
+            return jsonify({'sucesso': False, 'mensagem': f'limites_min deve ser uma lista com até {ISOCRONA_MAX_LIMITES} valores'})
+        limites = sorted({float(limite) for limite in limites})
+        if limites[0] <= 0 or limites[-1] > ISOCRONA_MAX_MIN:
+            return jsonify({'sucesso': False, 'mensagem': f'Limites devem estar entre 0 e {ISOCRONA_MAX_MIN:g} minutos'})
+        try:
+            lat, lng = float(dados.get('lat')), float(dados.get('lng'))
+        except (TypeError, ValueError):
+            return jsonify({'sucesso': False, 'mensagem': 'Coordenadas inválidas'})
+        try:
+            peso = peso_do_modo(modo)
+            motor = fixar_cenario(dados)
+        except ValueError as e:
+            return jsonify({'sucesso': False, 'mensagem': str(e)})
+        if motor is None:
+            return jsonify({'sucesso': False, 'mensagem': 'Isócronas disponíveis apenas com grafo local'})
+        inicio = time.perf_counter()
+        max_snap = dados.get('distancia_max_snap_m')
+        no = nos_mais_proximos([(lat, lng)], float(max_snap) if max_snap is not None else None)[0]
+        origem = motor.indice[no]
+        chave = ('isocrona', origem, peso, tuple(limites), motor.versao)
+        resultado = cache_isocronas.obter(chave)
+        if resultado is not None:
+            resultado['cache'] = True
+        else:
+            with cronometro('isocrona', modo=modo):
+                features, assentados, pontos = calcular_isocronas(motor, origem, [limite * 60 for limite in limites], peso)
+            for feature, limite in zip(features, limites):
+                feature['properties']['limite_min'] = int(limite) if limite.is_integer() else limite
+            resultado = {'features': features, 'nos_assentados': assentados, 'pontos': pontos, 'cache': False}
+            cache_isocronas.guardar(chave, resultado)
+        with cronometro('serializacao'):
+            return jsonify({
+                'sucesso': True,
+                'modo': modo,
+                'origem': {'lat': motor.lat[origem], 'lng': motor.lng[origem]},
+                'isocronas': {'type': 'FeatureCollection', 'features': resultado['features']},
+                'nos_assentados': resultado['nos_assentados'],
+                'cache': resultado['cache'],
+                'cenario': descrever_cenario(motor),
+                'tempo_ms': round((time.perf_counter() - inicio) * 1000, 2)
+            })
+    except Exception as e:
+        logger.exception("Erro na API isocrona")
+        return jsonify({'sucesso': False, 'mensagem': f'Erro ao calcular isócronas: {str(e)}'})
+
+class CamadaMalha:
+    """
+    Malha viária do motor para desenhar mapas sem networkx nem matplotlib: a
+    geometria achatada das arestas em coordenadas de mundo Web Mercator (zoom 0,
+    0..256) e a caixa envolvente de cada aresta. Tiles de 256 px (PNG em tons
+    de cinza ou fragmentos SVG) são desenhados sob demanda e guardados num LRU
+    por versão/zoom/posição; a rota é composta por cima em cada requisição.
+    """
+    TAMANHO_TILE = 256
+    CLASSES_PRINCIPAIS = ('motorway', 'trunk', 'primary', 'secondary')
+
+    def __init__(self, motor):
+        coords = np.frombuffer(motor.geometria.coords, dtype=np.float64).reshape(-1, 2)
+        self.xs, self.ys = self.mundo(coords[:, 0], coords[:, 1])
+        self.offsets = np.frombuffer(motor.geometria.offsets, dtype=f'i{motor.geometria.offsets.itemsize}')
+        inicios = np.minimum(self.offsets[:-1], len(self.xs) - 1)
+        self.x_min = np.minimum.reduceat(self.xs, inicios)
+        self.x_max = np.maximum.reduceat(self.xs, inicios)
+        self.y_min = np.minimum.reduceat(self.ys, inicios)
+        self.y_max = np.maximum.reduceat(self.ys, inicios)
+        principais = np.array([c in self.CLASSES_PRINCIPAIS for c in motor.classes_via], dtype=bool)
+        self.principais = principais[np.frombuffer(motor.classes, dtype=np.uint8)]
+        self.versao = motor._raiz.versao
+
+    @staticmethod
+    def mundo(lats, lngs):
+        """(lat, lng) -> coordenadas de mundo Web Mercator no zoom 0"""
+        lats = np.clip(np.asarray(lats, dtype=np.float64), -85.0511, 85.0511)
+        xs = (np.asarray(lngs, dtype=np.float64) + 180.0) / 360.0 * 256.0
+        ys = (1.0 - np.log(np.tan(np.radians(lats)) + 1.0 / np.cos(np.radians(lats))) / math.pi) / 2.0 * 256.0
+        return xs, ys
+
+    def _linhas_tile(self, z, tx, ty):
+        """Arestas que cruzam o tile, como listas de pontos em pixels locais (principais por último)"""
+        escala = 2.0 ** z
+        margem = 4.0 / escala
+        x0, y0 = tx * self.TAMANHO_TILE / escala, ty * self.TAMANHO_TILE / escala
+        x1, y1 = x0 + self.TAMANHO_TILE / escala, y0 + self.TAMANHO_TILE / escala
+        arestas = np.flatnonzero((self.x_max >= x0 - margem) & (self.x_min <= x1 + margem)
+                                 & (self.y_max >= y0 - margem) & (self.y_min <= y1 + margem))
+        arestas = arestas[np.argsort(self.principais[arestas], kind='stable')]
+        for e in arestas:
+            ini, fim = self.offsets[e], self.offsets[e + 1]
+            if fim - ini < 2:
+                continue
+            pontos = np.column_stack(((self.xs[ini:fim] - x0) * escala, (self.ys[ini:fim] - y0) * escala))
+            yield bool(self.principais[e]), pontos
+
+    def tile(self, z, tx, ty, formato='png'):
+        """Tile da malha em cache: imagem 'L' 256x256 (png) ou fragmento SVG em pixels locais"""
+        chave = ('tile', self.versao, z, tx, ty, formato)
+        item = cache_tiles.obter(chave)
+        if item is not None:
+            return item['tile']
+        if formato == 'svg':
+            caminhos = {False: [], True: []}
+            for principal, pontos in self._linhas_tile(z, tx, ty):
+                caminhos[principal].append('M' + 'L'.join(f'{x:.1f} {y:.1f}' for x, y in pontos))
+            tile = ''.join(f'<path d="{"".join(d)}" stroke="{cor}" stroke-width="{largura}" fill="none"/>'
+                           for d, cor, largura in ((caminhos[False], '#b0b0b0', 1), (caminhos[True], '#808080', 2)) if d)
+        else:
+            tile = Image.new('L', (self.TAMANHO_TILE, self.TAMANHO_TILE), 245)
+            desenho = ImageDraw.Draw(tile)
+            for principal, pontos in self._linhas_tile(z, tx, ty):
+                desenho.line([tuple(p) for p in pontos.tolist()], fill=128 if principal else 176, width=2 if principal else 1)
+        cache_tiles.guardar(chave, {'tile': tile})
+        return tile
+
+    def pre_renderizar(self, niveis=2):
+        """Renderiza os tiles PNG da cidade inteira do zoom em que ela cabe na imagem até 'niveis' acima"""
+        extensao = max(self.x_max.max() - self.x_min.min(), 1e-9), max(self.y_max.max() - self.y_min.min(), 1e-9)
+        z0 = zoom_para_extensao(*extensao)
+        total = 0
+        for z in range(z0, min(18, z0 + niveis) + 1):
+            escala = 2.0 ** z / self.TAMANHO_TILE
+            for tx in range(int(self.x_min.min() * escala), int(self.x_max.max() * escala) + 1):
+                for ty in range(int(self.y_min.min() * escala), int(self.y_max.max() * escala) + 1):
+                    self.tile(z, tx, ty)
+                    total += 1
+        return total
+
+VISUAL_LARGURA, VISUAL_ALTURA, VISUAL_MARGEM, VISUAL_TITULO = 720, 480, 24, 28
+cache_tiles = CacheRotas(int(os.environ.get('GRAFO_TILES_MAX', '256')), float(os.environ.get('GRAFO_TILES_TTL_S', '3600')),
+                         medir=lambda item: 1)
+
+GRAFO_TILES_PRE_NIVEIS = int(os.environ.get('GRAFO_TILES_PRE_NIVEIS', '2'))
+
+def zoom_para_extensao(largura_mundo, altura_mundo):
+    """Maior zoom inteiro em que a extensão (em coordenadas de mundo do zoom 0) cabe na área útil da imagem"""
+    largura_util = VISUAL_LARGURA - 2 * VISUAL_MARGEM
+    altura_util = VISUAL_ALTURA - 2 * VISUAL_MARGEM - VISUAL_TITULO
+    return int(min(18, max(0, math.floor(math.log2(min(largura_util / largura_mundo, altura_util / altura_mundo))))))
+
+def pre_renderizar_malha(motor):
+    """Aquece o cache de tiles da malha fora do caminho das requisições (após a troca de versão)"""
+    if GRAFO_TILES_PRE_NIVEIS < 0 or motor is None or motor.geometria is None:
+        return
+    try:
+        inicio = time.time()
+        total = motor.camada_malha.pre_renderizar(GRAFO_TILES_PRE_NIVEIS)
+        logger.info("✅ Malha pré-renderizada: %d tiles em %.1fs", total, time.time() - inicio)
+    except Exception:
+        logger.exception("Falha ao pré-renderizar a malha")
+
+def _carregar_fonte(tamanho):
+    # DejaVu vem com o matplotlib (acentos e travessão); carregada uma vez, fora das requisições
+    try:
+        return ImageFont.truetype(os.path.join(matplotlib.get_data_path(), 'fonts', 'ttf', 'DejaVuSans.ttf'), tamanho)
+    except OSError:
+        return ImageFont.load_default()
+
+FONTE_VISUAL = _carregar_fonte(13)
+FONTE_VISUAL_TITULO = _carregar_fonte(15)
+
+@functools.lru_cache(maxsize=64)
+def imagem_aviso(mensagem, cor='#000000', formato='png'):
+    """Imagem estática com uma mensagem (placeholders e erros), em cache LRU: (bytes, mimetype)"""
+    if formato == 'svg':
+        linhas = mensagem.split('\n')
+        topo = VISUAL_ALTURA / 2 - (len(linhas) - 1) * 9
+        textos = ''.join(f'<text x="{VISUAL_LARGURA / 2:.0f}" y="{topo + i * 18:.0f}" text-anchor="middle" '
+                         f'font-family="DejaVu Sans, sans-serif" font-size="15" fill="{cor}">{html.escape(linha)}</text>'
+                         for i, linha in enumerate(linhas))
+        svg = (f'<svg xmlns="http://www.w3.org/2000/svg" width="{VISUAL_LARGURA}" height="{VISUAL_ALTURA}" '
+               f'viewBox="0 0 {VISUAL_LARGURA} {VISUAL_ALTURA}"><rect width="100%" height="100%" fill="#ffffff"/>{textos}</svg>')
+        return svg.encode('utf-8'), 'image/svg+xml'
+    imagem = Image.new('RGB', (VISUAL_LARGURA, VISUAL_ALTURA), '#ffffff')
+    ImageDraw.Draw(imagem).multiline_text((VISUAL_LARGURA / 2, VISUAL_ALTURA / 2), mensagem, fill=cor,
+                                          font=FONTE_VISUAL_TITULO, anchor='mm', align='center')
+    buf = io.BytesIO()
+    imagem.save(buf, format='PNG')
+    return buf.getvalue(), 'image/png'
+
+def renderizar_mapa(motor, coords, marcadores, titulo, formato='png'):
+    """
+    Rota (lista de (lat, lng)) sobre a malha viária: escolhe o maior zoom inteiro
+    em que a rota cabe, compõe os tiles em cache e desenha rota, marcadores
+    [(lat, lng, rótulo, cor)] e título por cima. Retorna (bytes, mimetype).
+    """
+    camada = motor.camada_malha
+    pontos = np.asarray(coords + [(lat, lng) for lat, lng, _, _ in marcadores], dtype=np.float64)
+    mx, my = CamadaMalha.mundo(pontos[:, 0], pontos[:, 1])
+    z = zoom_para_extensao(max(mx.max() - mx.min(), 1e-9), max(my.max() - my.min(), 1e-9))
+    escala = 2.0 ** z
+    # Origem do viewport em pixels de mundo no zoom z, com a rota centrada abaixo do título
+    ox = (mx.min() + mx.max()) / 2 * escala - VISUAL_LARGURA / 2
+    oy = (my.min() + my.max()) / 2 * escala - (VISUAL_ALTURA + VISUAL_TITULO) / 2
+    tam = CamadaMalha.TAMANHO_TILE
+    tiles = [(tx, ty) for tx in range(int(ox // tam), int((ox + VISUAL_LARGURA) // tam) + 1)
+             for ty in range(int(oy // tam), int((oy + VISUAL_ALTURA) // tam) + 1)]
+    rota = [(x * escala - ox, y * escala - oy) for x, y in zip(mx[:len(coords)].tolist(), my[:len(coords)].tolist())]
+    marcas = [(x * escala - ox, y * escala - oy, rotulo, cor)
+              for (x, y), (_, _, rotulo, cor) in zip(zip(mx[len(coords):].tolist(), my[len(coords):].tolist()), marcadores)]
+    if formato == 'svg':
+        partes = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{VISUAL_LARGURA}" height="{VISUAL_ALTURA}" '
+                  f'viewBox="0 0 {VISUAL_LARGURA} {VISUAL_ALTURA}">',
+                  f'<defs><clipPath id="tile"><rect width="{tam}" height="{tam}"/></clipPath></defs>',
+                  '<rect width="100%" height="100%" fill="#f5f5f5"/>']
+        for tx, ty in tiles:
+            partes.append(f'<g transform="translate({tx * tam - ox:.1f},{ty * tam - oy:.1f})" clip-path="url(#tile)">'
+                          f'{camada.tile(z, tx, ty, "svg")}</g>')
+        if len(rota) > 1:
+            partes.append('<polyline points="' + ' '.join(f'{x:.1f},{y:.1f}' for x, y in rota)
+                          + '" stroke="#D32F2F" stroke-width="3" fill="none" stroke-linejoin="round"/>')
+        for x, y, rotulo, cor in marcas:
+            partes.append(f'<circle cx="{x:.1f}" cy="{y:.1f}" r="5" fill="{cor}"/>'
+                          f'<text x="{x + 10:.1f}" y="{y + 12:.1f}" font-family="DejaVu Sans, sans-serif" font-size="13" '
+                          f'fill="{cor}">{html.escape(rotulo)}</text>')
+        partes.append(f'<rect width="100%" height="{VISUAL_TITULO}" fill="#ffffff"/>'
+                      f'<text x="{VISUAL_LARGURA / 2:.0f}" y="19" text-anchor="middle" font-family="DejaVu Sans, sans-serif" '
+                      f'font-size="15">{html.escape(titulo)}</text></svg>')
+        return ''.join(partes).encode('utf-8'), 'image/svg+xml'
+    base = Image.new('L', (VISUAL_LARGURA, VISUAL_ALTURA), 245)
+    for tx, ty in tiles:
+        base.paste(camada.tile(z, tx, ty), (int(round(tx * tam - ox)), int(round(ty * tam - oy))))
+    imagem = base.convert('RGB')
+    desenho = ImageDraw.Draw(imagem)
+    if len(rota) > 1:
+        desenho.line(rota, fill='#D32F2F', width=3, joint='curve')
+    for x, y, rotulo, cor in marcas:
+        desenho.ellipse((x - 5, y - 5, x + 5, y + 5), fill=cor)
+        desenho.text((x + 10, y + 2), rotulo, fill=cor, font=FONTE_VISUAL)
+    desenho.rectangle((0, 0, VISUAL_LARGURA, VISUAL_TITULO), fill='#ffffff')
+    desenho.text((VISUAL_LARGURA / 2, VISUAL_TITULO / 2), titulo, fill='#000000', font=FONTE_VISUAL_TITULO, anchor='mm')
+    buf = io.BytesIO()
+    imagem.save(buf, format='PNG', compress_level=3)
+    return buf.getvalue(), 'image/png'
+
+def _resposta_imagem(conteudo):
+    dados, mimetype = conteudo
+    return send_file(io.BytesIO(dados), mimetype=mimetype)
+
 @app.route('/api/grafo_visual', methods=['POST'])
 def api_grafo_visual():
+    """
+    Imagem do caminho sobre a malha viária (PNG, ou SVG com formato='svg').
+    A malha vem de tiles em cache; só a rota é desenhada por requisição. Com
+    'caminho' (o devolvido por /api/calcular_rota) não refaz snapping nem busca.
+    """
+    dados = request.json or {}
+    formato = 'svg' if dados.get('formato') == 'svg' else 'png'
     try:
-        dados = request.json or {}
+        caminho = dados.get('caminho')
         origem_lat = dados.get('origem_lat')
         origem_lng = dados.get('origem_lng')
         destino_lat = dados.get('destino_lat')
         destino_lng = dados.get('destino_lng')
         paradas = dados.get('paradas') or []
+        estrategia = dados.get('estrategia')
+        modo = dados.get('modo')
+        peso_do_modo(modo)
         if origem_lat is None or origem_lng is None or destino_lat is None or destino_lng is None:
-            fig, ax = plt.subplots(figsize=(6, 4), dpi=120)
-            ax.text(0.5, 0.5, 'Defina origem e destino\npara visualizar o grafo',
-                    ha='center', va='center', fontsize=12)
-            ax.axis('off')
-            buf = io.BytesIO()
-            fig.tight_layout()
-            fig.savefig(buf, format='png')
-            plt.close(fig)
-            buf.seek(0)
-            return send_file(buf, mimetype='image/png')
-        origem_lat = float(origem_lat)
-        origem_lng = float(origem_lng)
-        destino_lat = float(destino_lat)
-        destino_lng = float(destino_lng)
-        if grafo is None:
-            fig, ax = plt.subplots(figsize=(6, 4), dpi=120)
-            ax.text(0.5, 0.5, 'Visualização indisponível sem grafo\nUsando OSRM para rotas',
-                    ha='center', va='center', fontsize=12)
-            ax.axis('off')
-            buf = io.BytesIO()
-            fig.tight_layout()
-            fig.savefig(buf, format='png')
-            plt.close(fig)
-            buf.seek(0)
-            return send_file(buf, mimetype='image/png')
-        def nearest_node(lat, lng):
-            try:
-                if grafo_proj is not None:
-                    from shapely.geometry import Point
-                    p = Point(lng, lat)
-                    p_proj, _ = ox.projection.project_geometry(p, to_crs=grafo_proj.graph.get('crs'))
-                    return ox.nearest_nodes(grafo_proj, p_proj.x, p_proj.y)
-                else:
-                    return ox.nearest_nodes(grafo, lng, lat)
-            except Exception:
-                return None
-        waypoints = [(origem_lat, origem_lng)]
-        for p in paradas:
+            return _resposta_imagem(imagem_aviso('Defina origem e destino\npara visualizar o grafo', '#000000', formato))
+        motor = fixar_cenario(dados)
+        if motor is None:
+            return _resposta_imagem(imagem_aviso('Visualização indisponível sem grafo\nUsando OSRM para rotas', '#000000', formato))
+        waypoints = [(float(origem_lat), float(origem_lng))]
+        indices_paradas = []
+        for idx, p in enumerate(paradas):
             try:
                 latp = float(p[0]) if isinstance(p, (list, tuple)) else float(p.get('lat'))
                 lngp = float(p[1]) if isinstance(p, (list, tuple)) else float(p.get('lng'))
                 waypoints.append((latp, lngp))
+                indices_paradas.append(idx)
             except Exception:
                 continue
-        waypoints.append((destino_lat, destino_lng))
-        router = GraphRouter(grafo)
-        caminho_total_nos = []
+        waypoints.append((float(destino_lat), float(destino_lng)))
+        coords = []
         distancia_total = 0.0
-        for i in range(len(waypoints)-1):
-            a = waypoints[i]
-            b = waypoints[i+1]
-            na = nearest_node(a[0], a[1])
-            nb = nearest_node(b[0], b[1])
-            if na is None or nb is None:
-                continue
-            caminho_nos, dist_seg = router.shortest_path(na, nb, 'length')
-            if not caminho_nos:
-                continue
-            if caminho_total_nos and caminho_nos:
-                if caminho_total_nos[-1] == caminho_nos[0]:
-                    caminho_nos = caminho_nos[1:]
-            caminho_total_nos.extend(caminho_nos)
-            distancia_total += float(dist_seg or 0.0)
-        if not caminho_total_nos:
-            fig, ax = plt.subplots(figsize=(6, 4), dpi=120)
-            ax.text(0.5, 0.5, 'Sem caminho disponível\n(verifique a randomização/paradas)',
-                    ha='center', va='center', fontsize=12, color='#D32F2F')
-            ax.axis('off')
-            buf = io.BytesIO()
-            fig.tight_layout()
-            fig.savefig(buf, format='png')
-            plt.close(fig)
-            buf.seek(0)
-            return send_file(buf, mimetype='image/png')
-        fig, ax = plt.subplots(figsize=(6, 4), dpi=120)
-        xs = [grafo.nodes[n]['x'] for n in caminho_total_nos]
-        ys = [grafo.nodes[n]['y'] for n in caminho_total_nos]
-        ax.plot(xs, ys, color='#D32F2F', linewidth=3)
-        ax.scatter(xs, ys, color='#444', s=10, zorder=3)
-        ax.set_xticks([])
-        ax.set_yticks([])
-        dist_km = distancia_total/1000.0 if distancia_total else 0.0
-        ax.set_title(f'Caminho mínimo (NetworkX/matplotlib) — {dist_km:.2f} km')
-        if xs and ys:
-            xmin, xmax = min(xs), max(xs)
-            ymin, ymax = min(ys), max(ys)
-            pad_x = (xmax - xmin) * 0.08 if xmax>xmin else 0.001
-            pad_y = (ymax - ymin) * 0.08 if ymax>ymin else 0.001
-            ax.set_xlim(xmin - pad_x, xmax + pad_x)
-            ax.set_ylim(ymin - pad_y, ymax + pad_y)
-        # marcar origem, destino e paradas
-        try:
-            no_origem = nearest_node(origem_lat, origem_lng)
-            no_destino = nearest_node(destino_lat, destino_lng)
-            if no_origem is not None:
-                ax.scatter(grafo.nodes[no_origem]['x'], grafo.nodes[no_origem]['y'], color='#388E3C', s=60, zorder=4)
-                ax.annotate('Origem', (grafo.nodes[no_origem]['x'], grafo.nodes[no_origem]['y']), xytext=(10, -10), textcoords='offset points', color='#388E3C')
-            if no_destino is not None:
-                ax.scatter(grafo.nodes[no_destino]['x'], grafo.nodes[no_destino]['y'], color='#1976D2', s=60, zorder=4)
-                ax.annotate('Destino', (grafo.nodes[no_destino]['x'], grafo.nodes[no_destino]['y']), xytext=(10, -10), textcoords='offset points', color='#1976D2')
-            for idx, p in enumerate(paradas):
-                try:
-                    latp = float(p[0]) if isinstance(p, (list, tuple)) else float(p.get('lat'))
-                    lngp = float(p[1]) if isinstance(p, (list, tuple)) else float(p.get('lng'))
-                    np = nearest_node(latp, lngp)
-                    if np is None: continue
-                    ax.scatter(grafo.nodes[np]['x'], grafo.nodes[np]['y'], color='#9C27B0', s=50, zorder=4)
-                    ax.annotate(f'Parada {idx+1}', (grafo.nodes[np]['x'], grafo.nodes[np]['y']), xytext=(10, -10), textcoords='offset points', color='#9C27B0')
-                except Exception:
+        if isinstance(caminho, list) and caminho:
+            # Rota já calculada pelo cliente: só desenha
+            coords = [(float(p[0]), float(p[1])) for p in caminho]
+            distancia_total = float(dados.get('distancia') or 0.0)
+        else:
+            # Snapping de todos os waypoints uma única vez; trechos saem do cache de rotas
+            nos_waypoints = nos_mais_proximos(waypoints)
+            for na, nb in zip(nos_waypoints, nos_waypoints[1:]):
+                seg = obter_rota_por_geometria(na, nb, estrategia, modo)
+                if not seg.get('sucesso'):
                     continue
-        except Exception:
-            pass
-        buf = io.BytesIO()
-        fig.tight_layout()
-        fig.savefig(buf, format='png')
-        plt.close(fig)
-        buf.seek(0)
-        return send_file(buf, mimetype='image/png')
+                trecho = [tuple(p) for p in seg['caminho']]
+                if coords and trecho and coords[-1] == trecho[0]:
+                    trecho = trecho[1:]
+                coords.extend(trecho)
+                distancia_total += float(seg.get('distancia') or 0.0)
+        if not coords:
+            return _resposta_imagem(imagem_aviso('Sem caminho disponível\n(verifique a randomização/paradas)', '#D32F2F', formato))
+        marcadores = [(waypoints[0][0], waypoints[0][1], 'Origem', '#388E3C'),
+                      (waypoints[-1][0], waypoints[-1][1], 'Destino', '#1976D2')]
+        marcadores.extend((lat, lng, f'Parada {idx + 1}', '#9C27B0')
+                          for idx, (lat, lng) in zip(indices_paradas, waypoints[1:-1]))
+        dist_km = distancia_total / 1000.0 if distancia_total else 0.0
+        with cronometro('visual', formato=formato):
+            conteudo = renderizar_mapa(motor, coords, marcadores, f'Caminho mínimo — {dist_km:.2f} km', formato)
+        return _resposta_imagem(conteudo)
+    except ValueError as e:
+        return _resposta_imagem(imagem_aviso(f'Erro ao gerar visualização:\n{str(e)}', '#D32F2F', formato))
     except Exception as e:
+        logger.exception("Erro na API grafo_visual")
         try:
-            fig, ax = plt.subplots(figsize=(6, 4), dpi=120)
-            ax.text(0.5, 0.5, f'Erro ao gerar visualização:\n{str(e)}',
-                    ha='center', va='center', fontsize=11, color='#D32F2F')
-            ax.axis('off')
-            buf = io.BytesIO()
-            fig.tight_layout()
-            fig.savefig(buf, format='png')
-            plt.close(fig)
-            buf.seek(0)
-            return send_file(buf, mimetype='image/png')
+            return _resposta_imagem(imagem_aviso(f'Erro ao gerar visualização:\n{str(e)}', '#D32F2F', formato))
         except Exception:
             return jsonify({'sucesso': False, 'mensagem': 'Falha ao gerar imagem do grafo'}), 200
 
-if __name__ == '__main__':
-    if inicializar_sistema():
-        print("🚀 Iniciando servidor Flask...")
-        app.run(debug=True, host='0.0.0.0', port=5000)
-    else:
-        print("❌ Não foi possível inicializar o sistema")
 @app.route('/health')
 def health():
     try:
         estado = {
             'ok': True,
-            'grafo_inicializado': grafo is not None,
-            'cidade': cidade_atual
+            'grafo_inicializado': motor_roteamento is not None,
+            'cidade': cidade_atual,
+            'carga': gerenciador_grafo.status()
         }
+        motor = motor_roteamento
+        if motor is not None:
+            estado['alt'] = None if motor.alt is None else {
+                'peso': motor.alt.peso,
+                'marcos': len(motor.alt.marcos),
+                'memoria_bytes': motor.alt.memoria_bytes(),
+                'tempo_construcao_s': round(motor.alt.tempo_construcao_s, 3)
+            }
+            estado['ch_carregada'] = motor.hierarquia is not None
+            estado['ch_peso'] = None if motor.hierarquia is None else motor.hierarquia.peso
+            # Estratégia que 'ch' e 'alt' realmente usam em cada modo (fallback quando falta o pré-processamento)
+            estado['estrategias_por_modo'] = {
+                modo: {e: motor.estrategia_efetiva(e, peso_do_modo(modo)) for e in ('ch', 'alt')}
+                for modo in PERFIS_MODO
+            }
+            estado['versao_grafo'] = motor.versao
+            estado['cenario'] = descrever_cenario(motor)
+            estado['cenarios'] = motor.estatisticas_cenarios()
+        estado['cache_rotas'] = cache_rotas.estatisticas()
+        estado['osrm'] = cliente_osrm.estatisticas()
         return jsonify(estado), 200
     except Exception:
         return jsonify({'ok': False}), 200
 
+@app.route('/metrics')
+def metrics():
+    """Histogramas de latência no formato texto do Prometheus"""
+    return app.response_class(metricas.texto_prometheus(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/init_graph', methods=['POST'])
 def api_init_graph():
+    """
+    Inicializa o grafo em segundo plano. Com 'recarregar' (ou 'semente'/'proporcao')
+    monta uma nova versão enquanto a atual continua atendendo e troca ao final;
+    o andamento aparece em /health (campo 'carga').
+    """
     try:
-        if grafo is not None:
+        dados = request.get_json(silent=True) or {}
+        semente = dados.get('semente')
+        proporcao = dados.get('proporcao')
+        recarregar = bool(dados.get('recarregar')) or semente is not None or proporcao is not None
+        if motor_roteamento is not None and not recarregar:
             return jsonify({'sucesso': True, 'mensagem': 'Grafo já inicializado'})
-        def do_init():
-            inicializar_sistema()
-        t = threading.Thread(target=do_init, daemon=True)
-        t.start()
-        return jsonify({'sucesso': True, 'mensagem': 'Inicialização iniciada'}), 202
+        if semente is not None or proporcao is not None:
+            # Semente numérica ou texto, como no campo 'cenario' das rotas
+            semente, proporcao = parametros_randomizacao(semente, proporcao)
+            if not 0.0 <= proporcao <= 1.0:
+                return jsonify({'sucesso': False, 'mensagem': 'proporcao deve estar entre 0 e 1'})
+        _, iniciada = gerenciador_grafo.carregar(semente, proporcao, esperar=False)
+        if not iniciada:
+            return jsonify({'sucesso': True, 'mensagem': 'Carga já em andamento', 'carga': gerenciador_grafo.status()}), 202
+        return jsonify({'sucesso': True, 'mensagem': 'Inicialização iniciada', 'carga': gerenciador_grafo.status()}), 202
     except Exception as e:
         return jsonify({'sucesso': False, 'mensagem': str(e)}), 200
+
+# Workers do lote importam este módulo; só o processo principal carrega o grafo
+if (INIT_GRAPH_ON_START and os.environ.get('GRAPH_MODE', 'osrm').lower() != 'osrm'
+        and multiprocessing.parent_process() is None):
+    gerenciador_grafo.carregar(esperar=False)
+
+if __name__ == '__main__':
+    if inicializar_sistema():
+        print("🚀 Iniciando servidor Flask...")
+        app.run(debug=True, host='0.0.0.0', port=5000)
+    else:
+        print("❌ Não foi possível inicializar o sistema")
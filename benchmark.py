@@ -0,0 +1,455 @@
+"""
+Benchmark offline do roteamento (sem rede).
+
+Mede, para cada grafo: carga (graphml -> motor), buscas por estratégia
+(distância e tempo do modo), dijkstra_customizado, snapping, montagem da
+geometria, obter_rota_por_geometria e a latência dos endpoints pelo test
+client do Flask. Cada busca é conferida com networkx.dijkstra_path sobre os
+mesmos pesos; qualquer divergência faz o benchmark falhar.
+
+Grafos:
+- grade-N: grade N x N com coordenadas perturbadas, mãos únicas e ruas faltando;
+- geometrico-N: N pontos aleatórios ligados aos vizinhos mais próximos;
+- marica-trecho: bench/marica_trecho.graphml, montado sobre o traçado real de
+  rota_driving_coords.json (a via do traçado com geometria, mais uma malha de
+  ruas ao redor); regenerado com --gerar-fixture.
+
+Cada medida roda REPETICOES vezes, em rodadas intercaladas com as demais e com o
+coletor de lixo desligado, e guarda o menor tempo por operação, em ms, e a
+dispersão entre as rodadas mais rápidas (primeiro quartil - mínimo). O mínimo é o
+estimador menos sensível a ruído da máquina; a comparação com bench/baseline.json
+(gravado pelo mesmo método) só acusa regressão quando o mínimo atual passa de
+LIMITE x o baseline somado a uma margem de FATOR_DISPERSAO x a maior dispersão
+(atual ou do baseline), nunca menor que TOLERANCIA_MS. Uma medida acima do limiar
+é medida de novo, com o dobro de rodadas, antes de contar como regressão. Medidas
+únicas (carga, construção da CH) não têm dispersão e são só informativas.
+O baseline vale para a máquina em que foi gravado: regrave com --salvar-baseline
+ao trocar de máquina.
+
+Uso:
+    python benchmark.py [--grafos grade-30,geometrico-2000,marica-trecho] [--pares 50]
+                        [--repeticoes 7] [--limite 1.3] [--saida resultado.json]
+                        [--salvar-baseline] [--gerar-fixture]
+"""
+import argparse
+import gc
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import networkx as nx
+import numpy as np
+import osmnx as ox
+from shapely.geometry import LineString
+
+import app
+
+DIR_BENCH = os.path.join(app.base_dir, 'bench')
+FIXTURE_MARICA = os.path.join(DIR_BENCH, 'marica_trecho.graphml')
+BASELINE = os.path.join(DIR_BENCH, 'baseline.json')
+GRAFOS_PADRAO = 'grade-30,grade-60,geometrico-2000,marica-trecho'
+# Centro de Maricá: os grafos sintéticos ficam na mesma latitude (afeta projeção e heurísticas)
+CENTRO = (-22.92, -42.82)
+CLASSES_VIA = ['residential'] * 6 + ['tertiary', 'secondary', 'primary', 'trunk', 'motorway']
+TOLERANCIA_MS = 0.05
+FATOR_DISPERSAO = 3.0
+
+
+def _comprimento(pontos):
+    """Comprimento (m) de uma polilinha [(lat, lng), ...]"""
+    return sum(ox.distance.great_circle_vec(a[0], a[1], b[0], b[1]) for a, b in zip(pontos, pontos[1:]))
+
+
+def _adicionar_via(grafo, u, v, rnd, highway=None, nome=None, pontos=None, mao_unica=None):
+    """Aresta u -> v (e v -> u, se mão dupla) com os atributos que o osmnx grava no graphml"""
+    if pontos is None:
+        pontos = [(grafo.nodes[u]['y'], grafo.nodes[u]['x']), (grafo.nodes[v]['y'], grafo.nodes[v]['x'])]
+    highway = highway or rnd.choice(CLASSES_VIA)
+    mao_unica = rnd.random() < 0.15 if mao_unica is None else mao_unica
+    dados = {'osmid': rnd.randint(1, 10 ** 9), 'highway': highway, 'oneway': mao_unica,
+             'reversed': False, 'length': round(_comprimento(pontos), 3)}
+    if nome:
+        dados['name'] = nome
+    if highway in ('primary', 'trunk', 'motorway') and rnd.random() < 0.5:
+        dados['maxspeed'] = rnd.choice(['40', '60', '80'])
+    if len(pontos) > 2:
+        dados['geometry'] = LineString([(lng, lat) for lat, lng in pontos])
+    grafo.add_edge(u, v, **dados)
+    if not mao_unica:
+        volta = dict(dados, reversed=True)
+        if len(pontos) > 2:
+            volta['geometry'] = LineString([(lng, lat) for lat, lng in reversed(pontos)])
+        grafo.add_edge(v, u, **volta)
+
+
+def gerar_grade(lado, semente=1, espacamento_m=90.0):
+    """Grade lado x lado em torno de Maricá, com 5% das ruas removidas e 15% em mão única"""
+    rnd = random.Random(semente)
+    grafo = nx.MultiDiGraph(crs='epsg:4326')
+    passo_lat = espacamento_m / 111320.0
+    passo_lng = passo_lat / math.cos(math.radians(CENTRO[0]))
+    lat0 = CENTRO[0] - lado * passo_lat / 2
+    lng0 = CENTRO[1] - lado * passo_lng / 2
+    ids = {}
+    for i in range(lado):
+        for j in range(lado):
+            no = ids[i, j] = 1000 + i * lado + j
+            grafo.add_node(no, y=lat0 + (i + rnd.uniform(-0.25, 0.25)) * passo_lat,
+                           x=lng0 + (j + rnd.uniform(-0.25, 0.25)) * passo_lng, street_count=4)
+    for i in range(lado):
+        for j in range(lado):
+            if j + 1 < lado and rnd.random() > 0.05:
+                _adicionar_via(grafo, ids[i, j], ids[i, j + 1], rnd, nome=f'Rua {i}')
+            if i + 1 < lado and rnd.random() > 0.05:
+                _adicionar_via(grafo, ids[i, j], ids[i + 1, j], rnd, nome=f'Travessa {j}')
+    return grafo
+
+
+def gerar_geometrico(total, semente=1, vizinhos=3, extensao_m=None):
+    """Grafo geométrico aleatório: cada ponto ligado aos 'vizinhos' mais próximos (densidade ~1 nó/8000 m²)"""
+    rnd = random.Random(semente)
+    gerador = np.random.default_rng(semente)
+    extensao_m = extensao_m or math.sqrt(total * 8000.0)
+    ys = gerador.uniform(-0.5, 0.5, total) * extensao_m
+    xs = gerador.uniform(-0.5, 0.5, total) * extensao_m
+    grafo = nx.MultiDiGraph(crs='epsg:4326')
+    escala_lng = 111320.0 * math.cos(math.radians(CENTRO[0]))
+    for k in range(total):
+        grafo.add_node(1000 + k, y=CENTRO[0] + ys[k] / 111320.0, x=CENTRO[1] + xs[k] / escala_lng, street_count=3)
+    ligados = set()
+    for inicio in range(0, total, 512):
+        bloco = slice(inicio, min(total, inicio + 512))
+        d2 = (xs[bloco, None] - xs[None, :]) ** 2 + (ys[bloco, None] - ys[None, :]) ** 2
+        proximos = np.argsort(d2, axis=1)[:, 1:vizinhos + 1]
+        for a, linha in zip(range(bloco.start, bloco.stop), proximos):
+            for b in linha.tolist():
+                par = (min(a, b), max(a, b))
+                if par not in ligados:
+                    ligados.add(par)
+                    _adicionar_via(grafo, 1000 + par[0], 1000 + par[1], rnd, nome=f'Estrada {par[0]}')
+    return grafo
+
+
+def gerar_fixture_marica(caminho=FIXTURE_MARICA, espacamento_m=125.0, margem_m=250.0):
+    """
+    Fixture pequena de Maricá: a via do traçado real de rota_driving_coords.json
+    (nós a cada 4 pontos, geometria intermediária preservada) sobre uma malha de
+    ruas que cobre a área do traçado, ligada à via pelos nós mais próximos.
+    """
+    rnd = random.Random(42)
+    with open(os.path.join(app.base_dir, 'rota_driving_coords.json'), encoding='utf-8') as f:
+        tracado = [tuple(p) for p in json.load(f)['coordenadas']]
+    pontos = [p for k, p in enumerate(tracado) if k == 0 or p != tracado[k - 1]]
+    grafo = nx.MultiDiGraph(crs='epsg:4326')
+    lats, lngs = [p[0] for p in pontos], [p[1] for p in pontos]
+    passo_lat = espacamento_m / 111320.0
+    passo_lng = passo_lat / math.cos(math.radians(statistics.fmean(lats)))
+    margem_lat, margem_lng = margem_m / 111320.0, margem_m / 111320.0 / math.cos(math.radians(statistics.fmean(lats)))
+    linhas = int((max(lats) - min(lats) + 2 * margem_lat) / passo_lat) + 1
+    colunas = int((max(lngs) - min(lngs) + 2 * margem_lng) / passo_lng) + 1
+    ids = {}
+    for i in range(linhas):
+        for j in range(colunas):
+            no = ids[i, j] = 5000000 + i * colunas + j
+            grafo.add_node(no, y=round(min(lats) - margem_lat + (i + rnd.uniform(-0.2, 0.2)) * passo_lat, 7),
+                           x=round(min(lngs) - margem_lng + (j + rnd.uniform(-0.2, 0.2)) * passo_lng, 7), street_count=4)
+    for i in range(linhas):
+        for j in range(colunas):
+            if j + 1 < colunas and rnd.random() > 0.08:
+                _adicionar_via(grafo, ids[i, j], ids[i, j + 1], rnd, highway='residential', nome=f'Rua {i}')
+            if i + 1 < linhas and rnd.random() > 0.08:
+                _adicionar_via(grafo, ids[i, j], ids[i + 1, j], rnd, highway='residential', nome=f'Travessa {j}')
+    # Via do traçado: um nó a cada 4 pontos, ligado ao nó da malha mais próximo
+    indices = list(range(0, len(pontos), 4))
+    if indices[-1] != len(pontos) - 1:
+        indices.append(len(pontos) - 1)
+    for k in indices:
+        lat, lng = pontos[k]
+        grafo.add_node(1000 + k, y=lat, x=lng, street_count=3)
+        i = min(linhas - 1, max(0, round((lat - min(lats) + margem_lat) / passo_lat)))
+        j = min(colunas - 1, max(0, round((lng - min(lngs) + margem_lng) / passo_lng)))
+        _adicionar_via(grafo, 1000 + k, ids[i, j], rnd, highway='residential', mao_unica=False, nome='Acesso')
+    for a, b in zip(indices, indices[1:]):
+        _adicionar_via(grafo, 1000 + a, 1000 + b, rnd, highway='primary', mao_unica=False,
+                       nome='Via do traçado', pontos=pontos[a:b + 1])
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    ox.save_graphml(grafo, caminho)
+    return grafo
+
+
+def grafo_por_nome(nome):
+    tipo, _, tamanho = nome.partition('-')
+    if tipo == 'grade':
+        return gerar_grade(int(tamanho))
+    if tipo == 'geometrico':
+        return gerar_geometrico(int(tamanho))
+    if nome == 'marica-trecho':
+        if not os.path.exists(FIXTURE_MARICA):
+            gerar_fixture_marica()
+        return None
+    raise ValueError(f'Grafo desconhecido: {nome}')
+
+
+def medida(ms, dispersao_ms=None):
+    return {'ms': ms, 'dispersao_ms': dispersao_ms}
+
+
+def _quartil_inferior(valores):
+    return statistics.quantiles(valores, n=4)[0] if len(valores) > 1 else valores[0]
+
+
+def cronometrar(medicoes, repeticoes):
+    """
+    Mede {nome: (função, itens, antes)} em rodadas intercaladas (cada rodada passa
+    uma vez por todas as medidas), para que uma fase lenta da máquina atinja
+    rodadas inteiras e não todas as repetições de uma mesma medida.
+    Retorna {nome: menor tempo por item e dispersão (primeiro quartil - mínimo), em ms}.
+    """
+    tempos = {nome: [] for nome in medicoes}
+    coletor_ativo = gc.isenabled()
+    try:
+        for _ in range(repeticoes):
+            for nome, (funcao, itens, antes) in medicoes.items():
+                if antes is not None:
+                    antes()
+                gc.collect()
+                gc.disable()
+                inicio = time.perf_counter()
+                for item in itens:
+                    funcao(item)
+                tempos[nome].append((time.perf_counter() - inicio) * 1000 / max(1, len(itens)))
+                gc.enable()
+    finally:
+        if coletor_ativo:
+            gc.enable()
+    return {nome: medida(min(t), _quartil_inferior(t) - min(t)) for nome, t in tempos.items()}
+
+
+def referencia_networkx(grafo, motor, pesos):
+    """DiGraph do networkx com os pesos efetivos de cada aresta do motor (sem as bloqueadas)"""
+    referencia = nx.DiGraph()
+    referencia.add_nodes_from(range(motor.total_nos))
+    desabilitadas = motor.desabilitadas
+    for e in range(motor.total_arestas):
+        if desabilitadas[e >> 3] & (1 << (e & 7)) or pesos[e] == float('inf'):
+            continue
+        referencia.add_edge(motor.origens[e], motor.alvos[e], peso=pesos[e])
+    return referencia
+
+
+def _mesma_distancia(a, b):
+    return a == b or abs(a - b) <= 1e-6 * max(1.0, abs(b))
+
+
+def conferir(grafo, motor, pares, falhas):
+    """Confere buscas, dijkstra_customizado e o endpoint com networkx.dijkstra_path"""
+    inf = float('inf')
+    # Pesos de distância recalculados do graphml (não do motor): confere também a compilação
+    multiplicadores = motor.cenario.multiplicadores
+    pesos_graphml = [grafo[motor.nos[motor.origens[e]]][motor.nos[motor.alvos[e]]][motor.chaves[e]]['length']
+                     * float(multiplicadores[e]) for e in range(motor.total_arestas)]
+    # tempo_driving é o peso padrão da CH e do ALT: sem ele as duas cairiam no fallback
+    for peso, pesos in (('length', pesos_graphml), ('tempo_driving', motor.pesos('tempo_driving')),
+                        ('tempo_walking', motor.pesos('tempo_walking'))):
+        referencia = referencia_networkx(grafo, motor, pesos)
+        for origem, destino in pares:
+            try:
+                caminho = nx.dijkstra_path(referencia, origem, destino, weight='peso')
+                esperado = sum(referencia[a][b]['peso'] for a, b in zip(caminho, caminho[1:]))
+            except nx.NetworkXNoPath:
+                esperado = inf
+            for estrategia in app.ESTRATEGIAS_BUSCA:
+                distancia, arestas, _ = motor.buscar(origem, destino, peso, estrategia)
+                nos = [origem] + [motor.alvos[e] for e in arestas]
+                valido = all(motor.origens[e] == a for e, a in zip(arestas, nos))
+                soma = sum(pesos[e] for e in arestas) if arestas else (0.0 if origem == destino else inf)
+                if not (_mesma_distancia(distancia, esperado) and (distancia == inf or (valido and _mesma_distancia(soma, esperado)))):
+                    falhas.append(f'{estrategia}/{peso} {origem}->{destino}: {distancia} (networkx: {esperado})')
+    # dijkstra_customizado roda no networkx sobre o 'length' do graphml, sem o cenário
+    base = nx.DiGraph()
+    for u, v, dados in grafo.edges(data=True):
+        if not base.has_edge(u, v):
+            base.add_edge(u, v, length=dados['length'])
+    for origem, destino in pares[:10]:
+        o, d = motor.nos[origem], motor.nos[destino]
+        _, distancia = app.dijkstra_customizado(grafo, o, d)
+        try:
+            esperado = nx.dijkstra_path_length(base, o, d, weight='length')
+        except nx.NetworkXNoPath:
+            esperado = 0.0
+        if not _mesma_distancia(distancia, esperado):
+            falhas.append(f'dijkstra_customizado {o}->{d}: {distancia} (networkx: {esperado})')
+
+
+def medir_grafo(nome, args, falhas, referencias=None):
+    """
+    Carrega o grafo pelo caminho normal do servidor e mede cada etapa; retorna
+    {bench: medida}. Medidas acima do limiar de 'referencias' (o baseline do grafo)
+    são medidas de novo, e vale o menor tempo das duas.
+    """
+    grafo = grafo_por_nome(nome)
+    with tempfile.TemporaryDirectory(prefix='rotamarcio-bench-') as pasta:
+        graphml = FIXTURE_MARICA if grafo is None else os.path.join(pasta, f'{nome}.graphml')
+        if grafo is not None:
+            ox.save_graphml(grafo, graphml)
+        os.environ.update(GRAPH_MODE='graphml', GRAPHML_FILE=graphml,
+                          GRAPH_SNAPSHOT=os.path.join(pasta, 'ausente.snap'))
+        inicio = time.perf_counter()
+        if not app.inicializar_sistema(semente='bench', proporcao=0.02):
+            raise RuntimeError(f'Falha ao carregar {nome}')
+        resultados = {'carga': medida((time.perf_counter() - inicio) * 1000)}
+    motor = app.motor_roteamento
+    grafo = app.grafo
+    inicio = time.perf_counter()
+    motor.hierarquia = app.HierarquiaContracao.construir(motor, peso=app.PESO_PREPROCESSAMENTO)
+    resultados['ch_construcao'] = medida((time.perf_counter() - inicio) * 1000)
+    print(f'📍 {nome}: {motor.total_nos} nós, {motor.total_arestas} arestas', file=sys.stderr)
+
+    rnd = random.Random(7)
+    pares = [(rnd.randrange(motor.total_nos), rnd.randrange(motor.total_nos)) for _ in range(args.pares)]
+    conferir(grafo, motor, pares, falhas)
+
+    # {nome: (função por item, itens, preparação antes de cada repetição)}
+    medicoes = {}
+    for peso in ('length', 'tempo_driving'):
+        sufixo = '' if peso == 'length' else '_tempo'
+        for estrategia in app.ESTRATEGIAS_BUSCA:
+            medicoes[f'busca_{estrategia}{sufixo}'] = (
+                lambda par, peso=peso, estrategia=estrategia: motor.buscar(par[0], par[1], peso, estrategia),
+                pares, None)
+    pares_ids = [(motor.nos[o], motor.nos[d]) for o, d in pares[:10]]
+    medicoes['dijkstra_customizado'] = (lambda par: app.dijkstra_customizado(grafo, par[0], par[1]), pares_ids, None)
+
+    lat_min, lat_max, lng_min, lng_max = min(motor.lat), max(motor.lat), min(motor.lng), max(motor.lng)
+    pontos = [(rnd.uniform(lat_min, lat_max), rnd.uniform(lng_min, lng_max)) for _ in range(500)]
+    medicoes['snap_unitario'] = (lambda p: app.no_mais_proximo(*p), pontos[:100], None)
+    medicoes['snap_lote_500'] = (lambda lote: app.nos_mais_proximos(lote), [pontos], None)
+
+    caminhos = [motor.buscar(o, d, 'length', 'ch')[1] for o, d in pares]
+    medicoes['geometria'] = (lambda arestas: app.GeometriaArestas.pares(motor.geometria.montar(arestas)), caminhos, None)
+    medicoes['obter_rota_por_geometria'] = (
+        lambda par: app.obter_rota_por_geometria(par[0], par[1], 'dijkstra', 'driving'),
+        pares_ids, app.cache_rotas.limpar)
+
+    cliente = app.app.test_client()
+    consultas = [{'origem_lat': motor.lat[o], 'origem_lng': motor.lng[o],
+                  'destino_lat': motor.lat[d], 'destino_lng': motor.lng[d]} for o, d in pares[:10]]
+    # O endpoint (modo driving) deve chegar ao mesmo tempo de viagem que o networkx
+    referencia = referencia_networkx(grafo, motor, motor.pesos('tempo_driving'))
+    for (origem, destino), consulta in zip(pares, consultas):
+        resposta = cliente.post('/api/calcular_rota', json=consulta).get_json()
+        try:
+            esperado = nx.dijkstra_path_length(referencia, origem, destino, weight='peso')
+        except nx.NetworkXNoPath:
+            esperado = None
+        obtido = resposta.get('tempo_s') if resposta.get('sucesso') else None
+        if (esperado is None) != (obtido is None) or (esperado is not None and not _mesma_distancia(obtido, esperado)):
+            falhas.append(f'/api/calcular_rota {origem}->{destino}: {obtido} (networkx: {esperado})')
+    medicoes['endpoint_calcular_rota'] = (
+        lambda consulta: cliente.post('/api/calcular_rota', json=consulta), consultas, app.cache_rotas.limpar)
+    matriz = {'origens': [[p[0], p[1]] for p in pontos[:10]], 'modo': 'driving'}
+    medicoes['endpoint_matriz_10x10'] = (lambda corpo: cliente.post('/api/matriz', json=corpo), [matriz], None)
+    isocronas = [{'lat': c['origem_lat'], 'lng': c['origem_lng'], 'modo': 'walking', 'limites_min': [5, 10]}
+                 for c in consultas[:3]]
+    medicoes['endpoint_isocrona'] = (
+        lambda corpo: cliente.post('/api/isocrona', json=corpo), isocronas, app.cache_isocronas.limpar)
+    medidas = cronometrar(medicoes, args.repeticoes)
+    suspeitas = {bench: medicoes[bench] for bench, atual in medidas.items()
+                 if (limiar(atual, (referencias or {}).get(bench), args.limite) or float('inf')) < atual['ms']}
+    if suspeitas:
+        # Mais rodadas cobrem uma janela maior, para escapar de uma fase lenta da máquina
+        print(f"   remedindo {', '.join(suspeitas)}", file=sys.stderr)
+        for bench, atual in cronometrar(suspeitas, 2 * args.repeticoes).items():
+            if atual['ms'] < medidas[bench]['ms']:
+                medidas[bench] = atual
+    resultados.update(medidas)
+    return resultados
+
+
+def limiar(atual, referencia, limite):
+    """Tempo (ms) acima do qual a medida atual é regressão (None se não comparável)"""
+    if referencia is None or atual['dispersao_ms'] is None or referencia.get('dispersao_ms') is None:
+        return None
+    margem = max(TOLERANCIA_MS, FATOR_DISPERSAO * max(atual['dispersao_ms'], referencia['dispersao_ms']))
+    return referencia['ms'] * limite + margem
+
+
+def comparar(resultados, baseline, limite):
+    """Lista de regressões (grafo/bench, atual, baseline, limiar) acima do limiar"""
+    regressoes = []
+    for grafo, medidas in resultados.items():
+        for bench, atual in medidas.items():
+            referencia = baseline.get(grafo, {}).get(bench)
+            maximo = limiar(atual, referencia, limite)
+            if maximo is not None and atual['ms'] > maximo:
+                regressoes.append((f'{grafo}/{bench}', atual, referencia, maximo))
+    return regressoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark offline do roteamento, com conferência no networkx')
+    parser.add_argument('--grafos', default=GRAFOS_PADRAO, help=f'lista separada por vírgulas (padrão: {GRAFOS_PADRAO})')
+    parser.add_argument('--pares', type=int, default=50, help='pares origem/destino por grafo')
+    parser.add_argument('--repeticoes', type=int, default=7, help='repetições de cada medida (vale o mínimo)')
+    parser.add_argument('--limite', type=float, default=float(os.environ.get('BENCH_LIMITE', '1.3')),
+                        help='razão atual/baseline acima da qual a medida é regressão')
+    parser.add_argument('--baseline', default=BASELINE, help='arquivo do baseline')
+    parser.add_argument('--saida', default=None, help='grava os resultados em JSON')
+    parser.add_argument('--salvar-baseline', action='store_true', help='grava os resultados como novo baseline')
+    parser.add_argument('--gerar-fixture', action='store_true', help='regenera bench/marica_trecho.graphml e sai')
+    args = parser.parse_args()
+
+    if args.gerar_fixture:
+        grafo = gerar_fixture_marica()
+        print(f'✅ Fixture salva em {FIXTURE_MARICA}: {len(grafo)} nós, {grafo.number_of_edges()} arestas')
+        return
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            # Entradas no formato antigo (só a mediana, sem dispersão) não são comparáveis
+            baseline = {grafo: {bench: ref for bench, ref in medidas.items() if isinstance(ref, dict)}
+                        for grafo, medidas in json.load(f).items()}
+
+    app.logger.setLevel('WARNING')
+    falhas, resultados = [], {}
+    for nome in args.grafos.split(','):
+        nome = nome.strip()
+        resultados[nome] = medir_grafo(nome, args, falhas, None if args.salvar_baseline else baseline.get(nome))
+    for grafo, medidas in resultados.items():
+        print(f'\n{grafo}')
+        for bench, atual in medidas.items():
+            referencia = baseline.get(grafo, {}).get(bench)
+            comparacao = f"{atual['ms'] / referencia['ms']:6.2f}x" if referencia else '      -'
+            dispersao = '' if atual['dispersao_ms'] is None else f" ±{atual['dispersao_ms']:.3f}"
+            print(f"   {bench:28s} {atual['ms']:10.3f} ms {comparacao}{dispersao}")
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, indent=2)
+    if args.salvar_baseline:
+        baseline.update({grafo: {bench: {chave: None if valor is None else round(valor, 4)
+                                         for chave, valor in atual.items()}
+                                 for bench, atual in medidas.items()}
+                         for grafo, medidas in resultados.items()})
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f'\n✅ Baseline salvo em {args.baseline}')
+
+    regressoes = [] if args.salvar_baseline else comparar(resultados, baseline, args.limite)
+    for bench, atual, referencia, maximo in regressoes:
+        print(f"❌ Regressão em {bench}: {atual['ms']:.3f} ms "
+              f"(baseline {referencia['ms']:.3f} ms, limiar {maximo:.3f} ms)")
+    for falha in falhas:
+        print(f'❌ Divergência do networkx: {falha}')
+    if falhas or regressoes:
+        sys.exit(1)
+    print(f'\n✅ {sum(map(len, resultados.values()))} medidas, buscas conferidas com networkx.dijkstra_path')
+
+
+if __name__ == '__main__':
+    main()
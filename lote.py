@@ -0,0 +1,73 @@
+"""
+Roteamento em lote pela linha de comando, no mesmo pool de processos do /api/lote.
+
+Lê pares origem/destino em CSV (cabeçalho origem_lat, origem_lng, destino_lat,
+destino_lng e, opcional, id) ou NDJSON, de um arquivo ou da entrada padrão, e
+grava os resultados em NDJSON (um registro por par, na ordem de entrada, e um
+resumo no final). O progresso sai na saída de erro.
+
+Uso:
+    GRAPH_MODE=graphml python lote.py pares.csv [--saida resultados.ndjson] [--modo walking]
+                                      [--estrategia ch] [--cenario 7] [--processos 8]
+                                      [--geometria] [--formato-geometria polyline6] [--simplificar-zoom 14]
+"""
+import argparse
+import json
+import os
+import sys
+
+import app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Roteia pares origem/destino em lote no grafo local')
+    parser.add_argument('entrada', help="arquivo CSV/NDJSON com os pares ('-' para a entrada padrão)")
+    parser.add_argument('--saida', default='-', help="arquivo NDJSON de saída ('-' para a saída padrão)")
+    parser.add_argument('--modo', default='driving', help='driving, walking ou cycling')
+    parser.add_argument('--estrategia', default=None, help=f"{', '.join(app.ESTRATEGIAS_BUSCA)} (padrão: ROTEAMENTO_ESTRATEGIA)")
+    parser.add_argument('--cenario', default=None, help='semente do cenário de pesos (padrão: o do servidor)')
+    parser.add_argument('--processos', type=int, default=None, help='workers do pool (padrão: LOTE_PROCESSOS ou nº de CPUs)')
+    parser.add_argument('--geometria', action='store_true', help='inclui a geometria de cada rota')
+    parser.add_argument('--formato-geometria', default='json', choices=app.FORMATOS_GEOMETRIA)
+    parser.add_argument('--simplificar-zoom', type=int, default=None, help='simplifica a geometria para o zoom dado')
+    args = parser.parse_args()
+
+    try:
+        opcoes = app.opcoes_lote({
+            'modo': args.modo, 'estrategia': args.estrategia, 'cenario': args.cenario,
+            'geometria': args.geometria, 'formato_geometria': args.formato_geometria,
+            'simplificar_zoom': args.simplificar_zoom
+        })
+    except ValueError as e:
+        parser.error(str(e))
+
+    os.environ.setdefault('GRAPH_MODE', 'graphml')
+    if not app.inicializar_sistema() or app.motor_roteamento is None:
+        sys.exit('❌ Lote disponível apenas com grafo local (GRAPH_MODE=graphml ou osm)')
+    motor = app.motor_roteamento
+    if opcoes['cenario'] is not None:
+        motor = motor.para_cenario(*opcoes['cenario'])
+
+    processos = args.processos or (None if os.environ.get('LOTE_PROCESSOS') else os.cpu_count())
+    processador = app.ProcessadorLote(processos)
+    entrada = sys.stdin if args.entrada == '-' else open(args.entrada, encoding='utf-8', newline='')
+    saida = sys.stdout if args.saida == '-' else open(args.saida, 'w', encoding='utf-8')
+    try:
+        for registro in processador.executar(motor, app.ler_pares_lote(entrada), opcoes):
+            if registro['tipo'] == 'rota':
+                saida.write(json.dumps(registro, ensure_ascii=False) + '\n')
+                continue
+            print(f"   {registro['processados']} pares ({registro['falhas']} falhas), "
+                  f"{registro['pares_por_s']} pares/s em {registro['decorrido_s']}s", file=sys.stderr)
+            if registro['tipo'] == 'resumo':
+                saida.write(json.dumps(registro, ensure_ascii=False) + '\n')
+    finally:
+        processador.encerrar()
+        if entrada is not sys.stdin:
+            entrada.close()
+        if saida is not sys.stdout:
+            saida.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Pré-processamento offline do grafo de Maricá.
+
+Gera, a partir do graphml configurado (GRAPHML_FILE):
+
+- o snapshot binário do grafo compilado (ex.: data/marica_drive.snap), que o
+  servidor mapeia em memória na inicialização em vez de ler o XML e projetar;
+  guarda os pesos base, válidos para qualquer cenário de randomização;
+- a Contraction Hierarchy (ex.: data/marica_drive.ch), carregada quando a
+  assinatura corresponde ao cenário padrão do servidor.
+
+A CH e os marcos ALT do snapshot (quando ALT_MARCOS > 0) são calculados sobre
+PESO_PREPROCESSAMENTO (padrão 'tempo_driving', o peso das rotas de carro da API;
+ou 'length', ou o tempo de outro modo) e só valem para o mesmo peso e a mesma
+RANDOMIZAR_SEMENTE/RANDOMIZAR_ARESTAS_PROP do servidor.
+
+Uso:
+    RANDOMIZAR_SEMENTE=42 python preprocessar.py [--graphml arquivo] [--saida arquivo.ch]
+                                                 [--snapshot arquivo.snap] [--sem-ch] [--sem-snapshot]
+"""
+import argparse
+import os
+import time
+
+import osmnx as ox
+
+import app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pré-processa o snapshot e a Contraction Hierarchy do grafo')
+    parser.add_argument('--graphml', default=app.arquivo_graphml(), help='graphml de entrada')
+    parser.add_argument('--saida', default=None, help='arquivo da hierarquia (padrão: ao lado do graphml)')
+    parser.add_argument('--snapshot', default=None, help='arquivo do snapshot (padrão: GRAPH_SNAPSHOT ou ao lado do graphml)')
+    parser.add_argument('--sem-ch', action='store_true', help='não gera a Contraction Hierarchy')
+    parser.add_argument('--sem-snapshot', action='store_true', help='não gera o snapshot binário')
+    args = parser.parse_args()
+
+    if not os.environ.get('RANDOMIZAR_SEMENTE'):
+        print("⚠️ RANDOMIZAR_SEMENTE não definida: CH e ALT só servirão para esta randomização")
+
+    inicio = time.time()
+    grafo = ox.load_graphml(args.graphml)
+    grafo_proj = ox.project_graph(grafo)
+    motor = app.compilar_motor(grafo, grafo_proj)
+    print(f"📍 Grafo compilado: {motor.total_nos} nós, {motor.total_arestas} arestas ({time.time() - inicio:.1f}s)")
+
+    if not args.sem_snapshot:
+        inicio = time.time()
+        if app.ALT_MARCOS > 0:
+            motor.alt = app.MarcosALT.construir(motor, peso=app.PESO_PREPROCESSAMENTO, quantidade=app.ALT_MARCOS)
+        saida = args.snapshot or app.caminho_snapshot(args.graphml)
+        app.SnapshotGrafo.salvar(motor, saida, origem=app.origem_snapshot(args.graphml))
+        print(f"✅ Snapshot salvo em {saida}: {os.path.getsize(saida) / 1e6:.1f} MB ({time.time() - inicio:.1f}s)")
+
+    if not args.sem_ch:
+        def progresso(contraidos, total, arestas):
+            print(f"   {contraidos}/{total} nós contraídos, {arestas} arestas na hierarquia")
+
+        inicio = time.time()
+        hierarquia = app.HierarquiaContracao.construir(motor, peso=app.PESO_PREPROCESSAMENTO, progresso=progresso)
+        saida = args.saida or app.caminho_hierarquia(args.graphml)
+        hierarquia.salvar(saida)
+        print(f"✅ Hierarquia salva em {saida}: {hierarquia.total_atalhos} atalhos ({time.time() - inicio:.1f}s)")
+
+
+if __name__ == '__main__':
+    main()
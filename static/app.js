@@ -346,6 +346,7 @@ function calcularRotaSelecionada() {
             destino_lat: destinoCoords.lat,
             destino_lng: destinoCoords.lng,
             modo: modoTransporte,
+            formato_geometria: 'polyline6',
             paradas: paradas.map(p => ({ lat: p.lat, lng: p.lng }))
         })
     })
@@ -353,6 +354,10 @@ function calcularRotaSelecionada() {
     .then(data => {
         document.getElementById('loadingDiv').style.display = 'none';
         
+        if (data.sucesso && typeof data.caminho === 'string') {
+            data.caminho = decodificarPolyline(data.caminho, data.precisao || 6);
+        }
+        
         console.log('Dados recebidos do servidor:', data);
         console.log('Caminho:', data.caminho);
         console.log('Primeiras coordenadas:', data.caminho ? data.caminho.slice(0, 5) : 'Sem caminho');
@@ -373,6 +378,29 @@ function calcularRotaSelecionada() {
     });
 }
 
+// Decodifica uma encoded polyline (formato do Google) em [[lat, lng], ...]
+function decodificarPolyline(texto, precisao) {
+    const fator = Math.pow(10, precisao);
+    const coords = [];
+    let indice = 0, lat = 0, lng = 0;
+    while (indice < texto.length) {
+        const deltas = [0, 0];
+        for (let k = 0; k < 2; k++) {
+            let resultado = 0, deslocamento = 0, byte;
+            do {
+                byte = texto.charCodeAt(indice++) - 63;
+                resultado += (byte & 0x1f) * Math.pow(2, deslocamento);
+                deslocamento += 5;
+            } while (byte >= 0x20);
+            deltas[k] = (resultado % 2) ? -(resultado + 1) / 2 : resultado / 2;
+        }
+        lat += deltas[0];
+        lng += deltas[1];
+        coords.push([lat / fator, lng / fator]);
+    }
+    return coords;
+}
+
 // Função para exibir rota no mapa
 function exibirRota(dados) {
     console.log('=== exibirRota ===');
@@ -539,7 +567,7 @@ function exibirComparacaoRotas() {
         if (rotasCalculadas[modo]) {
             const rota = rotasCalculadas[modo];
             const distanciaKm = (rota.distancia / 1000).toFixed(1);
-            const tempoEstimado = calcularTempoEstimado(distanciaKm, modo);
+            const tempoEstimado = calcularTempoEstimado(distanciaKm, modo, rota.tempo_s);
             
             const card = document.createElement('div');
             card.className = `route-card ${modoTransporte === modo ? 'active' : ''}`;
@@ -566,17 +594,22 @@ function exibirComparacaoRotas() {
     });
 }
 
-// Função para calcular tempo estimado
-function calcularTempoEstimado(distanciaKm, modo) {
+// Função para calcular tempo estimado (usa o tempo do perfil do modo calculado no servidor, se houver)
+function calcularTempoEstimado(distanciaKm, modo, tempoSegundos) {
     const velocidades = {
         driving: 30,    // km/h médio em cidade
         walking: 5,     // km/h médio caminhando
         cycling: 15     // km/h médio bicicleta
     };
     
-    const velocidade = velocidades[modo] || 30;
-    const tempoHoras = distanciaKm / velocidade;
-    const tempoMinutos = Math.round(tempoHoras * 60);
+    let tempoMinutos;
+    if (typeof tempoSegundos === 'number' && tempoSegundos > 0) {
+        tempoMinutos = Math.round(tempoSegundos / 60);
+    } else {
+        const velocidade = velocidades[modo] || 30;
+        const tempoHoras = distanciaKm / velocidade;
+        tempoMinutos = Math.round(tempoHoras * 60);
+    }
     
     if (tempoMinutos < 60) {
         return `${tempoMinutos} min`;
@@ -1233,6 +1266,13 @@ function carregarImagemGrafo(){
     if (paradas && paradas.length) {
         body.paradas = paradas.map(p => [p.lat, p.lng]);
     }
+    body.modo = modoTransporte;
+    // Rota já calculada: o servidor só desenha (sem novo snapping nem busca)
+    const rotaAtual = rotasCalculadas[modoTransporte];
+    if (rotaAtual && Array.isArray(rotaAtual.caminho) && rotaAtual.caminho.length) {
+        body.caminho = rotaAtual.caminho;
+        body.distancia = rotaAtual.distancia;
+    }
     fetch('/api/grafo_visual', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
@@ -0,0 +1,429 @@
+"""
+Teste de carga ponta a ponta.
+
+Sobe o app com o startCommand e as envVars do render.yaml (gunicorn, 1 worker,
+4 threads), apontando OSRM_URL e NOMINATIM_URL para servidores substitutos
+locais com latência e falhas injetáveis, e reproduz uma mistura de
+/api/buscar_endereco, /api/calcular_rota, /api/desvio_parada e
+/api/grafo_visual. Ao final informa, por endpoint, p50/p95/p99, máximo,
+vazão e falhas, além do que os substitutos injetaram.
+
+Sem --taxa a carga é de malha fechada (--usuarios clientes em laço); com --taxa
+as chegadas seguem um processo de Poisson e a latência conta a partir do
+instante agendado, incluindo a fila do lado do cliente (sem omissão coordenada).
+
+Uso:
+    python teste_carga.py [--usuarios 16] [--duracao 60] [--taxa 20] [--aquecimento 5]
+                          [--graphml bench/marica_trecho.graphml] [--url http://127.0.0.1:5000]
+                          [--osrm-latencia-ms 80] [--osrm-lentas 0.02] [--osrm-lenta-s 12] [--osrm-falhas 0.01]
+                          [--nominatim-latencia-ms 150] [--nominatim-lentas 0.02] [--nominatim-lenta-s 5]
+                          [--nominatim-falhas 0.01] [--mix calcular_rota=40,buscar_endereco=30,...]
+                          [--env CHAVE=VALOR ...] [--saida relatorio.json]
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RENDER_YAML = os.path.join(BASE_DIR, 'render.yaml')
+GRAPHML_PADRAO = os.path.join(BASE_DIR, 'bench', 'marica_trecho.graphml')
+MIX_PADRAO = 'calcular_rota=40,buscar_endereco=30,desvio_parada=15,grafo_visual=15'
+VELOCIDADES_MS = {'driving': 30 / 3.6, 'walking': 5 / 3.6, 'cycling': 15 / 3.6}
+RUAS = ['Rua 1', 'Rua 7', 'Travessa 3', 'Via do traçado', 'Avenida Roberto Silveira',
+        'Rua Abreu Rangel', 'Centro', 'Itaipuaçu', 'Ponta Negra']
+
+
+def distancia_m(a, b):
+    """Distância (m) entre (lat, lng) pela fórmula de haversine"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * 6371009 * math.asin(math.sqrt(min(1.0, h)))
+
+
+class Injecao:
+    """Latência base (com variação), fração de respostas lentas e fração de falhas (HTTP 503)"""
+    def __init__(self, latencia_ms, lentas, lenta_s, falhas):
+        self.latencia_ms = latencia_ms
+        self.lentas = lentas
+        self.lenta_s = lenta_s
+        self.falhas = falhas
+        self._lock = threading.Lock()
+        self.contagem = {'chamadas': 0, 'lentas': 0, 'falhas': 0}
+
+    def aplicar(self):
+        """Espera a latência sorteada; retorna True se a resposta deve falhar"""
+        lenta = random.random() < self.lentas
+        falha = random.random() < self.falhas
+        with self._lock:
+            self.contagem['chamadas'] += 1
+            self.contagem['lentas'] += lenta
+            self.contagem['falhas'] += falha
+        time.sleep(self.lenta_s if lenta else self.latencia_ms / 1000 * random.uniform(0.5, 1.5))
+        return falha
+
+
+class _Substituto(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    injecao = None
+
+    def log_message(self, formato, *args):
+        pass
+
+    def _responder(self, status, corpo):
+        dados = json.dumps(corpo).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(dados)))
+        self.end_headers()
+        try:
+            self.wfile.write(dados)
+        except (BrokenPipeError, ConnectionResetError):
+            # O app desistiu antes (timeout do cliente dele): é o cenário que a injeção provoca
+            pass
+
+    def do_GET(self):
+        if self.injecao.aplicar():
+            self._responder(503, {'code': 'Unavailable', 'message': 'falha injetada'})
+            return
+        url = urlsplit(self.path)
+        self.responder(url.path, {k: v[0] for k, v in parse_qs(url.query).items()})
+
+
+class SubstitutoOSRM(_Substituto):
+    """/route/v1/{profile}/{lng,lat;...}: linhas retas entre os waypoints, com distância e duração plausíveis"""
+    def responder(self, caminho, parametros):
+        partes = caminho.strip('/').split('/')
+        try:
+            if partes[:2] != ['route', 'v1'] or len(partes) != 4 or partes[2] not in VELOCIDADES_MS:
+                raise ValueError
+            waypoints = [tuple(map(float, wp.split(',')))[::-1] for wp in partes[3].split(';')]
+            if len(waypoints) < 2:
+                raise ValueError
+        except ValueError:
+            self._responder(400, {'code': 'InvalidUrl', 'message': 'URL inválida'})
+            return
+        coordenadas, pernas, total = [], [], 0.0
+        for a, b in zip(waypoints, waypoints[1:]):
+            distancia = distancia_m(a, b) * 1.3
+            total += distancia
+            coordenadas.extend([a[1] + (b[1] - a[1]) * k / 10, a[0] + (b[0] - a[0]) * k / 10] for k in range(10))
+            passos = []
+            if parametros.get('steps') == 'true':
+                passos = [{'maneuver': {'type': 'depart'}, 'name': 'Rua Substituta', 'distance': distancia, 'duration': 0},
+                          {'maneuver': {'type': 'arrive'}, 'name': '', 'distance': 0, 'duration': 0}]
+            pernas.append({'distance': distancia, 'duration': distancia / VELOCIDADES_MS[partes[2]], 'steps': passos})
+        coordenadas.append([waypoints[-1][1], waypoints[-1][0]])
+        self._responder(200, {
+            'code': 'Ok',
+            'routes': [{'distance': total, 'duration': total / VELOCIDADES_MS[partes[2]], 'legs': pernas,
+                        'geometry': {'type': 'LineString', 'coordinates': coordenadas}}],
+            'waypoints': [{'location': [lng, lat]} for lat, lng in waypoints]
+        })
+
+
+class SubstitutoNominatim(_Substituto):
+    """/search e /reverse em JSON; a posição de cada busca é derivada (estável) do texto"""
+    def responder(self, caminho, parametros):
+        if caminho.rstrip('/').endswith('/search'):
+            consulta = parametros.get('q', '')
+            if 'inexistente' in consulta.lower():
+                self._responder(200, [])
+                return
+            h = hashlib.sha1(consulta.encode('utf-8')).digest()
+            lat = -22.95 + h[0] / 255 * 0.06
+            lng = -42.85 + h[1] / 255 * 0.08
+            self._responder(200, [{'place_id': int.from_bytes(h[:4], 'little'), 'lat': f'{lat:.7f}', 'lon': f'{lng:.7f}',
+                                   'display_name': f'{consulta} (substituto)', 'type': 'road', 'importance': 0.5}])
+        elif caminho.rstrip('/').endswith('/reverse'):
+            lat, lng = parametros.get('lat', '0'), parametros.get('lon', '0')
+            self._responder(200, {'place_id': 1, 'lat': lat, 'lon': lng, 'display_name': 'Rua Substituta, Maricá, RJ, Brasil',
+                                  'address': {'road': 'Rua Substituta', 'city': 'Maricá', 'state': 'Rio de Janeiro'}})
+        else:
+            self._responder(404, {'error': 'não encontrado'})
+
+
+def iniciar_substituto(classe, injecao):
+    """Servidor substituto numa porta livre, em segundo plano; retorna (servidor, url)"""
+    handler = type(classe.__name__, (classe,), {'injecao': injecao})
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f'http://127.0.0.1:{servidor.server_address[1]}'
+
+
+def ler_render(caminho=RENDER_YAML):
+    """(startCommand, envVars) do render.yaml (só o necessário, sem depender de um parser YAML)"""
+    with open(caminho, encoding='utf-8') as f:
+        texto = f.read()
+    comando = re.search(r'^\s*startCommand:\s*(.+)$', texto, re.MULTILINE).group(1).strip()
+    variaveis = dict(re.findall(r'-\s*key:\s*(\S+)\s*\n\s*value:\s*(.*)', texto))
+    return comando, {chave: valor.strip().strip('"\'') for chave, valor in variaveis.items()}
+
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def iniciar_app(args, url_osrm, url_nominatim, pasta):
+    """Sobe o app como no render.yaml e espera o grafo carregar; retorna (processo, url, log)"""
+    comando, variaveis = ler_render()
+    porta = porta_livre()
+    ambiente = dict(os.environ, **variaveis)
+    ambiente.update(PORT=str(porta), OSRM_URL=url_osrm, NOMINATIM_URL=url_nominatim,
+                    GEOCODE_CACHE_FILE=os.path.join(pasta, 'geocode_cache.sqlite'),
+                    GRAPHML_FILE=args.graphml)
+    ambiente.update(item.split('=', 1) for item in args.env)
+    partes = shlex.split(comando.replace('$PORT', str(porta)))
+    if partes[0] == 'gunicorn':
+        partes = [sys.executable, '-m', 'gunicorn'] + partes[1:]
+    log = os.path.join(pasta, 'app.log')
+    processo = subprocess.Popen(partes, cwd=BASE_DIR, env=ambiente, stdout=open(log, 'wb'), stderr=subprocess.STDOUT)
+    url = f'http://127.0.0.1:{porta}'
+    print(f'🚀 {" ".join(partes[1:] if partes[0] == sys.executable else partes)} (log em {log})', file=sys.stderr)
+    limite = time.time() + args.timeout_inicio
+    while time.time() < limite:
+        if processo.poll() is not None:
+            raise RuntimeError(f'O app terminou na inicialização (veja {log})')
+        try:
+            estado = requests.get(f'{url}/health', timeout=2).json()
+        except requests.RequestException:
+            time.sleep(0.5)
+            continue
+        carga = estado.get('carga') or {}
+        if carga.get('estado') in ('pronto', 'osrm'):
+            return processo, url, log
+        if carga.get('estado') == 'erro':
+            raise RuntimeError(f"Falha ao carregar o grafo: {carga.get('erro')}")
+        if not carga.get('em_andamento'):
+            requests.post(f'{url}/api/init_graph', json={}, timeout=5)
+        time.sleep(0.5)
+    raise RuntimeError(f'O app não ficou pronto em {args.timeout_inicio:.0f}s (veja {log})')
+
+
+class Mistura:
+    """Gera as requisições da mistura de endpoints, com pontos em torno do traçado de Maricá"""
+    def __init__(self, pesos, semente=None):
+        self.endpoints = list(pesos)
+        self.pesos = [pesos[e] for e in self.endpoints]
+        self.rnd = random.Random(semente)
+        self._lock = threading.Lock()
+        with open(os.path.join(BASE_DIR, 'rota_driving_coords.json'), encoding='utf-8') as f:
+            self.tracado = json.load(f)['coordenadas']
+
+    def _ponto(self):
+        lat, lng = self.rnd.choice(self.tracado)
+        return [round(lat + self.rnd.uniform(-0.003, 0.003), 6), round(lng + self.rnd.uniform(-0.003, 0.003), 6)]
+
+    def proxima(self):
+        """(endpoint, caminho, corpo JSON)"""
+        with self._lock:
+            endpoint = self.rnd.choices(self.endpoints, self.pesos)[0]
+            origem, destino = self._ponto(), self._ponto()
+            modo = self.rnd.choice(list(VELOCIDADES_MS))
+            if endpoint == 'buscar_endereco':
+                sorteio = self.rnd.random()
+                if sorteio < 0.5:
+                    consulta = self.rnd.choice(RUAS)
+                elif sorteio < 0.7:
+                    consulta = f'{origem[0]}, {origem[1]}'
+                else:
+                    # Consultas inéditas passam pelo cache e chegam ao Nominatim
+                    consulta = f"{self.rnd.choice(['Praça', 'Rua Inexistente', 'Condomínio'])} {self.rnd.randrange(10 ** 6)}"
+                return endpoint, '/api/buscar_endereco', {'query': consulta}
+            if endpoint == 'desvio_parada':
+                return endpoint, '/api/desvio_parada', {'profile': modo, 'base': [origem, destino], 'candidate': self._ponto()}
+            corpo = {'origem_lat': origem[0], 'origem_lng': origem[1], 'destino_lat': destino[0],
+                     'destino_lng': destino[1], 'modo': modo}
+            if endpoint == 'calcular_rota':
+                if self.rnd.random() < 0.3:
+                    parada = self._ponto()
+                    corpo['paradas'] = [{'lat': parada[0], 'lng': parada[1]}]
+                return endpoint, '/api/calcular_rota', corpo
+            return endpoint, '/api/grafo_visual', corpo
+
+
+class Registro:
+    """Latências e resultados por endpoint (thread-safe)"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.amostras = {}
+
+    def anotar(self, endpoint, latencia_s, resultado):
+        with self._lock:
+            self.amostras.setdefault(endpoint, []).append((latencia_s, resultado))
+
+    def relatorio(self, duracao_s):
+        def percentil(ordenadas, p):
+            return ordenadas[max(0, math.ceil(p / 100 * len(ordenadas)) - 1)] * 1000
+
+        with self._lock:
+            amostras = {e: list(v) for e, v in self.amostras.items()}
+        amostras['total'] = [a for v in amostras.values() for a in v]
+        relatorio = {}
+        for endpoint, lista in amostras.items():
+            if not lista:
+                continue
+            latencias = sorted(l for l, _ in lista)
+            contagem = {'ok': 0, 'falha_app': 0, 'erro_http': 0}
+            for _, resultado in lista:
+                contagem[resultado] += 1
+            relatorio[endpoint] = dict(contagem, requisicoes=len(lista), vazao_rps=round(len(lista) / duracao_s, 2),
+                                       p50_ms=round(percentil(latencias, 50), 1), p95_ms=round(percentil(latencias, 95), 1),
+                                       p99_ms=round(percentil(latencias, 99), 1), max_ms=round(latencias[-1] * 1000, 1))
+        return relatorio
+
+
+_sessoes = threading.local()
+
+def enviar(url, caminho, corpo, timeout_s):
+    """Envia a requisição; retorna 'ok', 'falha_app' (HTTP 200 com sucesso falso) ou 'erro_http'"""
+    sessao = getattr(_sessoes, 'sessao', None)
+    if sessao is None:
+        sessao = _sessoes.sessao = requests.Session()
+    try:
+        resposta = sessao.post(url + caminho, json=corpo, timeout=timeout_s)
+    except requests.RequestException:
+        return 'erro_http'
+    if resposta.status_code != 200:
+        return 'erro_http'
+    if resposta.headers.get('Content-Type', '').startswith('application/json'):
+        try:
+            dados = resposta.json()
+        except ValueError:
+            return 'erro_http'
+        return 'ok' if isinstance(dados, dict) and dados.get('sucesso') else 'falha_app'
+    return 'ok'
+
+
+def executar_carga(url, mistura, args):
+    """Roda aquecimento + duração; só as requisições iniciadas depois do aquecimento entram no registro"""
+    registro = Registro()
+    inicio = time.perf_counter()
+    medir_de = inicio + args.aquecimento
+    fim = medir_de + args.duracao
+
+    def uma(agendada=None):
+        endpoint, caminho, corpo = mistura.proxima()
+        partida = agendada if agendada is not None else time.perf_counter()
+        resultado = enviar(url, caminho, corpo, args.timeout_s)
+        if partida >= medir_de:
+            registro.anotar(endpoint, time.perf_counter() - partida, resultado)
+
+    if args.taxa:
+        # Malha aberta: chegadas de Poisson, latência desde o instante agendado
+        with ThreadPoolExecutor(max_workers=args.usuarios) as executor:
+            agendada = inicio
+            while agendada < fim:
+                agendada += random.expovariate(args.taxa)
+                espera = agendada - time.perf_counter()
+                if espera > 0:
+                    time.sleep(espera)
+                executor.submit(uma, agendada)
+    else:
+        def usuario():
+            while time.perf_counter() < fim:
+                uma()
+                if args.pausa_ms:
+                    time.sleep(args.pausa_ms / 1000 * random.uniform(0.5, 1.5))
+
+        threads = [threading.Thread(target=usuario, daemon=True) for _ in range(args.usuarios)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    return registro.relatorio(args.duracao)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Teste de carga do app com OSRM e Nominatim substitutos')
+    parser.add_argument('--usuarios', type=int, default=16, help='clientes simultâneos (ou threads do gerador com --taxa)')
+    parser.add_argument('--duracao', type=float, default=60.0, help='segundos medidos')
+    parser.add_argument('--aquecimento', type=float, default=5.0, help='segundos iniciais descartados')
+    parser.add_argument('--taxa', type=float, default=None, help='requisições/s em malha aberta (Poisson)')
+    parser.add_argument('--pausa-ms', type=float, default=0.0, help='pausa entre requisições de cada cliente')
+    parser.add_argument('--timeout-s', type=float, default=130.0, help='timeout de cada requisição no cliente')
+    parser.add_argument('--timeout-inicio', type=float, default=300.0, help='espera máxima pelo app pronto')
+    parser.add_argument('--graphml', default=GRAPHML_PADRAO, help='graphml do app (padrão: fixture do benchmark)')
+    parser.add_argument('--url', default=None, help='usa um app já em execução em vez de subir o gunicorn')
+    parser.add_argument('--mix', default=MIX_PADRAO, help=f'pesos dos endpoints (padrão: {MIX_PADRAO})')
+    parser.add_argument('--env', action='append', default=[], help='CHAVE=VALOR extra para o app (repetível)')
+    parser.add_argument('--semente', type=int, default=None, help='semente da mistura de requisições')
+    parser.add_argument('--saida', default=None, help='grava o relatório em JSON')
+    for servico, latencia, lenta in (('osrm', 80.0, 12.0), ('nominatim', 150.0, 5.0)):
+        parser.add_argument(f'--{servico}-latencia-ms', type=float, default=latencia, help='latência típica')
+        parser.add_argument(f'--{servico}-lentas', type=float, default=0.02, help='fração de respostas lentas')
+        parser.add_argument(f'--{servico}-lenta-s', type=float, default=lenta, help='duração das respostas lentas')
+        parser.add_argument(f'--{servico}-falhas', type=float, default=0.01, help='fração de respostas 503')
+    args = parser.parse_args()
+
+    pesos = {}
+    for item in args.mix.split(','):
+        endpoint, _, peso = item.partition('=')
+        pesos[endpoint.strip()] = float(peso or 1)
+    mistura = Mistura(pesos, args.semente)
+    injecoes = {
+        'osrm': Injecao(args.osrm_latencia_ms, args.osrm_lentas, args.osrm_lenta_s, args.osrm_falhas),
+        'nominatim': Injecao(args.nominatim_latencia_ms, args.nominatim_lentas, args.nominatim_lenta_s, args.nominatim_falhas)
+    }
+    servidor_osrm, url_osrm = iniciar_substituto(SubstitutoOSRM, injecoes['osrm'])
+    servidor_nominatim, url_nominatim = iniciar_substituto(SubstitutoNominatim, injecoes['nominatim'])
+    print(f'🛰️ OSRM substituto em {url_osrm}, Nominatim substituto em {url_nominatim}', file=sys.stderr)
+
+    processo = None
+    with tempfile.TemporaryDirectory(prefix='rotamarcio-carga-') as pasta:
+        try:
+            if args.url:
+                url = args.url.rstrip('/')
+            else:
+                processo, url, _ = iniciar_app(args, url_osrm, url_nominatim, pasta)
+            modo = f'{args.taxa} req/s (malha aberta)' if args.taxa else f'{args.usuarios} clientes (malha fechada)'
+            print(f'⏱️ {args.aquecimento:.0f}s de aquecimento + {args.duracao:.0f}s medidos, {modo}', file=sys.stderr)
+            relatorio = executar_carga(url, mistura, args)
+            try:
+                saude = requests.get(f'{url}/health', timeout=5).json()
+            except (requests.RequestException, ValueError):
+                saude = {}
+        finally:
+            if processo is not None:
+                processo.terminate()
+                try:
+                    processo.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    processo.kill()
+            servidor_osrm.shutdown()
+            servidor_nominatim.shutdown()
+
+    print(f"\n{'endpoint':18s} {'req':>6s} {'rps':>7s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} {'max ms':>8s} "
+          f"{'falha_app':>9s} {'erro_http':>9s}")
+    for endpoint, r in relatorio.items():
+        print(f"{endpoint:18s} {r['requisicoes']:6d} {r['vazao_rps']:7.1f} {r['p50_ms']:8.1f} {r['p95_ms']:8.1f} "
+              f"{r['p99_ms']:8.1f} {r['max_ms']:8.1f} {r['falha_app']:9d} {r['erro_http']:9d}")
+    for servico, injecao in injecoes.items():
+        print(f"   {servico}: {injecao.contagem['chamadas']} chamadas, {injecao.contagem['lentas']} lentas, "
+              f"{injecao.contagem['falhas']} falhas injetadas")
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump({'endpoints': relatorio, 'substitutos': {s: i.contagem for s, i in injecoes.items()},
+                       'osrm_app': saude.get('osrm'), 'parametros': vars(args)}, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Grafos e utilitários compartilhados pelos testes do motor de roteamento.
+
+Os grafos são os do benchmark (grade e geométrico sintéticos, gerados com
+semente fixa) e o trecho real de Maricá em bench/marica_trecho.graphml, cada
+um com uma componente isolada para exercitar destinos inalcançáveis.
+"""
+import math
+import os
+import random
+import sys
+
+import networkx as nx
+import numpy as np
+import osmnx as ox
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ not in sys.path:
+    sys.path.insert(0, RAIZ)
+
+import app  # noqa: E402
+import benchmark  # noqa: E402
+
+GRAFOS = ('grade', 'geometrico', 'marica')
+PESOS = ('length', 'tempo_driving', 'tempo_walking')
+ESTRATEGIAS = app.ESTRATEGIAS_BUSCA
+# Nós da componente isolada (ids fora da faixa dos geradores e do OSM do fixture)
+ILHA = (9_000_000_001, 9_000_000_002)
+
+
+def _com_ilha(grafo):
+    """Acrescenta dois nós ligados só entre si, a ~2 km do restante do grafo"""
+    lat = max(d['y'] for _, d in grafo.nodes(data=True)) + 0.02
+    lng = max(d['x'] for _, d in grafo.nodes(data=True))
+    for k, no in enumerate(ILHA):
+        grafo.add_node(no, y=lat, x=lng + k * 0.001, street_count=1)
+    benchmark._adicionar_via(grafo, ILHA[0], ILHA[1], random.Random(0), highway='residential', mao_unica=False)
+    return grafo
+
+
+def carregar_grafo(nome):
+    if nome == 'grade':
+        grafo = benchmark.gerar_grade(14)
+    elif nome == 'geometrico':
+        grafo = benchmark.gerar_geometrico(400)
+    else:
+        grafo = ox.load_graphml(benchmark.FIXTURE_MARICA)
+    return _com_ilha(grafo)
+
+
+def cenario_neutro(total_arestas, bloqueadas=()):
+    """Cenário sem variação de pesos (os do graphml), bloqueando só as arestas dadas"""
+    marcadas = np.zeros(total_arestas, dtype=bool)
+    marcadas[list(bloqueadas)] = True
+    return app.CenarioPesos(None, 0.0, np.ones(total_arestas, dtype=np.float32),
+                            np.packbits(marcadas, bitorder='little'))
+
+
+def compilar(grafo, cenario=None):
+    """
+    Motor como o servidor monta (sem CH nem ALT), com o cenário de testes (±20% nos
+    pesos e 5% das arestas bloqueadas) ou o 'cenario(total_arestas)' dado
+    """
+    motor = app.compilar_motor(grafo, semente='testes', proporcao=0.05)
+    if cenario is not None:
+        motor.aplicar_cenario(cenario(motor.total_arestas))
+    return motor
+
+
+def referencia_networkx(motor, peso):
+    """DiGraph com os pesos efetivos do motor: sem bloqueadas e paralelas reduzidas à de menor peso"""
+    pesos = motor.pesos(peso)
+    referencia = nx.DiGraph()
+    referencia.add_nodes_from(range(motor.total_nos))
+    for e in range(motor.total_arestas):
+        if bloqueada(motor, e) or pesos[e] == math.inf:
+            continue
+        u, v = motor.origens[e], motor.alvos[e]
+        if not referencia.has_edge(u, v) or pesos[e] < referencia[u][v]['peso']:
+            referencia.add_edge(u, v, peso=pesos[e])
+    return referencia
+
+
+def menor_caminho(referencia, origem, destino):
+    """(custo, nós) pelo networkx; (inf, None) se inalcançável"""
+    try:
+        custo, nos = nx.single_source_dijkstra(referencia, origem, destino, weight='peso')
+    except nx.NetworkXNoPath:
+        return math.inf, None
+    return custo, nos
+
+
+def bloqueada(motor, e):
+    return bool(motor.desabilitadas[e >> 3] & (1 << (e & 7)))
+
+
+def pares_aleatorios(motor, quantidade, semente=7):
+    rnd = random.Random(semente)
+    return [(rnd.randrange(motor.total_nos), rnd.randrange(motor.total_nos)) for _ in range(quantidade)]
+
+
+def nos_do_caminho(motor, origem, arestas):
+    """Nós visitados pelas arestas CSR a partir da origem; None se não encadeiam"""
+    nos = [origem]
+    for e in arestas:
+        if motor.origens[e] != nos[-1]:
+            return None
+        nos.append(motor.alvos[e])
+    return nos
+
+
+def mesmo_custo(a, b):
+    return a == b or math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9)
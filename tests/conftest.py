@@ -0,0 +1,23 @@
+import pytest
+
+import apoio
+
+
+@pytest.fixture(scope='session')
+def grafos():
+    return {nome: apoio.carregar_grafo(nome) for nome in apoio.GRAFOS}
+
+
+@pytest.fixture(scope='session')
+def motores(grafos):
+    """Motor de cada (grafo, peso) com CH e ALT construídos para o peso, montado sob demanda"""
+    cache = {}
+
+    def obter(nome, peso):
+        if (nome, peso) not in cache:
+            motor = apoio.compilar(grafos[nome])
+            motor.hierarquia = apoio.app.HierarquiaContracao.construir(motor, peso=peso)
+            motor.alt = apoio.app.MarcosALT.construir(motor, peso=peso, quantidade=6)
+            cache[nome, peso] = motor
+        return cache[nome, peso]
+    return obter
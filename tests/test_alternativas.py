@@ -0,0 +1,54 @@
+"""Rotas alternativas pelo método dos platôs: limites de estiramento e de compartilhamento"""
+import math
+
+import pytest
+
+import apoio
+from apoio import app
+
+
+@pytest.mark.parametrize('peso', ['length', 'tempo_driving'])
+@pytest.mark.parametrize('nome', apoio.GRAFOS)
+def test_alternativas_respeitam_os_limites(motores, nome, peso):
+    motor = motores(nome, peso)
+    pesos = motor.pesos(peso)
+    encontradas = 0
+    for origem, destino in apoio.pares_aleatorios(motor, 30, semente=5):
+        otimo, arestas_otimas, _ = motor.buscar(origem, destino, peso, 'ch')
+        # Com e sem o custo ótimo do chamador o resultado é o mesmo
+        rotas, custo_otimo, _ = motor.rotas_alternativas(origem, destino, peso, 3, 'ch', otimo)
+        assert rotas == motor.rotas_alternativas(origem, destino, peso, 3, 'ch')[0]
+        if otimo == math.inf or otimo == 0:
+            assert rotas == []
+            continue
+        assert apoio.mesmo_custo(custo_otimo, otimo)
+        assert len(rotas) <= 3
+        assert [custo for custo, _, _ in rotas] == sorted(custo for custo, _, _ in rotas)
+        otimas = set(arestas_otimas)
+        conjuntos = []
+        for custo, arestas, compartilhado in rotas:
+            nos = apoio.nos_do_caminho(motor, origem, arestas)
+            assert nos is not None and nos[-1] == destino
+            assert len(set(nos)) == len(nos), 'caminho com ciclo'
+            assert not any(apoio.bloqueada(motor, e) for e in arestas)
+            assert apoio.mesmo_custo(sum(pesos[e] for e in arestas), custo)
+            assert otimo * (1 - 1e-9) <= custo <= (1 + app.ALTERNATIVAS_ESTIRAMENTO) * otimo * (1 + 1e-9)
+            assert arestas != arestas_otimas
+            assert apoio.mesmo_custo(compartilhado, sum(pesos[e] for e in arestas if e in otimas))
+            assert compartilhado <= app.ALTERNATIVAS_SOBREPOSICAO * otimo * (1 + 1e-9)
+            # Entre alternativas o compartilhamento também fica abaixo do limite
+            for outras in conjuntos:
+                comum = sum(pesos[e] for e in arestas if e in outras)
+                assert comum <= app.ALTERNATIVAS_SOBREPOSICAO * otimo * (1 + 1e-9)
+            conjuntos.append(set(arestas))
+        encontradas += len(rotas)
+    assert encontradas > 0, 'nenhuma alternativa encontrada em 30 pares'
+
+
+@pytest.mark.parametrize('nome', apoio.GRAFOS)
+def test_sem_alternativas_nos_casos_limite(motores, nome):
+    motor = motores(nome, 'tempo_driving')
+    ilha = motor.indice[apoio.ILHA[0]]
+    assert motor.rotas_alternativas(0, ilha, 'tempo_driving', 2)[0] == []
+    assert motor.rotas_alternativas(5, 5, 'tempo_driving', 2)[0] == []
+    assert motor.rotas_alternativas(0, motor.total_nos - 3, 'tempo_driving', 0)[0] == []
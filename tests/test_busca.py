@@ -0,0 +1,96 @@
+"""Estratégias de busca do GrafoCompilado conferidas com networkx e com dijkstra_customizado"""
+import math
+
+import pytest
+
+import apoio
+from apoio import app
+
+
+@pytest.mark.parametrize('peso', apoio.PESOS)
+@pytest.mark.parametrize('nome', apoio.GRAFOS)
+def test_estrategias_iguais_ao_networkx(motores, nome, peso):
+    motor = motores(nome, peso)
+    referencia = apoio.referencia_networkx(motor, peso)
+    pesos = motor.pesos(peso)
+    for origem, destino in apoio.pares_aleatorios(motor, 40):
+        esperado, nos_esperados = apoio.menor_caminho(referencia, origem, destino)
+        for estrategia in apoio.ESTRATEGIAS:
+            # O pré-processamento foi construído para este peso: nada de fallback
+            assert motor.estrategia_efetiva(estrategia, peso) == estrategia
+            custo, arestas, _ = motor.buscar(origem, destino, peso, estrategia)
+            contexto = f'{estrategia}/{peso} {origem}->{destino}'
+            assert apoio.mesmo_custo(custo, esperado), contexto
+            if esperado == math.inf:
+                assert arestas == [], contexto
+                continue
+            assert apoio.nos_do_caminho(motor, origem, arestas) == nos_esperados, contexto
+            # Entre arestas paralelas, a de menor peso; nenhuma bloqueada
+            for e in arestas:
+                assert not apoio.bloqueada(motor, e), contexto
+                assert pesos[e] == referencia[motor.origens[e]][motor.alvos[e]]['peso'], contexto
+            assert apoio.mesmo_custo(sum(pesos[e] for e in arestas), custo), contexto
+
+
+@pytest.mark.parametrize('nome', ['grade', 'geometrico'])
+def test_motor_igual_ao_dijkstra_customizado(grafos, nome):
+    # Sem variação de pesos nem bloqueios o motor usa o 'length' do graphml, como o dijkstra_customizado
+    grafo = grafos[nome]
+    motor = apoio.compilar(grafo, apoio.cenario_neutro)
+    for origem, destino in apoio.pares_aleatorios(motor, 15):
+        caminho, distancia = app.dijkstra_customizado(grafo, motor.nos[origem], motor.nos[destino])
+        custo, arestas, _ = motor.buscar(origem, destino, 'length', 'dijkstra')
+        if not caminho:
+            assert custo == math.inf and arestas == []
+            continue
+        assert apoio.mesmo_custo(custo, distancia)
+        assert [motor.nos[i] for i in apoio.nos_do_caminho(motor, origem, arestas)] == caminho
+
+
+@pytest.mark.parametrize('peso', ['length', 'tempo_driving'])
+@pytest.mark.parametrize('nome', apoio.GRAFOS)
+def test_origem_igual_ao_destino(motores, nome, peso):
+    motor = motores(nome, peso)
+    for no in (0, motor.total_nos // 2, motor.indice[apoio.ILHA[0]]):
+        for estrategia in apoio.ESTRATEGIAS:
+            custo, arestas, _ = motor.buscar(no, no, peso, estrategia)
+            assert custo == 0.0 and arestas == [], estrategia
+
+
+@pytest.mark.parametrize('peso', ['length', 'tempo_driving'])
+@pytest.mark.parametrize('nome', apoio.GRAFOS)
+def test_destino_inalcancavel(motores, nome, peso):
+    motor = motores(nome, peso)
+    ilha = motor.indice[apoio.ILHA[0]]
+    for origem, destino in ((0, ilha), (ilha, 0), (motor.total_nos // 2, ilha)):
+        for estrategia in apoio.ESTRATEGIAS:
+            custo, arestas, _ = motor.buscar(origem, destino, peso, estrategia)
+            assert custo == math.inf and arestas == [], estrategia
+    # Dentro da ilha o caminho existe
+    custo, arestas, _ = motor.buscar(ilha, motor.indice[apoio.ILHA[1]], peso, 'dijkstra')
+    assert custo < math.inf and len(arestas) == 1
+
+
+@pytest.mark.parametrize('nome', apoio.GRAFOS)
+def test_aresta_bloqueada_e_evitada(grafos, nome):
+    peso = 'tempo_driving'
+    livre = apoio.compilar(grafos[nome], apoio.cenario_neutro)
+    for origem, destino in apoio.pares_aleatorios(livre, 40):
+        custo_livre, arestas_livres, _ = livre.buscar(origem, destino, peso, 'dijkstra')
+        if custo_livre < math.inf and len(arestas_livres) >= 3:
+            break
+    else:
+        pytest.fail('nenhum par com caminho de 3+ arestas')
+    bloqueio = arestas_livres[len(arestas_livres) // 2]
+    motor = apoio.compilar(grafos[nome], lambda total: apoio.cenario_neutro(total, [bloqueio]))
+    assert apoio.bloqueada(motor, bloqueio)
+    motor.hierarquia = app.HierarquiaContracao.construir(motor, peso=peso)
+    motor.alt = app.MarcosALT.construir(motor, peso=peso, quantidade=4)
+    esperado, _ = apoio.menor_caminho(apoio.referencia_networkx(motor, peso), origem, destino)
+    assert esperado >= custo_livre
+    for estrategia in apoio.ESTRATEGIAS:
+        custo, arestas, _ = motor.buscar(origem, destino, peso, estrategia)
+        assert apoio.mesmo_custo(custo, esperado), estrategia
+        assert bloqueio not in arestas, estrategia
+        if custo < math.inf:
+            assert apoio.nos_do_caminho(motor, origem, arestas)[-1] == destino, estrategia
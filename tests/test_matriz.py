@@ -0,0 +1,66 @@
+"""Matrizes de tempo e distância do /api/matriz e desvios de inserção do /api/desvios_parada"""
+import math
+import random
+
+import networkx as nx
+import pytest
+
+import apoio
+from apoio import app
+
+
+@pytest.mark.parametrize('nome', apoio.GRAFOS)
+def test_distancias_sao_dos_caminhos_dos_tempos(motores, nome):
+    peso = 'tempo_walking'
+    motor = motores(nome, peso)
+    pontos = [no for par in apoio.pares_aleatorios(motor, 8, semente=13) for no in par]
+    pontos.append(motor.indice[apoio.ILHA[0]])
+    for origens, destinos, metodo_esperado in ((pontos[:6], pontos[6:], 'arvores'),
+                                               (pontos[6:], pontos[:6], 'arvores-reversas')):
+        tempos_ch, metodo_ch = app.matriz_distancias(motor, origens, destinos, peso)
+        assert metodo_ch == 'ch-baldes'
+        tempos, distancias, metodo = app.matriz_arvores(motor, origens, destinos, peso, somar='length')
+        assert metodo == metodo_esperado
+        for i, origem in enumerate(origens):
+            for j, destino in enumerate(destinos):
+                custo, arestas, _ = motor.buscar(origem, destino, peso, 'dijkstra')
+                assert apoio.mesmo_custo(tempos[i][j], custo) and apoio.mesmo_custo(tempos_ch[i][j], custo)
+                if custo == math.inf:
+                    assert distancias[i][j] == math.inf
+                    continue
+                # A distância é a do caminho de menor tempo a pé, não a menor distância por qualquer via
+                assert distancias[i][j] == pytest.approx(motor.comprimento(arestas), rel=1e-9)
+
+
+@pytest.mark.parametrize('nome', apoio.GRAFOS)
+def test_desvio_de_tempo_e_distancia_na_mesma_perna(motores, nome):
+    peso = 'tempo_walking'
+    motor = motores(nome, peso)
+    # Base e candidatos na maior componente fortemente conexa a pé, mais um candidato na ilha
+    componente = max(nx.strongly_connected_components(apoio.referencia_networkx(motor, peso)), key=len)
+    nos = random.Random(17).sample(sorted(componente), 13)
+    base, candidatos = nos[:4], nos[4:] + [motor.indice[apoio.ILHA[0]]]
+    desvios, tempo_base, distancia_base, _ = app.desvios_insercao(motor, base, candidatos, peso)
+
+    def trecho(origem, destino):
+        custo, arestas, _ = motor.buscar(origem, destino, peso, 'dijkstra')
+        return custo, motor.comprimento(arestas) if custo < math.inf else math.inf
+
+    pernas = [trecho(a, b) for a, b in zip(base, base[1:])]
+    assert apoio.mesmo_custo(tempo_base, sum(t for t, _ in pernas))
+    assert distancia_base == pytest.approx(sum(d for _, d in pernas), rel=1e-9)
+    assert all(desvio < math.inf for desvio, _, _ in desvios[:-1]) and desvios[-1][0] == math.inf
+    for candidato, (desvio_tempo, perna, desvio_distancia) in zip(candidatos, desvios):
+        # Força bruta: a perna de menor acréscimo de tempo e a distância desses mesmos caminhos
+        opcoes = []
+        for i, (a, b) in enumerate(zip(base, base[1:])):
+            (t1, d1), (t2, d2) = trecho(a, candidato), trecho(candidato, b)
+            if max(t1, t2, pernas[i][0]) < math.inf:
+                opcoes.append((t1 + t2 - pernas[i][0], i, d1 + d2 - pernas[i][1]))
+        if not opcoes:
+            assert desvio_tempo == math.inf
+            continue
+        esperado = min(opcoes)
+        assert perna == esperado[1]
+        assert desvio_tempo == pytest.approx(esperado[0], rel=1e-9, abs=1e-6)
+        assert desvio_distancia == pytest.approx(esperado[2], rel=1e-9, abs=1e-6)
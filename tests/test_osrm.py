@@ -0,0 +1,125 @@
+"""ClienteOSRM contra o substituto local do teste de carga"""
+import socket
+import threading
+
+import pytest
+
+import apoio  # noqa: F401  (coloca a raiz do repositório no sys.path)
+from apoio import app
+import teste_carga
+
+WAYPOINTS = [(-22.9190, -42.8180), (-22.9305, -42.7990)]
+
+
+class SubstitutoPortas(teste_carga.SubstitutoOSRM):
+    """Substituto que anota a porta de origem de cada requisição (uma por conexão TCP)"""
+    portas = None
+
+    def do_GET(self):
+        self.portas.append(self.client_address[1])
+        super().do_GET()
+
+
+@pytest.fixture
+def substituto():
+    """Sobe um substituto com a injeção pedida; retorna (url, injecao, portas)"""
+    servidores = []
+
+    def iniciar(latencia_ms=0, lentas=0.0, lenta_s=0.0, falhas=0.0):
+        injecao = teste_carga.Injecao(latencia_ms, lentas, lenta_s, falhas)
+        portas = []
+        classe = type('SubstitutoPortas', (SubstitutoPortas,), {'portas': portas})
+        servidor, url = teste_carga.iniciar_substituto(classe, injecao)
+        servidores.append(servidor)
+        return url, injecao, portas
+    yield iniciar
+    for servidor in servidores:
+        servidor.shutdown()
+        servidor.server_close()
+
+
+def test_sessao_reaproveita_a_conexao(substituto):
+    url, injecao, portas = substituto()
+    cliente = app.ClienteOSRM(url, timeout_s=5, conexoes=2)
+    for k in range(5):
+        resultado = cliente.rota('driving', [(WAYPOINTS[0][0] + k * 1e-3, WAYPOINTS[0][1]), WAYPOINTS[1]])
+        assert resultado['sucesso'] and 'cache' not in resultado
+    assert injecao.contagem['chamadas'] == 5
+    # Cinco chamadas distintas, em sequência, pela mesma conexão keep-alive
+    assert len(portas) == 5 and len(set(portas)) == 1
+    assert cliente.estatisticas()['chamadas'] == 5
+
+
+def test_chamada_repetida_vem_do_cache(substituto):
+    url, injecao, _ = substituto()
+    cliente = app.ClienteOSRM(url, timeout_s=5)
+    primeira = cliente.rota('driving', WAYPOINTS, include_steps=True)
+    assert primeira['sucesso'] and primeira['distance_m'] > 0 and 'cache' not in primeira
+    # Waypoints iguais após o arredondamento (~1 m) caem na mesma chave
+    quase_iguais = [(lat + 1e-7, lng - 1e-7) for lat, lng in WAYPOINTS]
+    segunda = cliente.rota('driving', quase_iguais, include_steps=True)
+    assert segunda['cache'] is True
+    assert segunda['distance_m'] == primeira['distance_m']
+    assert segunda['geometry_geojson'] == primeira['geometry_geojson']
+    assert injecao.contagem['chamadas'] == 1
+    # Outro perfil ou sem passos é outra chave
+    cliente.rota('walking', WAYPOINTS, include_steps=True)
+    cliente.rota('driving', WAYPOINTS, include_steps=False)
+    assert injecao.contagem['chamadas'] == 3
+    estatisticas = cliente.estatisticas()
+    assert estatisticas['chamadas'] == 3 and estatisticas['cache']['hits'] == 1
+
+
+def test_chamadas_simultaneas_identicas_sao_coalescidas(substituto):
+    url, injecao, _ = substituto(latencia_ms=400)
+    cliente = app.ClienteOSRM(url, timeout_s=5)
+    total = 6
+    barreira = threading.Barrier(total)
+    resultados = [None] * total
+
+    def chamar(i):
+        barreira.wait()
+        resultados[i] = cliente.rota('driving', WAYPOINTS)
+
+    threads = [threading.Thread(target=chamar, args=(i,)) for i in range(total)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+    assert injecao.contagem['chamadas'] == 1
+    assert all(r['sucesso'] and r['distance_m'] == resultados[0]['distance_m'] for r in resultados)
+    # Cada thread recebe a sua cópia do resultado
+    assert len({id(r) for r in resultados}) == total
+    estatisticas = cliente.estatisticas()
+    assert estatisticas['chamadas'] == 1 and estatisticas['coalescidas'] == total - 1
+
+
+def test_falha_do_servidor_nao_vai_para_o_cache(substituto):
+    url, injecao, _ = substituto(falhas=1.0)
+    cliente = app.ClienteOSRM(url, timeout_s=5)
+    for _ in range(2):
+        resultado = cliente.rota('driving', WAYPOINTS)
+        assert resultado['sucesso'] is False
+        assert resultado['mensagem'].startswith('Erro de rede ao chamar OSRM') and '503' in resultado['mensagem']
+    assert injecao.contagem['falhas'] == 2
+    estatisticas = cliente.estatisticas()
+    assert estatisticas['erros'] == 2 and estatisticas['cache']['hits'] == 0
+
+
+def test_timeout(substituto):
+    url, injecao, _ = substituto(lentas=1.0, lenta_s=1.0)
+    cliente = app.ClienteOSRM(url, timeout_s=0.2)
+    resultado = cliente.rota('driving', WAYPOINTS)
+    assert resultado['sucesso'] is False and 'Erro de rede' in resultado['mensagem']
+    assert injecao.contagem['lentas'] == 1
+    assert cliente.estatisticas()['erros'] == 1
+
+
+def test_servidor_fora_do_ar():
+    with socket.socket() as livre:
+        livre.bind(('127.0.0.1', 0))
+        porta = livre.getsockname()[1]
+    cliente = app.ClienteOSRM(f'http://127.0.0.1:{porta}', timeout_s=1)
+    resultado = cliente.rota('driving', WAYPOINTS)
+    assert resultado['sucesso'] is False and 'Erro de rede' in resultado['mensagem']
+    assert cliente.estatisticas()['erros'] == 1
@@ -0,0 +1,92 @@
+"""Contraction Hierarchy (desempacotamento, geometria e persistência) e limites do ALT"""
+import math
+
+import pytest
+
+import apoio
+from apoio import app
+
+
+def _geometria_esperada(grafo, motor, arestas):
+    """Pontos (lat, lng) do caminho lidos direto do graphml, sem repetir as emendas"""
+    pontos = []
+    for e in arestas:
+        u, v = motor.origens[e], motor.alvos[e]
+        dados = grafo[motor.nos[u]][motor.nos[v]][motor.chaves[e]]
+        if 'geometry' in dados:
+            trecho = [(lat, lng) for lng, lat in dados['geometry'].coords]
+        else:
+            trecho = [(motor.lat[u], motor.lng[u]), (motor.lat[v], motor.lng[v])]
+        for ponto in trecho:
+            if not pontos or max(abs(ponto[0] - pontos[-1][0]), abs(ponto[1] - pontos[-1][1])) >= 1e-6:
+                pontos.append(ponto)
+    return pontos
+
+
+@pytest.mark.parametrize('peso', ['length', 'tempo_driving'])
+@pytest.mark.parametrize('nome', apoio.GRAFOS)
+def test_ch_desempacota_arestas_originais(grafos, motores, nome, peso):
+    motor = motores(nome, peso)
+    hierarquia = motor.hierarquia
+    pesos = motor.pesos(peso)
+    for origem, destino in apoio.pares_aleatorios(motor, 40, semente=11):
+        custo, arestas, _ = hierarquia.consultar(origem, destino)
+        if custo == math.inf:
+            continue
+        # Só arestas CSR (nenhum índice de atalho), encadeadas, as mesmas do Dijkstra
+        assert all(0 <= e < motor.total_arestas for e in arestas)
+        assert apoio.nos_do_caminho(motor, origem, arestas)[-1] == destino
+        assert arestas == motor.buscar(origem, destino, peso, 'dijkstra')[1]
+        assert apoio.mesmo_custo(sum(pesos[e] for e in arestas), custo)
+        # Cada aresta é uma aresta OSM do graphml, e a geometria montada segue a dela
+        for e in arestas:
+            assert grafos[nome].has_edge(motor.nos[motor.origens[e]], motor.nos[motor.alvos[e]], motor.chaves[e])
+        montada = app.GeometriaArestas.pares(motor.geometria.montar(arestas))
+        esperada = _geometria_esperada(grafos[nome], motor, arestas)
+        assert len(montada) == len(esperada)
+        for (lat, lng), (lat_e, lng_e) in zip(montada, esperada):
+            assert lat == pytest.approx(lat_e, abs=1e-9) and lng == pytest.approx(lng_e, abs=1e-9)
+
+
+@pytest.mark.parametrize('nome', apoio.GRAFOS)
+def test_atalhos_valem_a_soma_das_arestas(motores, nome):
+    motor = motores(nome, 'tempo_driving')
+    hierarquia = motor.hierarquia
+    pesos = motor.pesos('tempo_driving')
+    atalhos = [idx for idx in range(len(hierarquia.original)) if hierarquia.original[idx] < 0]
+    assert atalhos, 'a hierarquia deveria ter atalhos'
+    for idx in atalhos:
+        arestas = hierarquia.desempacotar([idx])
+        assert apoio.nos_do_caminho(motor, hierarquia.origens[idx], arestas)[-1] == hierarquia.alvos[idx]
+        assert hierarquia.pesos[idx] == pytest.approx(sum(pesos[e] for e in arestas), rel=1e-9)
+
+
+def test_ch_salva_e_carrega(motores, tmp_path):
+    motor = motores('marica', 'tempo_driving')
+    caminho = str(tmp_path / 'marica.ch')
+    motor.hierarquia.salvar(caminho)
+    carregada = app.HierarquiaContracao.carregar(caminho)
+    assert carregada.assinatura == motor.assinatura('tempo_driving')
+    for origem, destino in apoio.pares_aleatorios(motor, 20):
+        assert carregada.consultar(origem, destino)[:2] == motor.hierarquia.consultar(origem, destino)[:2]
+
+
+@pytest.mark.parametrize('peso', apoio.PESOS)
+@pytest.mark.parametrize('nome', apoio.GRAFOS)
+def test_alt_nunca_superestima(motores, nome, peso):
+    motor = motores(nome, peso)
+    alt = motor.alt
+    assert alt.peso == peso and alt.marcos
+    for destino in [destino for _, destino in apoio.pares_aleatorios(motor, 6, semente=3)]:
+        distancias, _ = motor.arvore_caminhos(destino, peso, reverso=True)
+        for v in range(motor.total_nos):
+            # O limite inferior de cada marco, como na heurística de MarcosALT.consultar
+            limite = 0.0
+            for de, para in zip(alt.distancias_de, alt.distancias_para):
+                for x in (de[destino] - de[v], para[v] - para[destino]):
+                    if x == x and x > limite:
+                        limite = x
+            limite = limite - alt.folga if limite > alt.folga else 0.0
+            if distancias[v] == math.inf:
+                continue
+            assert limite <= distancias[v] * (1 + 1e-12), f'{v}->{destino}: {limite} > {distancias[v]}'